@@ -9,10 +9,13 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 1
+LIBPATCH = 3
 
 import dataclasses
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from functools import partial
 from uuid import uuid4
@@ -279,6 +282,34 @@ from ops.framework import BoundEvent, Handle, EventBase
 from ops.testing import Harness
 
 
+# Parsed metadata.yaml/actions.yaml and config.yaml, keyed by charm type and the yaml
+# they were parsed from, so that the many harnesses a playbook creates parse them once.
+_PARSED_META = {}  # type: Dict[Tuple[Any, ...], Tuple[Any, Any]]
+
+
+class _SharedMetaHarness(Harness):
+    """Harness which shares parsed charm metadata and config with its siblings."""
+
+    def _cached(self, key, parse):
+        if not all(part is None or isinstance(part, str) for part in key[2:]):
+            return parse()  # file-like objects can't be told apart; don't cache them
+        if key not in _PARSED_META:
+            _PARSED_META[key] = (parse(), self._charm_dir)
+        parsed, charm_dir = _PARSED_META[key]
+        if charm_dir != 'no-disk-path':
+            self._charm_dir = charm_dir
+        return parsed
+
+    def _create_meta(self, charm_metadata, action_metadata):
+        key = ('meta', self._charm_cls, charm_metadata, action_metadata)
+        return self._cached(key, partial(super()._create_meta, charm_metadata, action_metadata))
+
+    def _get_config(self, charm_config):
+        key = ('config', self._charm_cls, charm_config)
+        # the backend keeps a reference to it, so each harness gets its own copy
+        return deepcopy(self._cached(key, partial(super()._get_config, charm_config)))
+
+
 class _HasOn(Protocol):
     @property
     def on(self) -> CharmEvents:
@@ -290,13 +321,18 @@ def _DefaultEmitter(charm: CharmBase, harness: Harness):
 
 
 class Emitter:
-    """Event emitter."""
+    """Event emitter.
+
+    After the HarnessCtx exits, `duration` holds the wall time, in seconds, taken to
+    emit the event and commit the framework, i.e. what the hook cost the charm.
+    """
 
     def __init__(self, harness: Harness, emit: Callable[[], BoundEvent]):
         self.harness = harness
         self._emit = emit
         self.event = None
         self._emitted = False
+        self.duration = None  # type: Optional[float]
 
     @property
     def emitted(self):
@@ -309,7 +345,9 @@ class Emitter:
         Will get called automatically when HarnessCtx exits if you didn't call it already.
         """
         assert not self._emitted, "already emitted; should not emit twice"
+        start = time.perf_counter()
         self.event = self._emit()
+        self.duration = time.perf_counter() - start
         self._emitted = True
         return self.event
 
@@ -373,6 +411,8 @@ class HarnessCtx:
                 relation_name=obj.relation_name,
                 relation_id=obj.relation_id
             )
+        if isinstance(obj, InjectContainer):
+            return harness.model.unit.get_container(obj.container_name)
 
         return obj
 
@@ -384,8 +424,8 @@ class HarnessCtx:
         return kwargs
 
     def __enter__(self):
-        self._harness = harness = Harness(self.charm_cls,
-                                          **self.harness_kwargs)
+        self._harness = harness = _SharedMetaHarness(self.charm_cls,
+                                                     **self.harness_kwargs)
         if self.pre_begin_hook:
             logger.debug('running harness pre-begin hook')
             self.pre_begin_hook(harness)
@@ -417,7 +457,9 @@ class HarnessCtx:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if not self._emitter.emitted:
             self._emitter.emit()
+        start = time.perf_counter()
         self._harness.framework.on.commit.emit()  # type: ignore
+        self._emitter.duration += time.perf_counter() - start
 
 
 # from show-relation!
@@ -497,6 +539,15 @@ class CharmSpec:
         else:
             raise ValueError(f'cannot convert {obj} to CharmSpec')
 
+    def as_yaml(self) -> 'CharmSpec':
+        """Serialize metadata given as dicts once, rather than for every scene."""
+        def _to_yaml(obj):
+            return yaml.safe_dump(obj) if isinstance(obj, dict) else obj
+
+        return dataclasses.replace(self, meta=_to_yaml(self.meta),
+                                   actions=_to_yaml(self.actions),
+                                   config=_to_yaml(self.config))
+
 
 @dataclass
 class _Event(DCBase):
@@ -540,6 +591,9 @@ def _derive_args(event_name: str):
         if event_name.endswith(term):
             args.append(InjectRelation(relation_name=event_name[:-len(term)]))
 
+    if event_name.endswith('-pebble-ready'):
+        args.append(InjectContainer(container_name=event_name[:-len('-pebble-ready')]))
+
     return tuple(args)
 
 
@@ -572,7 +626,9 @@ class Context(DCBase):
     relations: Tuple[RelationSpec] = ()
     networks: Tuple[NetworkSpec] = ()
     leader: bool = False
-    model: Model = Model()
+    model: Model = dataclasses.field(default_factory=Model)
+    # names of the containers whose pebble can be connected to
+    containers: Tuple[str, ...] = ()
 
     # todo: add pebble stuff, unit/app status, etc...
     #  containers
@@ -586,7 +642,8 @@ class Context(DCBase):
             config=obj['config'],
             relations=tuple(RelationSpec.from_dict(raw_ard) for raw_ard in obj['relations']),
             networks=tuple(NetworkSpec.from_dict(raw_ns) for raw_ns in obj['networks']),
-            leader=obj['leader']
+            leader=obj['leader'],
+            containers=tuple(obj.get('containers', ())),
         )
 
     def as_scenario(self, event: _Event):
@@ -732,6 +789,11 @@ class InjectRelation(Inject):
     relation_id: Optional[int] = None
 
 
+@dataclass
+class InjectContainer(Inject):
+    container_name: str
+
+
 class Scenario:
     builtins = _Builtins()
 
@@ -739,7 +801,7 @@ class Scenario:
                  playbook: Playbook = Playbook(())):
 
         self._playbook = playbook
-        self._charm_spec = CharmSpec.cast(charm_spec)
+        self._charm_spec = CharmSpec.cast(charm_spec).as_yaml()
 
     @staticmethod
     def from_scenes(
@@ -791,6 +853,10 @@ class Scenario:
         harness.set_model_info(name=context.model.name,
                                uuid=context.model.uuid)
 
+        # config values, so the charm sees them from the start:
+        if context.config:
+            harness.update_config(context.config)
+
     @staticmethod
     def _setup_context(harness: Harness, context: Context):
         harness.disable_hooks()
@@ -820,6 +886,10 @@ class Scenario:
         # leadership:
         harness.set_leader(context.leader)
 
+        # pebble:
+        for container in context.containers:
+            harness.set_can_connect(container, True)
+
         # networking
         for network in context.networks:
             add_network(endpoint_name=network.name,
@@ -940,6 +1010,48 @@ class Scenario:
                     self._check_assertions(ctx, assertions)
         return ctx
 
+    def play_parallel(self,
+                      collect: Optional[Callable[[PlayResult], Any]] = None,
+                      assertions: Union[AssertionType,
+                                        Iterable[AssertionType]] = (),
+                      processes: Optional[int] = None,
+                      mp_context=None) -> List[Any]:
+        """Play every scene of the playbook, spreading them over a process pool.
+
+        Each scene runs against its own fresh harness, so scenes don't depend on each
+        other and can run in any order. Since events and harnesses can't leave the
+        worker processes, `collect` is called on each scene's PlayResult there, and
+        what it returns (which must be picklable) is returned, in playbook order.
+        `collect` and `assertions` are sent to the workers, so they must be picklable
+        too, e.g. module-level functions.
+
+        Arguments:
+            - `collect`: summarises a PlayResult; defaults to discarding it.
+            - `assertions`: checked on each scene, as by `play_until_complete`.
+            - `processes`: size of the pool; defaults to the number of CPUs. With 1,
+              scenes are played in this process.
+            - `mp_context`: multiprocessing context to start the workers with. Note
+              that only the "fork" start method carries over patches made in tests.
+        """
+        if not self._playbook:
+            raise RuntimeError('playbook is empty')
+
+        scenes = list(self._playbook)
+        # parse the metadata now, so forked workers inherit it already parsed
+        _SharedMetaHarness(self._charm_spec.charm_type,
+                           meta=self._charm_spec.meta,
+                           actions=self._charm_spec.actions,
+                           config=self._charm_spec.config)
+
+        job = (self._charm_spec, collect, assertions)
+        processes = processes or os.cpu_count() or 1
+        if processes == 1:
+            return [_play_scene(job, scene) for scene in scenes]
+
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context) as pool:
+            chunksize = max(1, len(scenes) // (processes * 4))
+            return list(pool.map(partial(_play_scene, job), scenes, chunksize=chunksize))
+
     @staticmethod
     def _check_assertions(ctx: PlayResult,
                           assertions: Union[AssertionType,
@@ -952,3 +1064,16 @@ class Scenario:
             if ret_val is False:
                 raise ValueError(f"Assertion {assertion} returned False")
 
+
+def _play_scene(job, scene: Scene):
+    """Play a single scene in its own Scenario; the unit of work of `play_parallel`."""
+    charm_spec, collect, assertions = job
+    scenario = Scenario(charm_spec)
+    with scenario:
+        result = scenario.play(evt=scene.event, context=scene.context)
+        if assertions:
+            scenario._check_assertions(result, assertions)
+    try:
+        return collect(result) if collect else None
+    finally:
+        result[2].harness.cleanup()
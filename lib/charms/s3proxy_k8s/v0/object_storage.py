@@ -47,11 +47,56 @@ class SomeCharm(CharmBase):
         #  event.path
         #  event.endpoint
         pass
+```
+
+Outside of the `ready` handler, `self.blobstore.bucket_details` returns the same details
+as an immutable `BucketInfo`, or `None` if the provider hasn't published them yet, while
+`self.blobstore.bucket_info` still returns them as a dict of relation data, empty until
+then. Both are read from relation data once per dispatch, so they are cheap to use from
+several handlers.
+
+If your charm also depends on `boto3`, the library can build a client tuned for s3proxy
+(connection pool, adaptive retries, timeouts and path-style addressing) from either:
+
+```python
+from charms.s3proxy_k8s.v0.object_storage import build_s3_client, build_transfer_config
+
+    def _on_object_storage_ready(self, event: ObjectStorageReadyEvent):
+        client = build_s3_client(event)  # or build_s3_client(self.blobstore.bucket_info)
+        config = build_transfer_config(event)
+        client.upload_file("data.bin", event.bucket, "data.bin", Config=config)
+```
+
+Providers may also publish hints on how clients should be sized (`HINT_FIELDS`): the
+largest single-request upload, a recommended concurrency, a multipart part size and the
+addressing style. They are surfaced as optional fields of `BucketInfo` and of the
+`ready` event, and the client helpers follow them unless told otherwise.
 """
 
+import asyncio
+import hashlib
 import logging
+import os
+import threading
+import time
 import typing
-from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict  # noqa: F401
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (  # noqa: F401
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Tuple,
+    TypedDict,
+    Union,
+)
 
 from ops.charm import CharmBase, HookEvent, RelationBrokenEvent, RelationEvent
 from ops.framework import BoundEvent, EventSource, Object, ObjectEvents, StoredState
@@ -65,7 +110,7 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 1
+LIBPATCH = 16
 
 DEFAULT_RELATION_NAME = "s3"
 RELATION_INTERFACE = "s3"
@@ -87,6 +132,35 @@ except ModuleNotFoundError:
     )
     DO_VALIDATION = False
 
+try:
+    import boto3
+    from boto3.s3.transfer import (
+        ProgressCallbackInvoker,
+        TransferConfig,
+        create_transfer_manager,
+    )
+    from botocore.config import Config
+except ModuleNotFoundError:
+    # Only needed by the client helpers (`build_s3_client` and friends), which raise
+    # MissingDependencyError when used without it.
+    boto3 = None  # type: ignore
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session as _get_aio_session
+except ModuleNotFoundError:
+    # Only needed by AsyncObjectStorageClient.
+    AioConfig = None  # type: ignore
+
+# Client tuning for s3proxy. Jetty serves requests from a pool of threads, so clients
+# should keep more connections open than botocore's default of 10 to keep it busy.
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+
 OBJECT_STORAGE_PROVIDES_APP_SCHEMA = {
     "$schema": "https://json-schema.org/draft/2019-09/schema",
     "$id": "https://canonical.github.io/charm-relation-interfaces/interfaces/s3/schemas/provider.json",
@@ -95,7 +169,7 @@ OBJECT_STORAGE_PROVIDES_APP_SCHEMA = {
     "type": "object",
     "default": {},
     "required": ["bucket", "access-key", "secret-key", "endpoint"],
-    "additionalProperties": "true",
+    "additionalProperties": True,
     "properties": {
         "bucket": {
             "title": "Bucket name",
@@ -146,6 +220,29 @@ OBJECT_STORAGE_PROVIDES_APP_SCHEMA = {
             "default": "",
             "examples": ["path", "host"],
         },
+        "max-request-size": {
+            "title": "Maximum request size",
+            "description": "Largest object, in bytes, which should be uploaded in a single "
+            "request. Larger objects should use multipart uploads.",
+            "type": "string",
+            "pattern": "^[0-9]+$",
+            "examples": ["134217728"],
+        },
+        "recommended-concurrency": {
+            "title": "Recommended client concurrency",
+            "description": "Number of concurrent requests a client should size its "
+            "connection pool and transfers for.",
+            "type": "string",
+            "pattern": "^[0-9]+$",
+            "examples": ["16"],
+        },
+        "multipart-part-size": {
+            "title": "Multipart part size",
+            "description": "Recommended size, in bytes, of each part of a multipart upload.",
+            "type": "string",
+            "pattern": "^[0-9]+$",
+            "examples": ["16777216"],
+        },
         "storage-class": {
             "title": "Storage Class",
             "description": "Storage Class for objects uploaded to the object storage.",
@@ -201,6 +298,14 @@ OBJECT_STORAGE_PROVIDES_APP_SCHEMA = {
     ],
 }
 
+# What a provider publishes, which only holds credentials when clients need them.
+ANONYMOUS_OBJECT_STORAGE_PROVIDES_APP_SCHEMA = {
+    **OBJECT_STORAGE_PROVIDES_APP_SCHEMA,
+    "$id": "https://canonical.github.io/charm-relation-interfaces/interfaces/s3/schemas/anonymous-provider.json",
+    "title": "`s3` anonymous provider schema",
+    "required": ["bucket", "endpoint"],
+}
+
 ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA = {
     "$schema": "https://json-schema.org/draft/2019-09/schema",
     "$id": "https://canonical.github.io/charm-relation-interfaces/interfaces/s3/schemas/requirer.json",
@@ -209,7 +314,7 @@ ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA = {
     "type": "object",
     "default": {},
     "required": ["bucket"],
-    "additionalProperties": "true",
+    "additionalProperties": True,
     "properties": {
         "bucket": {
             "title": "Bucket Name",
@@ -246,10 +351,35 @@ ProviderData = TypedDict(
     },
     total=False,
 )
+# Optional performance hints a provider may publish alongside the connection details.
+HINT_FIELDS = (
+    "s3-uri-style",
+    "max-request-size",
+    "recommended-concurrency",
+    "multipart-part-size",
+)
+
 # Provider application databag model.
 ProviderApplicationData = TypedDict("ProviderApplicationData", {"ingress": ProviderData})  # type: ignore
 
 
+# Compiled validators, keyed by schema `$id`. Building a validator checks the schema
+# against its metaschema, which is far more expensive than validating a databag, so
+# it is done once per schema on first use rather than on every call.
+_VALIDATORS = {}  # type: Dict[str, Any]
+
+
+def _get_validator(schema):
+    """Return a cached validator instance for `schema`, compiling it on first use."""
+    key = schema["$id"]
+    validator = _VALIDATORS.get(key)
+    if validator is None:
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = _VALIDATORS[key] = cls(schema)
+    return validator
+
+
 def _validate_data(data, schema):
     """Checks whether `data` matches `schema`.
 
@@ -258,15 +388,24 @@ def _validate_data(data, schema):
     if not DO_VALIDATION:
         return
     try:
-        jsonschema.validate(instance=data, schema=schema)
+        _get_validator(schema).validate(data)
     except jsonschema.ValidationError as e:
         raise DataValidationError(data, schema) from e
 
 
+def _digest(value: str) -> str:
+    """Return a short, stable digest of a relation data value."""
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
 class DataValidationError(RuntimeError):
     """Raised when data validation fails on IPU relation data."""
 
 
+class MissingDependencyError(RuntimeError):
+    """Raised when an optional helper is used without the package it needs."""
+
+
 class _ObjectStorageBase(Object):
     """Base class for ObjectStorage interface classes."""
 
@@ -411,6 +550,11 @@ class SingleAuthObjectStorageProvider(_ObjectStorageProviderBase):
 
     on = ObjectStorageProviderCharmEvents()
 
+    # Digests of the values last published to each relation, keyed by relation id and
+    # then by databag key, so unchanged values aren't rewritten. Only digests are kept
+    # so that credentials don't end up in the unit's state.
+    _stored = StoredState()
+
     def __init__(
         self,
         charm: CharmBase,
@@ -418,12 +562,30 @@ class SingleAuthObjectStorageProvider(_ObjectStorageProviderBase):
         refresh_event: Optional[BoundEvent] = None,
     ):
         super().__init__(charm, relation_name, refresh_event)
+        self._stored.set_default(published={})
+        self._relation_index = None  # type: Optional[Dict[int, Relation]]
+        # Buckets already requested in this dispatch, keyed by relation id. Many
+        # requirer units produce a burst of relation events for the same relation,
+        # which only need to be reconciled once.
+        self._requested = {}  # type: Dict[int, str]
+        self._requested_context = None  # type: Optional[str]
+        self.framework.observe(self.framework.on.commit, self._handle_commit)
 
     def _handle_relation(self, event: Any):
         self._request_endpoints(event)
 
+    def _handle_relation_broken(self, event):
+        self._relation_index = None
+        self._requested.pop(event.relation.id, None)
+        self._stored.published.pop(str(event.relation.id), None)  # type: ignore
+
+    def _handle_commit(self, _):
+        self._requested = {}
+
     def _handle_upgrade_or_leader(self, event):
-        # We don't do anything on upgrades or leader-elected yet.
+        # Another unit may have published while we weren't the leader, so what we
+        # remember publishing can't be trusted any more; `_publish` re-reads it.
+        self._stored.published = {}  # type: ignore
         self.on.refresh.emit()  # type: ignore
 
     def _handle_refresh(self, event):
@@ -432,7 +594,8 @@ class SingleAuthObjectStorageProvider(_ObjectStorageProviderBase):
     def _request_endpoints(self, event: Any) -> None:
         """Handler triggered on pretty much all events.
 
-        Request an update from the workload charm.
+        Request an update from the workload charm, at most once per relation and
+        bucket in a single dispatch.
 
         Args:
             event: Juju event
@@ -449,34 +612,201 @@ class SingleAuthObjectStorageProvider(_ObjectStorageProviderBase):
             )
         else:
             bucket = "anonymous"
+
+        # Juju gives every hook it runs a unique context id. Without one, e.g. in a test
+        # harness, there is no telling events of the same dispatch apart, so none are.
+        context = os.environ.get("JUJU_CONTEXT_ID")
+        if context is None or context != self._requested_context:
+            self._requested = {}
+            self._requested_context = context
+        if self._requested.get(event.relation.id) == bucket:
+            return
+        self._requested[event.relation.id] = bucket
         self.on.requested.emit(event.relation, bucket=bucket)  # type: ignore
 
+    def _get_relation(self, relation_id: int) -> Optional[Relation]:
+        """Look up a relation on this endpoint by id."""
+        if self._relation_index is None or relation_id not in self._relation_index:
+            self._relation_index = {r.id: r for r in self.relations}
+        return self._relation_index.get(relation_id)
+
     def update_endpoints(self, data: Dict[str, str], relation_id: Optional[int] = None):
-        """Update relation data bags with endpoint information."""
-        if relation_id:
-            for r in [rel for rel in self.relations if rel.id == relation_id]:
-                if bucket := r.data.get(r.app, {}).get("bucket", ""):  # type: ignore
-                    data["bucket"] = bucket
-                    _validate_data(data, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
-                    r.data[self.charm.app].update(data)  # type: ignore
+        """Update relation data bags with endpoint information.
+
+        Besides the connection details, `data` may carry any of the optional hints in
+        `HINT_FIELDS`, which requirers surface through `BucketInfo`.
+
+        Only values which differ from what was last published to a relation are
+        written, so a refresh which changes nothing doesn't fire relation-changed on
+        the requirers. Only the leader can publish; on other units this does nothing.
+        """
+        if not self.charm.unit.is_leader():
+            return
+
+        if relation_id is not None:
+            relation = self._get_relation(relation_id)
+            relations = [relation] if relation else []
         else:
-            for r in self.relations:
-                if bucket := r.data.get(r.app, {}).get("bucket", ""):  # type: ignore
-                    data["bucket"] = bucket
-                    _validate_data(data, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
-                    r.data[self.charm.app].update(data)  # type: ignore
+            relations = self.relations
+
+        for r in relations:
+            if bucket := r.data.get(r.app, {}).get("bucket", ""):  # type: ignore
+                self._publish(r, dict(data, bucket=bucket))
+
+    def _publish(self, relation: Relation, data: Dict[str, str]):
+        """Write the keys of `data` which changed since they were last published."""
+        # Checked here, as requirers ignore relation data which doesn't validate.
+        _validate_data(data, ANONYMOUS_OBJECT_STORAGE_PROVIDES_APP_SCHEMA)
+
+        published = self._stored.published.get(str(relation.id))  # type: ignore
+        if published is None:
+            # Nothing remembered for this relation, e.g. since leadership changed hands:
+            # compare with what the databag actually holds rather than rewriting it all.
+            published = {k: _digest(v) for k, v in relation.data[self.charm.app].items()}
+        published = dict(published)
+        digests = {k: _digest(v) for k, v in data.items()}
+        changed = {k: data[k] for k, v in digests.items() if published.get(k) != v}
+        if not changed:
+            return
+
+        relation.data[self.charm.app].update(changed)
+        published.update(digests)
+        self._stored.published[str(relation.id)] = published  # type: ignore
+
+
+class BucketInfo:
+    """Connection details for a bucket provided over the `s3` relation.
+
+    Besides the connection details, a provider may publish hints on how clients should
+    be sized; those which weren't published are None.
+
+    Instances are immutable. For compatibility with earlier versions of this library,
+    fields can also be read by their relation data key, e.g. `info["access-key"]`.
+    """
+
+    __slots__ = (
+        "bucket",
+        "endpoint",
+        "access_key",
+        "secret_key",
+        "s3_uri_style",
+        "max_request_size",
+        "recommended_concurrency",
+        "multipart_part_size",
+    )
+
+    bucket: str
+    endpoint: str
+    access_key: str
+    secret_key: str
+    s3_uri_style: Optional[str]
+    max_request_size: Optional[int]
+    recommended_concurrency: Optional[int]
+    multipart_part_size: Optional[int]
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint: str,
+        access_key: str,
+        secret_key: str,
+        s3_uri_style: Optional[str] = None,
+        max_request_size: Optional[int] = None,
+        recommended_concurrency: Optional[int] = None,
+        multipart_part_size: Optional[int] = None,
+    ):
+        values = (
+            bucket,
+            endpoint,
+            access_key,
+            secret_key,
+            s3_uri_style,
+            max_request_size,
+            recommended_concurrency,
+            multipart_part_size,
+        )
+        for attr, value in zip(self.__slots__, values):
+            object.__setattr__(self, attr, value)
+
+    @classmethod
+    def from_relation_data(cls, data: Dict[str, str]) -> "BucketInfo":
+        """Build from provider relation data."""
+
+        def optional_int(key):
+            return int(data[key]) if data.get(key) else None
+
+        return cls(
+            bucket=data["bucket"],
+            endpoint=data["endpoint"],
+            access_key=data["access-key"],
+            secret_key=data["secret-key"],
+            s3_uri_style=data.get("s3-uri-style") or None,
+            max_request_size=optional_int("max-request-size"),
+            recommended_concurrency=optional_int("recommended-concurrency"),
+            multipart_part_size=optional_int("multipart-part-size"),
+        )
+
+    def as_dict(self) -> Dict[str, str]:
+        """Return the fields keyed as they are in relation data, leaving out unset hints."""
+        return {
+            attr.replace("_", "-"): str(getattr(self, attr))
+            for attr in self.__slots__
+            if getattr(self, attr) is not None
+        }
+
+    def __setattr__(self, name, value):
+        """Refuse to change fields; BucketInfo is immutable."""
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        """Refuse to delete fields; BucketInfo is immutable."""
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __getitem__(self, key: str) -> str:
+        """Look a field up by its relation data key."""
+        attr = key.replace("-", "_")
+        if attr not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, attr)
+
+    def _fields(self) -> tuple:
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __eq__(self, other) -> bool:
+        """Compare all fields."""
+        if not isinstance(other, BucketInfo):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        """Hash all fields, as they are compared."""
+        return hash(self._fields())
+
+    def __repr__(self) -> str:
+        """Represent without the credentials, which shouldn't end up in logs."""
+        return f"{type(self).__name__}(bucket={self.bucket!r}, endpoint={self.endpoint!r})"
 
 
 class ObjectStorageReadyEvent(_ObjectStorageEvent):
     """Event representing that object storage data has been provided for an app."""
 
     __args__ = ("bucket", "endpoint", "access_key", "secret_key")
+    __optional_kwargs__ = {
+        "s3_uri_style": None,
+        "max_request_size": None,
+        "recommended_concurrency": None,
+        "multipart_part_size": None,
+    }
 
     if typing.TYPE_CHECKING:
         access_key = None  # type: Optional[str]
         bucket = None  # type: Optional[str]
         endpoint = None  # type: Optional[str]
         secret_key = None  # type: Optional[str]
+        s3_uri_style = None  # type: Optional[str]
+        max_request_size = None  # type: Optional[int]
+        recommended_concurrency = None  # type: Optional[int]
+        multipart_part_size = None  # type: Optional[int]
 
 
 class ObjectStorageBrokenEvent(_ObjectStorageEvent):
@@ -526,6 +856,8 @@ class ObjectStorageRequirer(_ObjectStorageBase):
         super().__init__(charm, relation_name)
         self._stored.set_default(current_endpoints={})
         self.bucket = bucket or f"{charm.model.name}-{charm.app.name}"
+        # Relation data read during this dispatch; see `_endpoints_from_relation_data`.
+        self._endpoints_cache = None  # type: Optional[Dict[str, str]]
 
     @property
     def relation(self) -> Optional[Relation]:
@@ -533,6 +865,7 @@ class ObjectStorageRequirer(_ObjectStorageBase):
         return self.relations[0] if self.relations else None
 
     def _handle_relation(self, event: RelationEvent):
+        self._endpoints_cache = None
         # we calculate the diff between the urls we were aware of
         # before and those we know now
         previous_endpoints = self._stored.current_endpoints or {}  # type: ignore
@@ -543,30 +876,72 @@ class ObjectStorageRequirer(_ObjectStorageBase):
             self._stored.current_endpoints = {}
             return
 
+        self._request_bucket(event.relation)
+
         changed = previous_endpoints != current_endpoints
-        if changed:
+        if changed and current_endpoints:
+            info = BucketInfo.from_relation_data(current_endpoints)
             self.on.ready.emit(  # type: ignore
                 event.relation,
-                current_endpoints["bucket"],
-                current_endpoints["endpoint"],
-                current_endpoints["access-key"],
-                current_endpoints["secret-key"],
+                info.bucket,
+                info.endpoint,
+                info.access_key,
+                info.secret_key,
+                s3_uri_style=info.s3_uri_style,
+                max_request_size=info.max_request_size,
+                recommended_concurrency=info.recommended_concurrency,
+                multipart_part_size=info.multipart_part_size,
             )
+
+    def _handle_upgrade_or_leader(self, event):
+        # A new leader, or a new charm revision, may want a different bucket.
+        for relation in self.relations:
+            self._request_bucket(relation)
+
+    def _request_bucket(self, relation: Relation):
+        """Publish the bucket request, unless the provider already has this one.
+
+        Rewriting an unchanged value would still cost a relation-set, and a changed
+        one fires relation-changed on the provider, so only write when it differs.
+        """
+        if not self.charm.unit.is_leader():
             return
-        event.relation.data[self.charm.app]["bucket"] = self.bucket
+        databag = relation.data[self.charm.app]
+        if databag.get("bucket") != self.bucket:
+            databag["bucket"] = self.bucket
 
     def _handle_relation_broken(self, event):
         """Emit an event the parent charm can listen to."""
+        self._endpoints_cache = None
         self.on.broken.emit(event.relation)  # type: ignore
 
     @property
-    def bucket_info(self):
-        """Indicate whether a remote bucket is available."""
+    def bucket_info(self) -> Dict[str, str]:
+        """Indicate whether a remote bucket is available.
+
+        Returns:
+            The provider's relation data, empty until it has published the bucket.
+        """
         return self._endpoints_from_relation_data
 
+    @property
+    def bucket_details(self) -> Optional[BucketInfo]:
+        """Connection details for the remote bucket, or None if it isn't available yet."""
+        data = self._endpoints_from_relation_data
+        return BucketInfo.from_relation_data(data) if data else None
+
     @property
     def _endpoints_from_relation_data(self) -> Dict[str, str]:
-        """Pull connection information out of relation data."""
+        """Pull connection information out of relation data.
+
+        The result is cached for the rest of the dispatch, and invalidated whenever a
+        relation event for this endpoint is handled.
+        """
+        if self._endpoints_cache is None:
+            self._endpoints_cache = self._read_endpoints()
+        return dict(self._endpoints_cache)
+
+    def _read_endpoints(self) -> Dict[str, str]:
         relation = self.relation
         if not relation:
             return {}
@@ -579,9 +954,17 @@ class ObjectStorageRequirer(_ObjectStorageBase):
         data = {}
         try:
             fields = ["access-key", "bucket", "endpoint", "secret-key"]
+            remote_data = relation.data[relation.app]
 
             for f in fields:
-                data[f] = relation.data[relation.app].get(f, "")  # type: ignore
+                data[f] = remote_data.get(f, "")  # type: ignore
+            if not all([data[k] for k in data.keys()]):
+                # incomplete relation data
+                return {}
+
+            for f in HINT_FIELDS:
+                if value := remote_data.get(f, ""):  # type: ignore
+                    data[f] = value
         except ModelError as e:
             logger.debug(
                 "Error {} attempting to read remote app data; "
@@ -589,9 +972,528 @@ class ObjectStorageRequirer(_ObjectStorageBase):
             )
             return {}
 
-        if not all([data[k] for k in data.keys()]):
-            # incomplete relation data
-            return {}
-
-        _validate_data(data, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
+        _validate_data(data, OBJECT_STORAGE_PROVIDES_APP_SCHEMA)
         return data
+
+
+def _bucket_info(source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]]):
+    """Normalise the ways connection details are handed to consumers into a BucketInfo."""
+    if isinstance(source, BucketInfo):
+        return source
+    if isinstance(source, ObjectStorageReadyEvent):
+        return BucketInfo(
+            source.bucket,  # type: ignore
+            source.endpoint,  # type: ignore
+            source.access_key,  # type: ignore
+            source.secret_key,  # type: ignore
+            source.s3_uri_style,
+            source.max_request_size,
+            source.recommended_concurrency,
+            source.multipart_part_size,
+        )
+    if isinstance(source, dict):
+        return BucketInfo.from_relation_data(source)
+    raise TypeError(f"cannot get connection details from {source!r}")
+
+
+def _pool_size(info: BucketInfo, value: Optional[int]) -> int:
+    """Connections/concurrency to use: `value`, else the provider's hint, else the default."""
+    return value or info.recommended_concurrency or DEFAULT_MAX_POOL_CONNECTIONS
+
+
+def _part_size(info: BucketInfo, value: Optional[int]) -> int:
+    """Multipart part size to use, kept within the provider's maximum request size."""
+    part_size = value or info.multipart_part_size or DEFAULT_MULTIPART_CHUNKSIZE
+    if info.max_request_size:
+        part_size = min(part_size, info.max_request_size)
+    return part_size
+
+
+def _require_boto3():
+    if boto3 is None:
+        raise MissingDependencyError(
+            "The object storage client helpers need the `boto3` package. "
+            "Add `boto3` to the 'requirements.txt' of your charm to use them."
+        )
+
+
+def build_s3_client(
+    source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+    *,
+    max_pool_connections: Optional[int] = None,
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: float = DEFAULT_READ_TIMEOUT,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    addressing_style: Optional[Literal["path", "virtual", "auto"]] = None,
+    region_name: str = "us-east-1",
+):
+    """Build a boto3 S3 client for the bucket provided over the relation.
+
+    The client keeps a larger pool of keep-alive connections than botocore's default,
+    retries adaptively (backing off when s3proxy is saturated), and uses path-style
+    addressing, since s3proxy endpoints are usually service hostnames that bucket
+    names can't be prepended to. Where the provider published hints, the pool size and
+    addressing style follow them unless given explicitly.
+
+    Args:
+        source: an `ObjectStorageReadyEvent`, the requirer's `bucket_info`, or a dict
+            of provider relation data.
+        max_pool_connections: maximum number of connections kept open to s3proxy.
+            Transfers using more threads than this will wait for a connection.
+            Defaults to the provider's recommended concurrency, or 32.
+        connect_timeout: seconds to wait for a connection to be established.
+        read_timeout: seconds to wait for data on an established connection.
+        max_attempts: total attempts for a request, including the first one.
+        addressing_style: how the bucket is encoded in request URLs. Defaults to the
+            provider's `s3-uri-style`, or "path".
+        region_name: region to sign requests for; s3proxy accepts any.
+
+    Returns:
+        A `botocore.client.S3` instance.
+    """
+    _require_boto3()
+    info = _bucket_info(source)
+    if addressing_style is None:
+        addressing_style = "virtual" if info.s3_uri_style == "host" else "path"
+    config = Config(
+        max_pool_connections=_pool_size(info, max_pool_connections),
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={"mode": "adaptive", "total_max_attempts": max_attempts},
+        tcp_keepalive=True,
+        s3={"addressing_style": addressing_style},
+        signature_version="s3v4",
+    )
+    # A dedicated session, since the default one isn't safe to share between threads.
+    return boto3.session.Session().client(
+        service_name="s3",
+        endpoint_url=info.endpoint,
+        aws_access_key_id=info.access_key,
+        aws_secret_access_key=info.secret_key,
+        region_name=region_name,
+        config=config,
+    )
+
+
+def build_transfer_config(
+    source: Optional[Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]]] = None,
+    *,
+    max_concurrency: Optional[int] = None,
+    multipart_threshold: Optional[int] = None,
+    multipart_chunksize: Optional[int] = None,
+):
+    """Build a boto3 `TransferConfig` to use with clients from `build_s3_client`.
+
+    Pass it as `Config=` to `upload_file`, `download_file` and their `fileobj`
+    variants. Keep `max_concurrency` at or below the client's `max_pool_connections`.
+    If `source` is given, whatever isn't passed explicitly follows the provider's hints.
+
+    Args:
+        source: optionally, an `ObjectStorageReadyEvent`, the requirer's `bucket_info`,
+            or a dict of provider relation data.
+        max_concurrency: threads used to transfer the parts of a single object.
+        multipart_threshold: objects at least this large are transferred in parts.
+            Defaults to the part size.
+        multipart_chunksize: size of each part, in bytes.
+
+    Returns:
+        A `boto3.s3.transfer.TransferConfig` instance.
+    """
+    _require_boto3()
+    info = _bucket_info(source) if source is not None else BucketInfo("", "", "", "")
+    part_size = _part_size(info, multipart_chunksize)
+    return TransferConfig(
+        max_concurrency=_pool_size(info, max_concurrency),
+        multipart_threshold=multipart_threshold or part_size,
+        multipart_chunksize=part_size,
+        use_threads=True,
+    )
+
+
+# One aiobotocore session per process, shared by all async clients: sessions load the
+# service models, which is slow and needn't be repeated for every client.
+_AIO_SESSION = None
+
+
+class AsyncObjectStorageClient:
+    """Asyncio client for the bucket provided over the relation, built on aiobotocore.
+
+    It is tuned like the clients from `build_s3_client`, and adds bulk operations which
+    run with bounded concurrency over a shared connection pool:
+
+        async with AsyncObjectStorageClient(event) as s3:
+            await s3.put_many({"a.txt": b"a", "b.txt": b"b"})
+            keys = await s3.list_keys(prefix="a")
+            objects = await s3.get_many(keys)
+
+    The underlying aiobotocore client is available as `client` for anything else.
+    """
+
+    def __init__(
+        self,
+        source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+        *,
+        max_pool_connections: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        region_name: str = "us-east-1",
+    ):
+        """Prepare a client; connections are only opened once it is entered.
+
+        Args:
+            source: an `ObjectStorageReadyEvent`, the requirer's `bucket_info`, or a
+                dict of provider relation data.
+            max_pool_connections: maximum number of connections kept open to s3proxy.
+                Defaults to the provider's recommended concurrency, or 32.
+            concurrency: maximum requests in flight for the bulk operations. Defaults
+                to `max_pool_connections`.
+            connect_timeout: seconds to wait for a connection to be established.
+            read_timeout: seconds to wait for data on an established connection.
+            max_attempts: total attempts for a request, including the first one.
+            region_name: region to sign requests for; s3proxy accepts any.
+        """
+        if AioConfig is None:
+            raise MissingDependencyError(
+                "AsyncObjectStorageClient needs the `aiobotocore` package. "
+                "Add `aiobotocore` to the 'requirements.txt' of your charm to use it."
+            )
+        self.info = _bucket_info(source)
+        max_pool_connections = _pool_size(self.info, max_pool_connections)
+        self.concurrency = concurrency or max_pool_connections
+        self._region_name = region_name
+        self._config = AioConfig(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={"mode": "adaptive", "total_max_attempts": max_attempts},
+            tcp_keepalive=True,
+            s3={"addressing_style": "virtual" if self.info.s3_uri_style == "host" else "path"},
+            signature_version="s3v4",
+        )
+        self._stack = None  # type: Optional[AsyncExitStack]
+        self.client = None  # type: Any
+
+    async def __aenter__(self) -> "AsyncObjectStorageClient":
+        """Open the underlying client and its connection pool."""
+        global _AIO_SESSION
+        if _AIO_SESSION is None:
+            _AIO_SESSION = _get_aio_session()
+
+        self._stack = AsyncExitStack()
+        self.client = await self._stack.enter_async_context(
+            _AIO_SESSION.create_client(
+                "s3",
+                endpoint_url=self.info.endpoint,
+                aws_access_key_id=self.info.access_key,
+                aws_secret_access_key=self.info.secret_key,
+                region_name=self._region_name,
+                config=self._config,
+            )
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the underlying client and its connections."""
+        stack, self._stack, self.client = self._stack, None, None
+        if stack:
+            await stack.aclose()
+
+    async def _gather_bounded(self, coros: Iterable[typing.Awaitable]) -> List[Any]:
+        """Run `coros` with at most `self.concurrency` of them in flight."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        return await asyncio.gather(*(bounded(c) for c in coros))
+
+    async def put(self, key: str, body: bytes, bucket: Optional[str] = None) -> None:
+        """Upload a single object."""
+        await self.client.put_object(Bucket=bucket or self.info.bucket, Key=key, Body=body)
+
+    async def get(self, key: str, bucket: Optional[str] = None) -> bytes:
+        """Download a single object."""
+        response = await self.client.get_object(Bucket=bucket or self.info.bucket, Key=key)
+        async with response["Body"] as stream:
+            return await stream.read()
+
+    async def put_many(
+        self,
+        objects: Union[Mapping[str, bytes], Iterable[Tuple[str, bytes]]],
+        bucket: Optional[str] = None,
+    ) -> None:
+        """Upload objects concurrently, given as a mapping or pairs of key and body."""
+        items = objects.items() if isinstance(objects, Mapping) else objects
+        await self._gather_bounded(self.put(key, body, bucket) for key, body in items)
+
+    async def get_many(
+        self, keys: Iterable[str], bucket: Optional[str] = None
+    ) -> Dict[str, bytes]:
+        """Download objects concurrently, returning their bodies keyed by object key."""
+        keys = list(keys)
+        bodies = await self._gather_bounded(self.get(key, bucket) for key in keys)
+        return dict(zip(keys, bodies))
+
+    async def list_keys(self, prefix: str = "", bucket: Optional[str] = None) -> List[str]:
+        """List the keys in the bucket starting with `prefix`, across all result pages."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        keys = []
+        async for page in paginator.paginate(Bucket=bucket or self.info.bucket, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", ()))
+        return keys
+
+
+@dataclass(frozen=True)
+class TransferStats:
+    """Summary of a transfer made with one of the transfer helpers."""
+
+    objects: int
+    bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Average throughput, in bytes per second."""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+class _ProgressCounter:
+    """Thread-safe running total of transferred bytes, reported to an optional callback."""
+
+    def __init__(self, callback: Optional[Callable[[int], None]]):
+        self.callback = callback
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, transferred: int):
+        """Record `transferred` more bytes."""
+        with self._lock:
+            self.total += transferred
+            total = self.total
+        if self.callback:
+            self.callback(total)
+
+
+class _Transfer:
+    """Client, transfer configuration and progress accounting shared by the helpers."""
+
+    def __init__(
+        self,
+        source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+        bucket: Optional[str],
+        part_size: Optional[int],
+        concurrency: Optional[int],
+        progress: Optional[Callable[[int], None]],
+    ):
+        self.info = _bucket_info(source)
+        self.bucket = bucket or self.info.bucket
+        concurrency = _pool_size(self.info, concurrency)
+        self.client = build_s3_client(self.info, max_pool_connections=concurrency)
+        self.config = build_transfer_config(
+            self.info, max_concurrency=concurrency, multipart_chunksize=part_size
+        )
+        self.progress = _ProgressCounter(progress)
+        self.objects = 0
+        self._started = time.monotonic()
+
+    def stats(self, description: str) -> TransferStats:
+        stats = TransferStats(self.objects, self.progress.total, time.monotonic() - self._started)
+        logger.info(
+            "%s: %d objects, %d bytes in %.1fs (%.1f MiB/s)",
+            description,
+            stats.objects,
+            stats.bytes,
+            stats.seconds,
+            stats.throughput / (1024 * 1024),
+        )
+        return stats
+
+    def run(self, submit: Callable[[Any, List[Any]], Any], jobs: Iterable[Any]):
+        """Submit all `jobs` to one transfer manager and wait for them to complete.
+
+        A single manager schedules the parts of every object on one bounded pool, so
+        many small objects and a few large ones both keep `concurrency` requests busy.
+        """
+        subscribers = [ProgressCallbackInvoker(self.progress)]
+        with create_transfer_manager(self.client, self.config) as manager:
+            futures = [submit(manager, job, subscribers) for job in jobs]
+            for future in futures:
+                future.result()
+                self.objects += 1
+
+
+def upload_directory(
+    source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+    directory: Union[str, os.PathLike],
+    prefix: str = "",
+    *,
+    bucket: Optional[str] = None,
+    part_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> TransferStats:
+    """Upload every file under `directory`, keyed by `prefix` and its relative path.
+
+    Files larger than `part_size` are uploaded in parts, and parts of all files share a
+    pool of `concurrency` concurrent requests.
+
+    Args:
+        source: an `ObjectStorageReadyEvent`, the requirer's `bucket_info`, or a dict
+            of provider relation data.
+        directory: local directory to upload.
+        prefix: prepended to each file's relative path to make its key.
+        bucket: bucket to upload to, if not the one provided over the relation.
+        part_size: size of each part of a multipart upload, in bytes. Defaults to the
+            provider's hint, or 16 MiB.
+        concurrency: maximum requests in flight. Defaults to the provider's hint, or 32.
+        progress: called with the running total of bytes uploaded.
+
+    Returns:
+        A TransferStats summary.
+    """
+    transfer = _Transfer(source, bucket, part_size, concurrency, progress)
+    root = Path(directory)
+
+    def submit(manager, path: Path, subscribers):
+        key = prefix + path.relative_to(root).as_posix()
+        return manager.upload(str(path), transfer.bucket, key, subscribers=subscribers)
+
+    transfer.run(submit, (p for p in sorted(root.rglob("*")) if p.is_file()))
+    return transfer.stats(f"Uploaded {root} to {transfer.bucket}/{prefix}")
+
+
+def download_directory(
+    source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+    directory: Union[str, os.PathLike],
+    prefix: str = "",
+    *,
+    bucket: Optional[str] = None,
+    part_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> TransferStats:
+    """Download every object whose key starts with `prefix` into `directory`.
+
+    Objects are written to their key relative to `prefix`, with or without a trailing
+    "/", creating subdirectories as needed. Objects larger than `part_size` are fetched
+    as concurrent ranged requests.
+
+    Args:
+        source: an `ObjectStorageReadyEvent`, the requirer's `bucket_info`, or a dict
+            of provider relation data.
+        directory: local directory to download into.
+        prefix: only objects with keys starting with this are downloaded.
+        bucket: bucket to download from, if not the one provided over the relation.
+        part_size: size of each ranged request, in bytes. Defaults to the provider's
+            hint, or 16 MiB.
+        concurrency: maximum requests in flight. Defaults to the provider's hint, or 32.
+        progress: called with the running total of bytes downloaded.
+
+    Returns:
+        A TransferStats summary.
+
+    Raises:
+        ValueError: if a key would be written outside of `directory`.
+    """
+    transfer = _Transfer(source, bucket, part_size, concurrency, progress)
+    root = Path(directory).resolve()
+
+    def keys():
+        paginator = transfer.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=transfer.bucket, Prefix=prefix):
+            for obj in page.get("Contents", ()):
+                if not obj["Key"].endswith("/"):  # "directory" placeholders
+                    yield obj["Key"]
+
+    def submit(manager, key: str, subscribers):
+        # After a prefix like "models" rather than "models/", keys still start with "/",
+        # which would make them absolute; a key equal to the prefix keeps its name.
+        relative = key[len(prefix) :].lstrip("/")  # noqa: E203
+        relative = relative or key.rsplit("/", 1)[-1]
+        path = (root / relative).resolve()
+        if root not in path.parents:
+            raise ValueError(f"refusing to write {key!r} outside of {root}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return manager.download(transfer.bucket, key, str(path), subscribers=subscribers)
+
+    transfer.run(submit, keys())
+    return transfer.stats(f"Downloaded {transfer.bucket}/{prefix} to {root}")
+
+
+def upload_stream(
+    source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+    stream: IO[bytes],
+    key: str,
+    *,
+    bucket: Optional[str] = None,
+    part_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> TransferStats:
+    """Upload a readable binary stream, which needn't be seekable, as `key`.
+
+    The stream is read in `part_size` chunks which are uploaded concurrently, so at
+    most about `concurrency` parts are held in memory at once.
+
+    Args:
+        source: an `ObjectStorageReadyEvent`, the requirer's `bucket_info`, or a dict
+            of provider relation data.
+        stream: file-like object to read from.
+        key: object key to upload to.
+        bucket: bucket to upload to, if not the one provided over the relation.
+        part_size: size of each part of a multipart upload, in bytes. Defaults to the
+            provider's hint, or 16 MiB.
+        concurrency: maximum requests in flight. Defaults to the provider's hint, or 32.
+        progress: called with the running total of bytes uploaded.
+
+    Returns:
+        A TransferStats summary.
+    """
+    transfer = _Transfer(source, bucket, part_size, concurrency, progress)
+
+    def submit(manager, fileobj, subscribers):
+        return manager.upload(fileobj, transfer.bucket, key, subscribers=subscribers)
+
+    transfer.run(submit, [stream])
+    return transfer.stats(f"Uploaded stream to {transfer.bucket}/{key}")
+
+
+def download_stream(
+    source: Union[ObjectStorageReadyEvent, BucketInfo, Dict[str, str]],
+    key: str,
+    stream: IO[bytes],
+    *,
+    bucket: Optional[str] = None,
+    part_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> TransferStats:
+    """Download `key` into a writable binary stream, which needn't be seekable.
+
+    Ranged requests for `part_size` chunks run concurrently and are written to the
+    stream in order.
+
+    Args:
+        source: an `ObjectStorageReadyEvent`, the requirer's `bucket_info`, or a dict
+            of provider relation data.
+        key: object key to download.
+        stream: file-like object to write to.
+        bucket: bucket to download from, if not the one provided over the relation.
+        part_size: size of each ranged request, in bytes. Defaults to the provider's
+            hint, or 16 MiB.
+        concurrency: maximum requests in flight. Defaults to the provider's hint, or 32.
+        progress: called with the running total of bytes downloaded.
+
+    Returns:
+        A TransferStats summary.
+    """
+    transfer = _Transfer(source, bucket, part_size, concurrency, progress)
+
+    def submit(manager, fileobj, subscribers):
+        return manager.download(transfer.bucket, key, fileobj, subscribers=subscribers)
+
+    transfer.run(submit, [stream])
+    return transfer.stats(f"Downloaded {transfer.bucket}/{key} to stream")
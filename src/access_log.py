@@ -0,0 +1,138 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Sampled, structured access logs of requests to s3proxy, shipped to Loki in batches.
+
+Logging every request costs s3proxy measurable CPU and I/O at high request rates, so the
+charm's reverse proxy in front of it logs a sample of them instead: a share `ratio` of
+all requests, and every one which failed on the server's side. Each is a line of JSON,
+written to standard output, where Pebble keeps it, and queued for Loki's push API.
+
+A background thread pushes what is queued in batches, so that requests never wait on
+Loki. Should Loki fall behind or be unreachable, lines which don't fit in the bounded
+queue, or can't be pushed, are dropped and counted.
+
+This module only uses the standard library, as it runs in the workload container.
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import urllib.request
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# How long a line may wait for others to fill its batch.
+FLUSH_SECONDS = 2
+QUEUE_SIZE = 10000
+PUSH_TIMEOUT = 10
+
+
+def parse_labels(value: str) -> Dict[str, str]:
+    """Parse "name=value,..." into Loki stream labels."""
+    return dict(item.partition("=")[::2] for item in value.split(",") if item)
+
+
+class AccessLog:
+    """Samples requests into JSON lines, for standard output and Loki at `loki_urls`."""
+
+    def __init__(
+        self,
+        ratio: float,
+        loki_urls: Iterable[str] = (),
+        labels: Dict[str, str] = None,
+        stream=sys.stdout,
+        sample=random.random,
+    ):
+        self.ratio = ratio
+        self.loki_urls = list(loki_urls)
+        self.labels = labels or {}
+        self.sampled = self.pushed = self.dropped = 0
+        self._stream = stream
+        self._sample = sample
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[int, str]]" = queue.Queue(QUEUE_SIZE)
+
+    def record(self, **entry) -> bool:
+        """Log a request described by `entry` if it is sampled, returning whether it was."""
+        if entry.get("status", 0) < 500 and self._sample() >= self.ratio:
+            return False
+        now = time.time_ns()
+        line = json.dumps(
+            {"time": round(now / 1e9, 3), **entry}, separators=(",", ":"), sort_keys=True
+        )
+        with self._lock:
+            self.sampled += 1
+            self._stream.write(line + "\n")
+            self._stream.flush()
+        if self.loki_urls:
+            try:
+                self._queue.put_nowait((now, line))
+            except queue.Full:
+                self._count_dropped(1)
+        return True
+
+    def start(self):
+        """Push queued lines to Loki from a background thread, if there are endpoints."""
+        if self.loki_urls:
+            threading.Thread(target=self._ship, daemon=True).start()
+
+    def _ship(self):
+        while True:
+            self.push(self.next_batch())
+
+    def next_batch(self) -> List[Tuple[int, str]]:
+        """Wait for a line, then for up to BATCH_SIZE of them or FLUSH_SECONDS."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + FLUSH_SECONDS
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def push(self, batch: List[Tuple[int, str]]) -> bool:
+        """Push `batch` to every Loki endpoint, returning whether any accepted it."""
+        values = [[str(timestamp), line] for timestamp, line in batch]
+        body = json.dumps({"streams": [{"stream": self.labels, "values": values}]}).encode()
+        pushed = False
+        for url in self.loki_urls:
+            request = urllib.request.Request(
+                url, data=body, headers={"Content-Type": "application/json"}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=PUSH_TIMEOUT) as response:
+                    response.read()
+                pushed = True
+            except (OSError, ValueError) as e:
+                logger.warning("cannot push access logs to %s: %s", url, e)
+        if pushed:
+            with self._lock:
+                self.pushed += len(batch)
+        else:
+            self._count_dropped(len(batch))
+        return pushed
+
+    def _count_dropped(self, lines: int):
+        with self._lock:
+            self.dropped += lines
+
+    def metrics(self):
+        """The log's counters, as `metrics_exporter` metrics."""
+        with self._lock:
+            values = {
+                "s3proxy_access_log_sampled_total": ("Requests logged.", self.sampled),
+                "s3proxy_access_log_pushed_total": ("Lines pushed to Loki.", self.pushed),
+                "s3proxy_access_log_dropped_total": (
+                    "Lines which couldn't be pushed to Loki.",
+                    self.dropped,
+                ),
+            }
+        return {name: ("counter", text, {"": value}) for name, (text, value) in values.items()}
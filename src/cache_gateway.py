@@ -0,0 +1,733 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A read-through cache, on local disk, in front of a remote S3 store.
+
+When s3proxy serves buckets from a remote S3-compatible store, its jclouds backend is
+pointed at this gateway, which forwards every request to the remote, signed with the
+remote's credentials. Objects fetched with plain GETs are kept on disk as they stream
+through, up to a total size, and served from there on later GETs and HEADs; the least
+recently used objects are evicted to make room. Writes and deletes through the gateway
+invalidate what they touch, so the remote must only be written to through this proxy
+for the cache to stay fresh.
+
+The gateway only listens on the loopback interface: s3proxy has already authenticated
+the client by the time a request gets here.
+
+Hits, misses, evictions and the cache size are written as Prometheus metrics, see
+`metrics_exporter`. This module only uses the standard library, as it runs in the
+workload container.
+"""
+
+import argparse
+import datetime
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+
+from metrics_exporter import write_textfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# A single object may take at most this share of the cache, so that one large download
+# doesn't flush everything else.
+MAX_ENTRY_SHARE = 8
+METRICS_INTERVAL = 15
+# The longest chunk size or trailer line accepted in chunked request bodies.
+MAX_LINE = 64 * 1024
+
+# Response headers describing the object, as opposed to the response.
+_OBJECT_HEADERS = {
+    "cache-control",
+    "content-disposition",
+    "content-encoding",
+    "content-language",
+    "content-type",
+    "etag",
+    "expires",
+    "last-modified",
+    "x-amz-version-id",
+}
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "trailer", "upgrade"}
+# Request headers which are replaced when re-signing, or which only apply to this hop.
+_UNFORWARDED = HOP_BY_HOP | {"authorization", "host", "expect", "x-amz-date"}
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def canonical_target(path: str, query: str) -> Tuple[str, str]:
+    """The path and query in the encoding AWS Signature V4 expects.
+
+    Requests are sent with this same encoding, so that what is signed is what is sent.
+    """
+    params = sorted(
+        (quote(k, safe="~"), quote(v, safe="~"))
+        for k, v in parse_qsl(query, keep_blank_values=True)
+    )
+    return quote(unquote(path), safe="/~"), "&".join(f"{k}={v}" for k, v in params)
+
+
+def canonical_request(
+    method: str, path: str, query: str, headers: Dict[str, str], signed, payload_hash: str
+) -> str:
+    """The AWS Signature V4 canonical request, given lowercase header names."""
+    return "\n".join(
+        [
+            method,
+            path,
+            query,
+            "".join(f"{k}:{' '.join(headers[k].split())}\n" for k in signed),
+            ";".join(signed),
+            payload_hash,
+        ]
+    )
+
+
+def signature_v4(request: str, amz_date: str, region: str, credential: str) -> str:
+    """The AWS Signature V4 signature of a canonical `request` for S3."""
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, _sha256(request.encode())])
+    key = f"AWS4{credential}".encode()
+    for part in (amz_date[:8], region, "s3", "aws4_request"):
+        key = _hmac(key, part)
+    return hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def sign_v4(
+    method: str,
+    host: str,
+    path: str,
+    query: str,
+    headers: Dict[str, str],
+    region: str,
+    identity: str,
+    credential: str,
+    now: Optional[datetime.datetime] = None,
+) -> Dict[str, str]:
+    """Return `headers` with AWS Signature V4 headers for an unsigned payload added.
+
+    `path` and `query` must already be in canonical form, see `canonical_target`.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+
+    headers = {k.lower(): v.strip() for k, v in headers.items()}
+    headers.update(
+        {"host": host, "x-amz-date": amz_date, "x-amz-content-sha256": "UNSIGNED-PAYLOAD"}
+    )
+    signed = sorted(
+        k
+        for k in headers
+        if k in ("host", "content-md5", "content-type") or k.startswith("x-amz-")
+    )
+    request = canonical_request(method, path, query, headers, signed, "UNSIGNED-PAYLOAD")
+    signature = signature_v4(request, amz_date, region, credential)
+    headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={identity}/{amz_date[:8]}/{region}/s3/aws4_request, "
+        f"SignedHeaders={';'.join(signed)}, Signature={signature}"
+    )
+    return headers
+
+
+class CacheEntry:
+    """An object kept in the cache."""
+
+    __slots__ = ("bucket", "key", "size", "headers", "path")
+
+    def __init__(self, bucket: str, key: str, size: int, headers: Dict[str, str], path: Path):
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.headers = headers
+        self.path = path
+
+    def open(self) -> BinaryIO:
+        """The object's data, raising FileNotFoundError if it was evicted meanwhile."""
+        return open(self.path, "rb")
+
+
+class Invalidations:
+    """Invalidations since the oldest cache fill in progress.
+
+    A fill which started before its object was written to or deleted must not be kept.
+    Callers hold their cache's lock around every method.
+    """
+
+    def __init__(self):
+        self._sequence = 0
+        self._invalidated: Dict[Tuple[str, Optional[str]], int] = {}
+        self._fills = 0
+
+    def start_fill(self) -> int:
+        """Note a fill starting, returning the sequence number to check it against."""
+        self._fills += 1
+        return self._sequence
+
+    def end_fill(self, bucket: str, key: str, sequence: int) -> bool:
+        """Note a fill ending, returning whether it may be kept."""
+        raced = max(
+            self._invalidated.get((bucket, key), -1),
+            self._invalidated.get((bucket, None), -1),
+        )
+        self._fills -= 1
+        if not self._fills:
+            self._invalidated.clear()
+        return raced < sequence
+
+    def record(self, bucket: str, key: Optional[str]):
+        """Note that an object, or a whole bucket if `key` is None, was invalidated."""
+        self._sequence += 1
+        if self._fills:
+            self._invalidated[(bucket, key)] = self._sequence
+
+
+class DiskCache:
+    """Whole objects on disk under `root`, evicted least recently used first.
+
+    Each object is a data file named after a hash of its bucket and key, next to a JSON
+    file with its bucket, key and headers. The index of entries, in LRU order, is kept
+    in memory and rebuilt from the files' modification times when the cache is opened,
+    which is also when any half-written files from an earlier run are removed.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // MAX_ENTRY_SHARE
+        self.hits = self.misses = self.evictions = 0
+        self.size = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = Invalidations()
+        self._load()
+
+    @staticmethod
+    def _id(bucket: str, key: str) -> str:
+        return hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest()
+
+    def _load(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        found = []
+        for meta_path in self.root.glob("*/*.json"):
+            data_path = meta_path.with_suffix("")
+            try:
+                meta = json.loads(meta_path.read_text())
+                stat = data_path.stat()
+            except (OSError, ValueError):
+                meta_path.unlink(missing_ok=True)
+                continue
+            entry = CacheEntry(
+                meta["bucket"], meta["key"], stat.st_size, meta["headers"], data_path
+            )
+            found.append((stat.st_mtime, data_path.name, entry))
+        for _, name, entry in sorted(found, key=lambda item: item[:2]):
+            self._entries[name] = entry
+            self.size += entry.size
+        for stale in self.root.glob("*/.fill-*"):
+            stale.unlink(missing_ok=True)
+        with self._lock:
+            self._evict()
+
+    def get(self, bucket: str, key: str, count: bool = True) -> Optional[CacheEntry]:
+        """The entry for an object, if it is cached, marking it as recently used."""
+        entry_id = self._id(bucket, key)
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                self._entries.move_to_end(entry_id)
+            if count:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        if entry is not None:
+            try:
+                # Keep the order across restarts.
+                os.utime(entry.path)
+            except FileNotFoundError:
+                return None
+        return entry
+
+    def fill(self, bucket: str, key: str, headers: Dict[str, str]) -> "CacheFill":
+        """Start caching an object, which is committed once all its data is written."""
+        with self._lock:
+            sequence = self._invalidations.start_fill()
+        return CacheFill(self, bucket, key, headers, sequence)
+
+    def _commit(self, fill: "CacheFill", tmp: Path) -> bool:
+        entry_id = self._id(fill.bucket, fill.key)
+        data_path = self.root / entry_id[:2] / entry_id
+        with self._lock:
+            keep = self._invalidations.end_fill(fill.bucket, fill.key, fill.sequence)
+            keep = keep and fill.size <= self.max_entry_bytes
+            if keep:
+                self._remove(entry_id)
+                meta = {"bucket": fill.bucket, "key": fill.key, "headers": fill.headers}
+                data_path.with_suffix(".json").write_text(json.dumps(meta))
+                os.replace(tmp, data_path)
+                entry = CacheEntry(fill.bucket, fill.key, fill.size, fill.headers, data_path)
+                self._entries[entry_id] = entry
+                self.size += fill.size
+                self._evict()
+        return keep
+
+    def _abort(self, fill: "CacheFill"):
+        with self._lock:
+            self._invalidations.end_fill(fill.bucket, fill.key, fill.sequence)
+
+    def invalidate(self, bucket: str, key: Optional[str] = None):
+        """Drop an object, or every object in `bucket` if `key` is None."""
+        with self._lock:
+            self._invalidations.record(bucket, key)
+            if key is not None:
+                self._remove(self._id(bucket, key))
+                return
+            for entry_id in [i for i, e in self._entries.items() if e.bucket == bucket]:
+                self._remove(entry_id)
+
+    def _remove(self, entry_id: str) -> bool:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return False
+        self.size -= entry.size
+        entry.path.unlink(missing_ok=True)
+        entry.path.with_suffix(".json").unlink(missing_ok=True)
+        return True
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def metrics(self):
+        """The cache's counters, as `metrics_exporter` metrics."""
+        with self._lock:
+            values = {
+                "s3proxy_cache_hits_total": ("counter", "GETs served from the cache.", self.hits),
+                "s3proxy_cache_misses_total": (
+                    "counter",
+                    "GETs of uncached objects.",
+                    self.misses,
+                ),
+                "s3proxy_cache_evictions_total": (
+                    "counter",
+                    "Objects evicted to make room for others.",
+                    self.evictions,
+                ),
+                "s3proxy_cache_size_bytes": ("gauge", "Bytes of objects cached.", self.size),
+                "s3proxy_cache_capacity_bytes": ("gauge", "Maximum cache size.", self.max_bytes),
+                "s3proxy_cache_objects": ("gauge", "Objects cached.", len(self._entries)),
+            }
+        return {name: (kind, text, {"": value}) for name, (kind, text, value) in values.items()}
+
+
+class CacheFill:
+    """An object being written to the cache as it is downloaded."""
+
+    def __init__(self, cache: DiskCache, bucket: str, key: str, headers: Dict[str, str], sequence):
+        self.cache = cache
+        self.bucket = bucket
+        self.key = key
+        self.headers = headers
+        self.sequence = sequence
+        self.size = 0
+        directory = cache.root / DiskCache._id(bucket, key)[:2]
+        directory.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".fill-")
+        self._tmp = Path(tmp)
+        self._file: Optional[BinaryIO] = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        """Append downloaded data, giving up once the object is too large to keep."""
+        if self._file is None:
+            return
+        self.size += len(data)
+        if self.size > self.cache.max_entry_bytes:
+            self.abort()
+            return
+        self._file.write(data)
+
+    def commit(self) -> bool:
+        """Add the object to the cache, unless it was written to since the fill started."""
+        if self._file is None:
+            return False
+        self._file.close()
+        self._file = None
+        if not self.cache._commit(self, self._tmp):
+            self._tmp.unlink(missing_ok=True)
+            return False
+        return True
+
+    def abort(self):
+        """Discard what was written."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._tmp.unlink(missing_ok=True)
+        self.cache._abort(self)
+
+
+class _LimitedReader:
+    """Reads at most `remaining` bytes from `stream`, for streaming request bodies."""
+
+    def __init__(self, stream: BinaryIO, remaining: int):
+        self.stream = stream
+        self.remaining = remaining
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class _ChunkedReader:
+    """Decodes a chunked request body from `stream` as it is read, for streaming it on."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.remaining = 0
+        self.done = False
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            return b"".join(iter(lambda: self.read(CHUNK_SIZE), b""))
+        if not size:
+            return b""
+        while not self.done and not self.remaining:
+            self.remaining = self._chunk_size()
+            if not self.remaining:
+                # The last chunk, followed by optional trailers up to an empty line.
+                while self.stream.readline(MAX_LINE).strip():
+                    pass
+                self.done = True
+        if self.done:
+            return b""
+        data = self.stream.read(min(size, self.remaining))
+        if not data:
+            raise ConnectionResetError("chunked request body ended early")
+        self.remaining -= len(data)
+        if not self.remaining:
+            # The line break ending the chunk.
+            self.stream.readline(MAX_LINE)
+        return data
+
+    def _chunk_size(self) -> int:
+        line = self.stream.readline(MAX_LINE)
+        try:
+            # Chunk extensions, after a semicolon, are ignored.
+            return int(line.split(b";", 1)[0], 16)
+        except ValueError:
+            raise ConnectionAbortedError(f"invalid chunk size line {line[:32]!r}") from None
+
+
+def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """The inclusive byte range of a single-range `Range` header, if it is satisfiable."""
+    unit, _, spec = value.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+class CachingHandler(BaseHTTPRequestHandler):
+    """Forwards requests to the server's upstream, and serves GETs from its cache.
+
+    Subclasses may restrict which requests the cache serves, and which headers are
+    forwarded.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server: "CacheGateway"
+    unforwarded = _UNFORWARDED
+
+    def do_GET(self):  # noqa: N802
+        """Handle a request, whichever its method."""
+        self._handle()
+
+    do_HEAD = do_PUT = do_POST = do_DELETE = do_GET  # noqa: N815
+
+    def log_message(self, format, *args):  # noqa: A002
+        """Log requests at debug level, rather than to stderr."""
+        logger.debug(format, *args)
+
+    def _handle(self):
+        target = urlsplit(self.path)
+        bucket, _, key = unquote(target.path).lstrip("/").partition("/")
+        if self.command in ("GET", "HEAD") and key and not target.query:
+            if self.may_use_cache() and self._serve_cached(bucket, key):
+                return
+        elif self.command not in ("GET", "HEAD") and bucket:
+            # Before and after, as a GET racing with the write may refill the cache.
+            self.server.cache.invalidate(bucket, key or None)
+        try:
+            self._forward(target.path, target.query, bucket, key)
+        finally:
+            if self.command not in ("GET", "HEAD") and bucket:
+                self.server.cache.invalidate(bucket, key or None)
+
+    def may_use_cache(self) -> bool:
+        """Whether this request may be served from the cache."""
+        return True
+
+    def _serve_cached(self, bucket: str, key: str) -> bool:
+        """Serve a GET or HEAD from the cache, if it can be."""
+        conditions = {h.lower() for h in self.headers if h.lower().startswith("if-")}
+        if conditions - {"if-none-match"}:
+            return False
+        entry = self.server.cache.get(bucket, key, count=self.command == "GET")
+        if entry is None:
+            return False
+
+        if conditions and self.headers["If-None-Match"] == entry.headers.get("etag"):
+            self.send_response(304)
+            self._send_object_headers(entry.headers, length=0)
+            return True
+
+        status, start, end = 200, 0, entry.size - 1
+        if "Range" in self.headers:
+            satisfiable = _parse_range(self.headers["Range"], entry.size)
+            if satisfiable is None:
+                return False
+            status, (start, end) = 206, satisfiable
+        try:
+            f = entry.open()
+        except FileNotFoundError:
+            # Evicted since it was looked up.
+            return False
+        with f:
+            self.send_response(status)
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{entry.size}")
+            self._send_object_headers(entry.headers, length=end - start + 1)
+            if self.command == "GET":
+                self._copy(f, start, end - start + 1)
+        return True
+
+    def _copy(self, f: BinaryIO, offset: int, length: int):
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            self.wfile.write(data)
+            length -= len(data)
+
+    def _send_object_headers(self, headers: Dict[str, str], length: int):
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def request_body(self) -> Tuple[Optional[BinaryIO], Optional[int]]:
+        """A reader streaming the request's body, if it has one, and its length if known."""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            return _ChunkedReader(self.rfile), None
+        length = int(self.headers.get("Content-Length") or 0)
+        return (_LimitedReader(self.rfile, length), length) if length else (None, 0)
+
+    def _forward(self, path: str, query: str, bucket: str, key: str):
+        body, length = self.request_body()
+        unforwarded = self.unforwarded
+        if length is None:
+            # Chunked again upstream, as http.client does with bodies of unknown length.
+            unforwarded = unforwarded | {"content-length"}
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in unforwarded}
+        if length:
+            headers["Content-Length"] = str(length)
+
+        try:
+            response = self.server.upstream.request(self.command, path, query, headers, body)
+        except OSError as e:
+            logger.warning("%s %s failed: %s", self.command, self.path, e)
+            self.close_connection = True
+            self.send_error(502)
+            return
+        cacheable = (
+            self.command == "GET"
+            and key
+            and not query
+            and response.status == 200
+            and not any(h.lower() in ("range", "if-none-match") for h in self.headers)
+        )
+        fill = None
+        if cacheable:
+            object_headers = {
+                k.lower(): v for k, v in response.getheaders() if k.lower() in _OBJECT_HEADERS
+            }
+            object_headers.update(
+                (k.lower(), v)
+                for k, v in response.getheaders()
+                if k.lower().startswith("x-amz-meta-")
+            )
+            fill = self.server.cache.fill(bucket, key, object_headers)
+        try:
+            self._relay(response, fill)
+        except BaseException:
+            if fill is not None:
+                fill.abort()
+            raise
+        if fill is not None:
+            fill.commit()
+
+    def _relay(self, response: http.client.HTTPResponse, fill: Optional[CacheFill]):
+        self.send_response_only(response.status, response.reason)
+        for name, value in response.getheaders():
+            if name.lower() not in HOP_BY_HOP:
+                self.send_header(name, value)
+        chunked = (
+            response.getheader("Content-Length") is None
+            and self.command != "HEAD"
+            and response.status not in (204, 304)
+        )
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for data in iter(lambda: response.read(CHUNK_SIZE), b""):
+            if fill is not None:
+                fill.write(data)
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+
+class Upstream:
+    """An HTTP server requests are forwarded to, with a kept-alive connection per thread."""
+
+    def __init__(self, endpoint: str):
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme or "https"
+        self.host = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self._local = threading.local()
+
+    def _connection(self, fresh: bool = False) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or fresh:
+            if connection is not None:
+                connection.close()
+            cls = http.client.HTTPConnection
+            if self.scheme == "https":
+                cls = http.client.HTTPSConnection
+            connection = self._local.connection = cls(self.host, timeout=60)
+        return connection
+
+    def request(self, method, path, query, headers, body) -> http.client.HTTPResponse:
+        """Send a request as it is, and return its response."""
+        path = self.prefix + path
+        return self._send(method, f"{path}?{query}" if query else path, headers, body)
+
+    def _send(self, method, url, headers, body) -> http.client.HTTPResponse:
+        for attempt in range(2):
+            connection = self._connection(fresh=attempt > 0)
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                return connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # A kept-alive connection the server closed; only safe to retry without a body.
+                if body is not None or attempt:
+                    raise
+        raise AssertionError("unreachable")  # pragma: nocover
+
+
+class Remote(Upstream):
+    """The remote S3 store, which requests are re-signed for."""
+
+    def __init__(self, endpoint: str, region: str, identity: str, credential: str):
+        super().__init__(endpoint)
+        self.region = region
+        self.identity = identity
+        self.credential = credential
+
+    def request(self, method, path, query, headers, body) -> http.client.HTTPResponse:
+        """Send a request, signed for the remote, and return its response."""
+        path, query = canonical_target(self.prefix + path, query)
+        signed = sign_v4(
+            method, self.host, path, query, headers, self.region, self.identity, self.credential
+        )
+        return self._send(method, f"{path}?{query}" if query else path, signed, body)
+
+
+class CacheGateway(ThreadingHTTPServer):
+    """Forwards S3 requests to `upstream`, serving what it can from `cache`."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        upstream: Upstream,
+        cache,
+        handler=CachingHandler,
+    ):
+        super().__init__(address, handler)
+        self.upstream = upstream
+        self.cache = cache
+
+
+def report_metrics(cache, directory: Path, name: str):
+    """Write `cache`'s metrics to `directory` every METRICS_INTERVAL seconds, forever."""
+    while True:
+        write_textfile(directory, name, cache.metrics())
+        time.sleep(METRICS_INTERVAL)
+
+
+def main():
+    """Run the gateway, with the remote's credentials from the environment."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", default="127.0.0.1:8081", help="address:port to serve on")
+    parser.add_argument("--remote", required=True, help="endpoint URL of the remote S3 store")
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--cache-size", type=int, required=True, help="in bytes")
+    parser.add_argument("--metrics-dir", help="directory to write metrics to")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    remote = Remote(
+        args.remote, args.region, os.environ["REMOTE_IDENTITY"], os.environ["REMOTE_CREDENTIAL"]
+    )
+    cache = DiskCache(Path(args.cache_dir), args.cache_size)
+    if args.metrics_dir:
+        threading.Thread(
+            target=report_metrics, args=(cache, Path(args.metrics_dir), "cache"), daemon=True
+        ).start()
+    host, port = args.listen.rsplit(":", 1)
+    logger.info("caching %s in %s, up to %d bytes", args.remote, args.cache_dir, cache.max_bytes)
+    CacheGateway((host, int(port)), remote, cache).serve_forever()
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
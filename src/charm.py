@@ -6,33 +6,186 @@
 
 """A Juju Charmed Operator for s3proxy."""
 
+import datetime
+import json
 import logging
+import math
+import os
 import re
 import secrets
+import shlex
 import socket
 import string
 from dataclasses import dataclass, fields
-from typing import Any, Dict, Literal, Optional
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional
 
 import boto3
-from boto3 import resource as s3client
 from botocore import exceptions
 from charms.observability_libs.v0.kubernetes_service_patch import KubernetesServicePatch
 from charms.s3proxy_k8s.v0.object_storage import (
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    DEFAULT_MULTIPART_CHUNKSIZE,
     ObjectStorageDataProvidedEvent,
     ObjectStorageDataRefreshEvent,
     SingleAuthObjectStorageProvider,
 )
+from lightkube import Client
+from lightkube.core.exceptions import ApiError
+from lightkube.resources.core_v1 import Service
+from lightkube.types import PatchType
+from lightkube.utils.quantity import parse_quantity
 from ops.charm import ActionEvent, CharmBase, HookEvent, WorkloadEvent
-from ops.framework import StoredState
+from ops.framework import Object, StoredState
 from ops.main import main
-from ops.model import ActiveStatus, WaitingStatus
-from ops.pebble import Layer
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.pebble import APIError, ExecError, Layer, PathError
+
+import lifecycle
+import scrub
+import snapshot
+import usage
+from metrics_exporter import write_textfile
 
 DATA_DIR = "/data"
+METRICS_DIR = f"{DATA_DIR}/metrics"
+METRICS_PORT = 9102
+# Where the charm's own services are installed in the workload container.
+WORKLOAD_LIB = "/usr/local/lib/s3proxy-charm"
+# The oldest python3 which runs them, as the workload image brings its own.
+WORKLOAD_PYTHON = (3, 8)
+NO_WORKLOAD_PYTHON = "the workload image has no python3 >= {}.{}".format(*WORKLOAD_PYTHON)
+WORKLOAD_SCRIPTS = (
+    "access_log.py",
+    "cache_gateway.py",
+    "front_cache.py",
+    "jobs.py",
+    "lifecycle.py",
+    "metrics_exporter.py",
+    "migration.py",
+    "scrub.py",
+    "transfer.py",
+    "usage.py",
+)
+CACHE_GATEWAY_ADDRESS = "127.0.0.1:8081"
+PROXY_CACHE_PORT = 8090
+# s3proxy's log levels, and the Python logging levels the charm's own services use for them.
+LOG_LEVELS = {
+    "trace": "DEBUG",
+    "debug": "DEBUG",
+    "info": "INFO",
+    "warn": "WARNING",
+    "error": "ERROR",
+}
+REMOTE_BACKENDS = ("aws-s3", "s3")
+# How far below storage-threshold usage must drop for s3proxy to be made writable again.
+READ_ONLY_HYSTERESIS = 5
+LIFECYCLE_DIR = f"{DATA_DIR}/lifecycle"
+# The rules the expiry job applies: those from config merged with the action's.
+EXPIRY_RULES = f"{LIFECYCLE_DIR}/rules.json"
+# Rules set with the set-expiry action, on top of the expiry-rules config option.
+ACTION_RULES = f"{LIFECYCLE_DIR}/action-rules.json"
+EXPIRY_INTERVAL = 60 * 60
+SCRUB_STATE = f"{DATA_DIR}/scrub/state.json"
+# While migrating between backends, s3proxy is pointed at the migration gateway, in front
+# of the old and new backends, and a second s3proxy serves the filesystem one to it.
+MIGRATION_ADDRESS = "127.0.0.1:8083"
+BLOBSTORE_ADDRESS = "127.0.0.1:8082"
+MIGRATION_DIR = f"{DATA_DIR}/migration"
+MIGRATION_STATE = f"{MIGRATION_DIR}/state.json"
+# Every service the charm may put in its layer; any other in the plan isn't the charm's.
+MANAGED_SERVICES = (
+    "s3proxy",
+    "cache-gateway",
+    "proxy-cache",
+    "s3proxy-filesystem",
+    "migration",
+    "expiry",
+    "usage",
+    "scrub",
+    "metrics",
+)
+FILESYSTEM_ARGS = {
+    "jclouds.region": "us-east-1",
+    "jclouds.provider": "filesystem",
+    "jclouds.identity": "remote-identity",
+    "jclouds.filesystem.basedir": f"{DATA_DIR}/blobstore",
+}
+MiB = 1024 * 1024
+# Jetty's default thread pool size, which bounds the requests s3proxy serves at once.
+JETTY_MAX_THREADS = 200
+# S3 requires multipart parts (but the last) to be at least 5 MiB.
+MIN_PART_SIZE = 5 * MiB
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class StorageUsage:
+    """How full a filesystem is, in bytes and in inodes, from a single `statvfs`."""
+
+    size: int
+    available: int
+    used: int
+    inodes: int
+    free_inodes: int
+
+    @classmethod
+    def of(cls, path: Path) -> "StorageUsage":
+        """The usage of the filesystem `path` is on."""
+        st = os.statvfs(path)
+        return cls(
+            size=st.f_blocks * st.f_frsize,
+            available=st.f_bavail * st.f_frsize,
+            used=(st.f_blocks - st.f_bfree) * st.f_frsize,
+            inodes=st.f_files,
+            free_inodes=st.f_favail,
+        )
+
+    @property
+    def percent(self) -> float:
+        """Bytes used, as df counts them: out of what non-root users can have."""
+        usable = self.used + self.available
+        return 100 * self.used / usable if usable else 0
+
+    @property
+    def inodes_percent(self) -> float:
+        """Inodes used; 0 where the filesystem doesn't limit them."""
+        return 100 * (self.inodes - self.free_inodes) / self.inodes if self.inodes else 0
+
+    @property
+    def pressure(self) -> float:
+        """The higher of the bytes and inodes used, in percent."""
+        return max(self.percent, self.inodes_percent)
+
+    def describe(self) -> str:
+        """Whichever of bytes or inodes runs out first, for a status message."""
+        if self.inodes_percent > self.percent:
+            return f"{self.inodes_percent:.0f}% of inodes used"
+        return f"{self.percent:.0f}% full"
+
+    def metrics(self, read_only: bool):
+        """The usage, and whether s3proxy was made read-only because of it, as metrics."""
+        return {
+            "s3proxy_storage_size_bytes": ("gauge", "Size of the storage.", {"": self.size}),
+            "s3proxy_storage_available_bytes": (
+                "gauge",
+                "Bytes of the storage available to s3proxy.",
+                {"": self.available},
+            ),
+            "s3proxy_storage_inodes": ("gauge", "Inodes of the storage.", {"": self.inodes}),
+            "s3proxy_storage_free_inodes": (
+                "gauge",
+                "Inodes of the storage still free.",
+                {"": self.free_inodes},
+            ),
+            "s3proxy_storage_read_only": (
+                "gauge",
+                "Whether s3proxy was made read-only until storage is freed.",
+                {"": int(read_only)},
+            ),
+        }
+
+
 @dataclass
 class S3ProxyConfig:
     """A basic holder and transformer for S3Proxy Configuration."""
@@ -42,6 +195,7 @@ class S3ProxyConfig:
     credential: str = ""
     cors_allow_all: bool = True
     endpoint: str = "http://0.0.0.0:8080"
+    v4_max_non_chunked_request_size: int = 32 * MiB
 
     def as_args(self) -> Dict[str, Any]:
         """Return as substituted environment variables."""
@@ -54,8 +208,56 @@ class S3ProxyConfig:
 
     @classmethod
     def from_dict(cls, obj):
-        """Build an object from a dict."""
-        return cls(**obj)
+        """Build an object from a dict, ignoring keys which aren't s3proxy settings."""
+        names = {field.name for field in fields(cls)}
+        return cls(**{k: v for k, v in obj.items() if k in names})
+
+
+class CredentialStore(Object):
+    """The S3 credentials, resolved once per dispatch and persisted only when they change.
+
+    Credentials set in config take precedence. Otherwise they are generated once and kept
+    in `stored`, which is only written when what it holds changes, so that reading the
+    credentials doesn't dirty the charm's state on every hook.
+    """
+
+    def __init__(self, charm: CharmBase, stored: StoredState):
+        super().__init__(charm, "credentials")
+        self._charm = charm
+        self._stored = stored
+        self._resolved: Optional[Dict[str, str]] = None
+        # Config can only change between dispatches, or between events in a test harness.
+        self.framework.observe(charm.on.config_changed, self._forget)
+        self.framework.observe(self.framework.on.commit, self._forget)
+
+    def _forget(self, _):
+        self._resolved = None
+
+    def get(self) -> Dict[str, str]:
+        """Return the identity and credential, generating them if needed."""
+        if self._resolved is None:
+            self._resolved = self._resolve()
+        return dict(self._resolved)
+
+    def _resolve(self) -> Dict[str, str]:
+        config = self._charm.config
+        identity = config.get("identity", "") or self._stored.identity  # type: ignore
+        credential = config.get("credential", "").lower() or self._stored.credential  # type: ignore
+
+        # The AWS default lengths for access and secret keys are 20 and 40 characters
+        identity = identity or self._generate(20)
+        credential = credential or self._generate(40)
+
+        if self._stored.identity != identity:  # type: ignore
+            self._stored.identity = identity  # type: ignore
+        if self._stored.credential != credential:  # type: ignore
+            self._stored.credential = credential  # type: ignore
+        return {"identity": identity, "credential": credential}
+
+    @staticmethod
+    def _generate(length: int) -> str:
+        alphabet = string.ascii_letters + string.digits
+        return "".join(secrets.choice(alphabet) for _ in range(length))
 
 
 class S3ProxyK8SOperatorCharm(CharmBase):
@@ -76,43 +278,242 @@ class S3ProxyK8SOperatorCharm(CharmBase):
         self._stored.set_default(  # type: ignore
             identity="",
             credential="",
+            routed_port=self.http_listen_port,
+            # Checked once per start of the workload container, see `_workload_python`.
+            workload_python=None,
+            # Whether s3proxy was last made read-only, or None if its services weren't applied.
+            read_only=None,
         )
+        self._credential_store = CredentialStore(self, self._stored)
 
-        self.service_patch = KubernetesServicePatch(self, [(self.app.name, self.http_listen_port)])
+        # Clients go through the proxy cache, when there is one.
+        self.service_patch = KubernetesServicePatch(
+            self,
+            [(self.app.name, self.http_listen_port, self._client_port), ("metrics", METRICS_PORT)],
+        )
 
         self.object_storage = SingleAuthObjectStorageProvider(self, "s3")
         self.framework.observe(self.object_storage.on.requested, self._on_client_requested)
         self.framework.observe(self.object_storage.on.refresh, self._on_refresh_endpoint)
         self.framework.observe(self.on.get_credentials_action, self._on_get_credentials)  # type: ignore
+        self.framework.observe(self.on.set_expiry_action, self._on_set_expiry)  # type: ignore
+        self.framework.observe(self.on.expiry_report_action, self._on_expiry_report)  # type: ignore
+        self.framework.observe(self.on.bucket_usage_action, self._on_bucket_usage)  # type: ignore
+        self.framework.observe(self.on.export_bucket_action, self._on_transfer)  # type: ignore
+        self.framework.observe(self.on.import_bucket_action, self._on_transfer)  # type: ignore
+        self.framework.observe(self.on.snapshot_action, self._on_snapshot)  # type: ignore
+        self.framework.observe(self.on.scrub_report_action, self._on_scrub_report)  # type: ignore
+
+        # The proxy in front of s3proxy pushes the access log to Loki.
+        self.framework.observe(self.on["logging"].relation_changed, self._on_logging_changed)
+        self.framework.observe(self.on["logging"].relation_departed, self._on_logging_changed)
 
         self.framework.observe(self.on.s3proxy_pebble_ready, self._on_s3proxy_pebble_ready)  # type: ignore
         self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.update_status, self._on_update_status)
 
     @property
     def _credentials(self) -> Dict[str, Any]:
         """Generate credentials if they don't exist and aren't set in config."""
-        alphabet = string.ascii_letters + string.digits
+        return self._credential_store.get()
 
-        identity = self.config.get("identity", "") or self._stored.identity  # type: ignore
-        credential = self.config.get("credential", "").lower() or self._stored.credential  # type: ignore
+    def _on_get_credentials(self, event: ActionEvent) -> None:
+        """Return the connection credentials."""
+        cred = self._credentials
+        event.set_results({"identity": cred["identity"], "credential": cred["credential"]})
 
-        if not identity:
-            # The AWS default for access key length is 20 characters
-            identity = "".join(secrets.choice(alphabet) for i in range(20))
+    def _on_set_expiry(self, event: ActionEvent) -> None:
+        """Set how long objects of a bucket are kept, or stop expiring them."""
+        if self.config.get("backend", "filesystem") != "filesystem":
+            event.fail("expiry needs the filesystem backend")
+            return
+        if not self._container.can_connect():
+            event.fail("Pebble is not ready")
+            return
+        bucket, prefix, days = event.params["bucket"], event.params["prefix"], event.params["days"]
+        rules = [r for r in self._action_rules() if (r.bucket, r.prefix) != (bucket, prefix)]
+        if days:
+            try:
+                rules += lifecycle.parse_rules(
+                    [{"bucket": bucket, "days": days, "prefix": prefix}]
+                )
+            except ValueError as e:
+                event.fail(str(e))
+                return
+        self._container.push(ACTION_RULES, lifecycle.rules_as_json(rules), make_dirs=True)
+        self._configure()
+        event.set_results({"rules": lifecycle.rules_as_json(self._expiry_rules())})
 
-        if not credential:
-            # The AWS default for access key length is 40 characters
-            credential = "".join(secrets.choice(alphabet) for i in range(40))
+    def _on_expiry_report(self, event: ActionEvent) -> None:
+        """Return what the last expiry runs reclaimed, and how far a run in progress is."""
+        if not self._container.can_connect():
+            event.fail("Pebble is not ready")
+            return
+        state = self._pull_state(f"{LIFECYCLE_DIR}/state.json")
+        results = {}
+        for i, run in enumerate(reversed(state.get("runs", []))):
+            results[f"run-{i}"] = {
+                "finished": _timestamp(run["finished"]),
+                "objects": run["objects"],
+                "bytes": run["bytes"],
+            }
+        if "checkpoint" in state:
+            run = state["checkpoint"]["run"]
+            results["in-progress"] = {
+                "started": _timestamp(run["started"]),
+                "reached": "/".join(state["checkpoint"]["path"]),
+                "objects": run["objects"],
+                "bytes": run["bytes"],
+            }
+        event.set_results(results or {"runs": "none"})
 
-        self._stored.identity = identity or ""  # type: ignore
-        self._stored.credential = credential  # type: ignore
+    def _on_bucket_usage(self, event: ActionEvent) -> None:
+        """Return the object count and size of buckets, logging each as it is counted.
 
-        return {"identity": identity, "credential": credential}
+        The index is kept on the storage, which the charm's container mounts too, so this
+        works from there rather than through Pebble.
+        """
+        if self.config.get("backend", "filesystem") != "filesystem":
+            event.fail("usage is only known with the filesystem backend")
+            return
+        storages = self.model.storages["s3proxy-store"]
+        if not storages:
+            event.fail("s3proxy-store is not attached")
+            return
+        root = storages[0].location
+        index = usage.BucketUsage(root / "blobstore", root / "usage")
+        bucket = event.params.get("bucket")
 
-    def _on_get_credentials(self, event: ActionEvent) -> None:
-        """Return the connection credentials."""
-        cred = self._credentials
-        event.set_results({"identity": cred["identity"], "credential": cred["credential"]})
+        results, usages = {}, []
+        for i, bucket_usage in enumerate(index.update([bucket] if bucket else None)):
+            event.log(
+                f"{bucket_usage.bucket}: {bucket_usage.objects} objects, {bucket_usage.bytes} bytes"
+            )
+            results[f"bucket-{i}"] = {
+                "name": bucket_usage.bucket,
+                "objects": bucket_usage.objects,
+                "bytes": bucket_usage.bytes,
+            }
+            usages.append(bucket_usage)
+        if not bucket:
+            write_textfile(root / "metrics", "usage", usage.metrics(usages))
+        event.set_results(results or {"buckets": "none"})
+
+    def _on_transfer(self, event: ActionEvent) -> None:
+        """Export a bucket to, or import it from, a path of the workload container.
+
+        The transfer runs in the workload container, where the path is mounted, logging its
+        progress as it goes. Run again after a failure, it resumes where it stopped.
+        """
+        if self.config.get("backend", "filesystem") != "filesystem":
+            event.fail("buckets can only be transferred with the filesystem backend")
+            return
+        if not self._container.can_connect():
+            event.fail("Pebble is not ready")
+            return
+        if not self._workload_python:
+            event.fail(NO_WORKLOAD_PYTHON)
+            return
+        self._push_workload_scripts()
+        direction = event.handle.kind.split("_")[0]
+        command = [
+            "python3",
+            f"{WORKLOAD_LIB}/transfer.py",
+            direction,
+            f"--basedir={DATA_DIR}/blobstore",
+            f"--work-dir={DATA_DIR}/transfers",
+            f"--bucket={event.params['bucket']}",
+            f"--path={event.params['path']}",
+            f"--format={event.params.get('format', 'directory')}",
+            f"--parallel={event.params.get('parallel', 4)}",
+        ]
+        process = self._container.exec(command, combine_stderr=True)
+        progress = {}
+        for line in process.stdout:
+            try:
+                progress = json.loads(line)
+                event.log(f"{progress['objects']} objects, {progress['bytes']} bytes")
+            except ValueError:
+                event.log(line.rstrip())
+        try:
+            process.wait()
+        except ExecError as e:
+            event.fail(f"{direction} of {event.params['bucket']} failed ({e.exit_code})")
+            return
+        event.set_results(
+            {"objects": progress.get("objects", 0), "bytes": progress.get("bytes", 0)}
+        )
+
+    def _on_snapshot(self, event: ActionEvent) -> None:
+        """Snapshot the blobstore, linking what the previous snapshot has, and prune old ones."""
+        if self.config.get("backend", "filesystem") != "filesystem":
+            event.fail("snapshots are only taken with the filesystem backend")
+            return
+        storages = self.model.storages["s3proxy-store"]
+        if not storages:
+            event.fail("s3proxy-store is not attached")
+            return
+        root = storages[0].location
+        snapshots = snapshot.Snapshots(root / "blobstore", root / "snapshots")
+        try:
+            result = snapshots.take(keep=self.config.get("snapshot-retention", 7))
+        except (OSError, ValueError) as e:
+            event.fail(f"snapshot failed: {e}")
+            return
+        event.set_results(
+            {
+                "name": result.name,
+                "path": f"{DATA_DIR}/snapshots/{result.name}",
+                "linked": result.linked,
+                "copied": result.copied,
+                "copied-bytes": result.copied_bytes,
+                "pruned": ",".join(result.pruned) or "none",
+            }
+        )
+
+    def _on_scrub_report(self, event: ActionEvent) -> None:
+        """Return what the last scrub checked, how far one in progress is, and what's corrupt."""
+        if not self._container.can_connect():
+            event.fail("Pebble is not ready")
+            return
+        state = self._pull_state(SCRUB_STATE)
+        runs = state.get("runs", [])
+        results = {}
+        if runs:
+            run = runs[-1]
+            results["last-run"] = {
+                "finished": _timestamp(run["finished"]),
+                "objects": run["objects"],
+                "bytes": run["bytes"],
+                "unverified": run["unverified"],
+                "corrupt": run["mismatched"],
+            }
+        if "checkpoint" in state:
+            run = state["checkpoint"]["run"]
+            results["in-progress"] = {
+                "started": _timestamp(run["started"]),
+                "reached": "/".join(state["checkpoint"]["path"]),
+                "objects": run["objects"],
+                "bytes": run["bytes"],
+                "corrupt": run["mismatched"],
+            }
+        # Those found by the run in progress, else by the last one.
+        run = state.get("checkpoint", {}).get("run") or (runs[-1] if runs else {})
+        if run.get("mismatches"):
+            results["corrupt-objects"] = "\n".join(
+                f"{m['object']}: {m['actual']}, expected {m['expected']}"
+                for m in run["mismatches"]
+            )
+        event.set_results(results or {"runs": "none"})
+
+    def _pull_state(self, path: str) -> Dict[str, Any]:
+        """The state a workload job keeps at `path`, empty if it has none yet."""
+        if not self._container.exists(path):
+            return {}
+        try:
+            return json.loads(self._container.pull(path).read())
+        except (PathError, ValueError):
+            return {}
 
     @property
     def _config(self) -> S3ProxyConfig:
@@ -122,88 +523,666 @@ class S3ProxyK8SOperatorCharm(CharmBase):
         return S3ProxyConfig.from_dict(cfg)
 
     def _on_s3proxy_pebble_ready(self, event: WorkloadEvent):
+        # The container was (re)started, maybe from another image.
+        self._stored.workload_python = None  # type: ignore
         self._set_s3proxy_version()
         self._configure()
 
     def _on_config_changed(self, event: HookEvent):
         self._configure()
+        self._route_service()
+        # Resource limits may have changed, and with them the hints.
+        self.object_storage.update_endpoints(self._endpoint_data)
+
+    def _on_update_status(self, event: HookEvent):
+        """Keep the status, and read-only mode, in line with how full the storage is.
+
+        Only read-only mode depends on the storage, so the services are only applied again
+        when it changes, or if the last attempt didn't get to apply them.
+        """
+        read_only = self._stored.read_only  # type: ignore
+        storage = self._storage_usage()
+        if (
+            read_only is None
+            or self._read_only(storage, read_only) != read_only
+            or not self._container.can_connect()
+        ):
+            self._configure()
+            return
+        self._set_status(storage, read_only)
+
+    def _on_logging_changed(self, event: HookEvent):
+        # Loki's endpoints are arguments of the proxy keeping the access log.
+        self._configure()
 
     def _on_refresh_endpoint(self, event: ObjectStorageDataRefreshEvent):
         """Update observer endpoints with a new URI."""
-        self.object_storage.update_endpoints(
-            {
-                "endpoint": f"http://{self.hostname}:{self.http_listen_port}",
-            }
-        )
+        self.object_storage.update_endpoints(self._endpoint_data)
+
+    @property
+    def _endpoint_data(self) -> Dict[str, str]:
+        """The endpoint, along with hints on how clients should be sized."""
+        data = {"endpoint": f"http://{self.hostname}:{self._client_port}"}
+        data.update(self._performance_hints())
+        return data
+
+    def _performance_hints(self) -> Dict[str, str]:
+        """Client sizing hints derived from the resource limits and s3proxy's settings.
+
+        Concurrency scales with the cpu limit, leaving most of Jetty's threads to other
+        clients. Parts are sized so that a client's in-flight parts fit in a quarter of
+        the memory limit, and never exceed what s3proxy accepts in a single request.
+        """
+        max_request_size = self._config.v4_max_non_chunked_request_size
+
+        concurrency = DEFAULT_MAX_POOL_CONNECTIONS // 2
+        if cpu := self.config.get("cpu"):
+            concurrency = math.ceil(float(parse_quantity(cpu)) * 8)
+        concurrency = max(4, min(concurrency, JETTY_MAX_THREADS // 4))
+
+        part_size = DEFAULT_MULTIPART_CHUNKSIZE
+        if memory := self.config.get("memory"):
+            part_size = int(parse_quantity(memory)) // 4 // concurrency // MiB * MiB
+        part_size = max(MIN_PART_SIZE, min(part_size, max_request_size))
+
+        return {
+            "s3-uri-style": "path",
+            "max-request-size": str(max_request_size),
+            "recommended-concurrency": str(concurrency),
+            "multipart-part-size": str(part_size),
+        }
 
     def _on_client_requested(self, event: ObjectStorageDataProvidedEvent):
         """Update requirers with endpoint information."""
+        relation = event.relation
+        relation_id = relation.id
+        # A deferred event may predate the requirer asking for a different bucket.
+        bucket = relation.data[relation.app].get("bucket") or event.bucket
+        # The library only requests each relation's bucket once per dispatch.
         if not self._container.can_connect() or not self.is_ready:
             event.defer()
             return
 
-        client = s3client(
-            service_name="s3",
-            endpoint_url="http://127.0.0.1:8080",
-            aws_access_key_id=self._credentials["identity"],
-            aws_secret_access_key=self._credentials["credential"],
-        )
-
+        client = self._s3_client()
         try:
-            client.create_bucket(Bucket=event.bucket)
+            client.create_bucket(Bucket=bucket)
         except (
-            client.meta.client.exceptions.BucketAlreadyExists,
-            client.meta.client.exceptions.BucketAlreadyOwnedByYou,
+            client.exceptions.BucketAlreadyExists,
+            client.exceptions.BucketAlreadyOwnedByYou,
         ) as e:
             logger.debug("Bucket already exists: %r", e)
 
-        self.object_storage.update_endpoints(
+        credentials = self._credentials
+        data = self._endpoint_data
+        data.update(
             {
-                "endpoint": f"http://{self.hostname}:{self.http_listen_port}",
-                "access-key": self._credentials["identity"],
-                "secret-key": self._credentials["credential"],
-            },
-            event.relation.id,
+                "access-key": credentials["identity"],
+                "secret-key": credentials["credential"],
+            }
+        )
+        self.object_storage.update_endpoints(data, relation_id)
+
+    def _s3_client(self):
+        """An S3 client for the local s3proxy."""
+        credentials = self._credentials
+        return boto3.client(
+            service_name="s3",
+            endpoint_url=f"http://{self.instance_addr}:{self.http_listen_port}",
+            aws_access_key_id=credentials["identity"],
+            aws_secret_access_key=credentials["credential"],
         )
 
     def _configure(self):
+        read_only = self._apply()
+        if self._stored.read_only != read_only:  # type: ignore
+            self._stored.read_only = read_only  # type: ignore
+
+    def _apply(self) -> Optional[bool]:
+        """Apply the services and set the status, returning whether s3proxy is read-only.
+
+        Returns None if the services couldn't be applied.
+        """
         if not self._container.can_connect():
             self.unit.status = WaitingStatus("Waiting for Pebble ready")
-            return
+            return None
+
+        problem = self._config_problem()
+        if problem:
+            self.unit.status = BlockedStatus(problem)
+            return None
 
-        if self._container.get_plan().services != self._build_layer().services:
-            self._container.add_layer(self.name, self._build_layer(), combine=True)
-            self._container.replan()
+        expiry_rules = self._expiry_rules()
+        self._push_expiry_rules(expiry_rules)
+
+        plan = self._container.get_plan()
+        storage = self._storage_usage()
+        current = plan.services.get("s3proxy")
+        read_only = self._read_only(
+            storage, current is not None and "read-only-blobstore" in current.command
+        )
+        layer = self._build_layer(expiry=bool(expiry_rules), read_only=read_only)
+        if len(layer.services) > 1 and not self._workload_python:
+            # Anything besides s3proxy is one of the charm's own services, run by python3.
+            services = ", ".join(sorted(set(layer.services) - {"s3proxy"}))
+            self.unit.status = BlockedStatus(f"{NO_WORKLOAD_PYTHON}, for {services}")
+            return None
+        if self._wanted_services(plan) != layer.services:
+            if len(layer.services) > 1:
+                self._push_workload_scripts()
+            self._replace_services(plan, layer)
             logger.info("s3proxy (re)started")
+        if not self._migration_source and self._container.exists(MIGRATION_DIR):
+            # The migration is over, and a later one must not resume it.
+            self._container.remove_path(MIGRATION_DIR, recursive=True)
+        self._set_status(storage, read_only)
+        return read_only
+
+    def _set_status(self, storage: Optional[StorageUsage], read_only: bool):
+        """Set the status of a unit whose services are applied."""
+        self.unit.status = ActiveStatus(self._active_message())
+        if storage:
+            self._report_storage(storage, read_only)
+        corrupt = (
+            scrub.corrupt_objects(self._pull_state(SCRUB_STATE)) if self._scrub_interval else 0
+        )
+        if corrupt:
+            self.unit.status = BlockedStatus(
+                f"scrub found {corrupt} corrupt objects, see the scrub-report action"
+            )
+
+    def _push_expiry_rules(self, expiry_rules: List[lifecycle.Rule]):
+        """Give the expiry job its rules, or remove them when there are none."""
+        if expiry_rules:
+            # The job reads its rules afresh for every run, so they need no restart.
+            rules = lifecycle.rules_as_json(expiry_rules)
+            self._container.push(EXPIRY_RULES, rules, make_dirs=True)
+        elif self._container.exists(EXPIRY_RULES):
+            # Without rules, the job is stopped, and wouldn't expire anything if it ran.
+            self._container.remove_path(EXPIRY_RULES)
+
+    @staticmethod
+    def _wanted_services(plan) -> Dict[str, Any]:
+        """The charm's services in `plan` which weren't disabled as no longer wanted."""
+        return {
+            name: service
+            for name, service in plan.services.items()
+            if name in MANAGED_SERVICES and service.startup != "disabled"
+        }
+
+    def _replace_services(self, plan, layer: Layer):
+        """Apply `layer`, stopping and disabling the charm's services it leaves out.
+
+        Layers can't remove services from the plan, so those are overridden with a
+        disabled copy, which replanning leaves stopped.
+        """
+        unwanted = sorted(set(self._wanted_services(plan)) - set(layer.services))
+        services = layer.to_dict()["services"]
+        if unwanted:
+            services_info = self._container.get_services(*unwanted).values()
+            running = [info.name for info in services_info if info.is_running()]
+            if running:
+                self._container.stop(*running)
+            for name in unwanted:
+                disabled = plan.services[name].to_dict()
+                services[name] = {**disabled, "override": "replace", "startup": "disabled"}
+        self._container.add_layer(
+            self.name, Layer({**layer.to_dict(), "services": services}), combine=True
+        )
+        self._container.replan()
+
+    def _storage_usage(self) -> Optional[StorageUsage]:
+        """How full the filesystem backend's storage is, if this unit has it."""
+        if self.config.get("backend", "filesystem") != "filesystem":
+            return None
+        storages = self.model.storages["s3proxy-store"]
+        if not storages:
+            return None
+        try:
+            return StorageUsage.of(storages[0].location)
+        except OSError as e:
+            logger.warning("cannot check storage usage: %s", e)
+            return None
+
+    def _read_only(self, storage: Optional[StorageUsage], was_read_only: bool) -> bool:
+        """Whether s3proxy should refuse writes, until enough storage is freed."""
+        if not storage or not self.config.get("storage-read-only"):
+            return False
+        threshold = self.config.get("storage-threshold", 90)
+        if storage.pressure >= threshold:
+            return True
+        # Once read-only, stay so until usage is clearly below the threshold, not flapping.
+        return was_read_only and storage.pressure >= threshold - READ_ONLY_HYSTERESIS
+
+    def _report_storage(self, storage: StorageUsage, read_only: bool):
+        """Export the storage's usage, and set the status if it is running out."""
+        metrics_dir = self.model.storages["s3proxy-store"][0].location / "metrics"
+        write_textfile(metrics_dir, "storage", storage.metrics(read_only))
+        if read_only:
+            self.unit.status = WaitingStatus(
+                f"read-only until storage is freed: {storage.describe()}"
+            )
+        elif storage.pressure >= self.config.get("storage-threshold", 90):
+            self.unit.status = BlockedStatus(f"storage {storage.describe()}")
+
+    def _config_problem(self) -> Optional[str]:
+        """Why the config can't be applied, if it can't."""
+        for option in ("cache-size", "proxy-cache-memory", "proxy-cache-disk"):
+            value = self.config.get(option)
+            try:
+                if value:
+                    parse_quantity(value)
+            except ValueError:
+                return f"invalid {option} {value!r}"
+        try:
+            lifecycle.parse_rules(json.loads(self.config.get("expiry-rules") or "[]"))
+        except ValueError:
+            return "invalid expiry-rules"
+        if self._log_level not in LOG_LEVELS:
+            return f"invalid log-level {self._log_level!r}"
+        if not 0 <= self._access_log_ratio <= 1:
+            return "access-log-ratio must be between 0 and 1"
+        return self._migration_problem() or self._backend_problem()
+
+    def _migration_problem(self) -> Optional[str]:
+        source = self._migration_source
+        if not source:
+            return None
+        backend = self.config.get("backend", "filesystem")
+        if source != "filesystem" and source not in REMOTE_BACKENDS:
+            return f"invalid migrate-from {source!r}"
+        if (source == "filesystem") == (backend == "filesystem"):
+            return "either backend or migrate-from must be filesystem"
+        return self._remote_problem(source) if backend == "filesystem" else None
+
+    def _backend_problem(self) -> Optional[str]:
+        backend = self.config.get("backend", "filesystem")
+        if backend == "filesystem":
+            return None
+        if self.config.get("expiry-rules"):
+            return "expiry-rules need the filesystem backend"
+        if backend not in REMOTE_BACKENDS:
+            return f"invalid backend {backend!r}"
+        return self._remote_problem(backend)
 
-        self.unit.status = ActiveStatus()
+    def _remote_problem(self, backend: str) -> Optional[str]:
+        """Why the backend-* options can't describe a remote `backend`, if they can't."""
+        if not (self.config.get("backend-identity") and self.config.get("backend-credential")):
+            return "backend-identity and backend-credential must be set"
+        if backend == "s3" and not self.config.get("backend-endpoint"):
+            return "backend-endpoint must be set"
+        return None
+
+    def _expiry_rules(self) -> List[lifecycle.Rule]:
+        """The rules set in config, overridden by those set with the set-expiry action."""
+        if self.config.get("backend", "filesystem") != "filesystem":
+            return []
+        configured = lifecycle.parse_rules(json.loads(self.config.get("expiry-rules") or "[]"))
+        return lifecycle.merge_rules(configured, self._action_rules())
+
+    def _action_rules(self) -> List[lifecycle.Rule]:
+        if not self._container.exists(ACTION_RULES):
+            return []
+        try:
+            return lifecycle.parse_rules(json.loads(self._container.pull(ACTION_RULES).read()))
+        except (PathError, ValueError):
+            return []
+
+    @property
+    def _usage_interval(self) -> int:
+        """Seconds between updates of the bucket usage metrics, 0 if they aren't kept."""
+        if self.config.get("backend", "filesystem") != "filesystem":
+            return 0
+        return 60 * self.config.get("usage-interval", 0)
+
+    @property
+    def _migration_source(self) -> str:
+        """The backend objects are being migrated from, if any."""
+        return self.config.get("migrate-from") or ""
+
+    @property
+    def _migration_name(self) -> str:
+        """Tells the migration's saved progress from that of one between other backends."""
+        backend = self.config.get("backend", "filesystem")
+        return f"{self._migration_source}-to-{backend}@{self._remote_endpoint}"
+
+    def _active_message(self) -> str:
+        """What the status says when all is well: the migration's progress, and any warning."""
+        messages = [self._migration_progress()]
+        if self._access_log_ratio and not self._proxy_cache_enabled:
+            # Only the proxy keeps the access log, and it costs more than it saves to run
+            # it for that alone.
+            messages.append("access-log-ratio needs proxy-cache-memory or proxy-cache-disk")
+        return "; ".join(message for message in messages if message)
+
+    def _migration_progress(self) -> str:
+        """How far the migration from another backend has got, if there is one."""
+        source = self._migration_source
+        if not source:
+            return ""
+        state = self._pull_state(MIGRATION_STATE)
+        if state.get("source") != self._migration_name:
+            # Not started yet, or the state is still that of a previous migration.
+            state = {}
+        if state.get("done"):
+            return f"migrated from {source}, unset migrate-from"
+        progress = f"migrating from {source}: {state.get('copied', 0)} objects copied"
+        if state.get("failed"):
+            progress += f", {state['failed']} failed"
+        return progress
+
+    @property
+    def _scrub_interval(self) -> int:
+        """Seconds between scrubs of the blobstore, 0 if it isn't scrubbed."""
+        if self.config.get("backend", "filesystem") != "filesystem":
+            return 0
+        return 60 * 60 * self.config.get("scrub-interval", 0)
+
+    @property
+    def _remote_endpoint(self) -> str:
+        region = self.config.get("backend-region") or "us-east-1"
+        return self.config.get("backend-endpoint") or f"https://s3.{region}.amazonaws.com"
+
+    @property
+    def _cache_size(self) -> int:
+        """Bytes of remote objects to cache locally, 0 if there is no cache."""
+        size = self.config.get("cache-size")
+        if not size or self.config.get("backend", "filesystem") not in REMOTE_BACKENDS:
+            return 0
+        return int(parse_quantity(size))
+
+    @property
+    def _log_level(self) -> str:
+        return (self.config.get("log-level") or "info").lower()
+
+    @property
+    def _access_log_ratio(self) -> float:
+        return float(self.config.get("access-log-ratio") or 0)
+
+    @property
+    def _proxy_cache_enabled(self) -> bool:
+        """Whether clients go through the proxy, which also keeps the access log."""
+        return bool(self.config.get("proxy-cache-memory") or self.config.get("proxy-cache-disk"))
+
+    @property
+    def _loki_urls(self) -> List[str]:
+        """The push API endpoints of the Loki units related over "logging"."""
+        urls = []
+        for relation in self.model.relations["logging"]:
+            for unit in relation.units:
+                try:
+                    urls.append(json.loads(relation.data[unit]["endpoint"])["url"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+        return sorted(urls)
+
+    @property
+    def _client_port(self) -> int:
+        """The port clients connect to: the proxy cache's if enabled, else s3proxy's."""
+        return PROXY_CACHE_PORT if self._proxy_cache_enabled else self.http_listen_port
 
-    def _build_layer(self) -> Layer:
+    def _route_service(self):
+        """Point the service's port at whichever of s3proxy or the proxy cache serves clients."""
+        if not self.unit.is_leader() or self._stored.routed_port == self._client_port:  # type: ignore
+            return
+        # The library only patches the service on install and upgrade, so patch its
+        # Service, whose target port follows `_client_port`, here too.
+        service = self.service_patch.service
+        try:
+            Client().patch(
+                Service,
+                service.metadata.name,  # type: ignore
+                service,
+                namespace=self.model.name,
+                patch_type=PatchType.MERGE,
+            )
+        except ApiError as e:
+            logger.error("cannot route the service to port %d: %s", self._client_port, e)
+            return
+        self._stored.routed_port = self._client_port  # type: ignore
+
+    def _push_workload_scripts(self):
+        """Install the charm's own services in the workload container."""
+        for script in WORKLOAD_SCRIPTS:
+            self._container.push(
+                f"{WORKLOAD_LIB}/{script}",
+                (Path(__file__).parent / script).read_text(),
+                make_dirs=True,
+            )
+
+    def _backend_args(self) -> Dict[str, str]:
+        backend = self.config.get("backend", "filesystem")
+        region = self.config.get("backend-region") or "us-east-1"
+        if self._migration_source:
+            # The gateway signs requests to a remote itself, and ignores s3proxy's.
+            return {
+                "jclouds.region": region,
+                "jclouds.provider": "s3",
+                "jclouds.endpoint": f"http://{MIGRATION_ADDRESS}",
+                "jclouds.identity": "migration",
+                "jclouds.credential": "migration",
+                "jclouds.s3.virtual-host-buckets": "false",
+            }
+        if backend == "filesystem":
+            return dict(FILESYSTEM_ARGS)
+        if self._cache_size:
+            # The gateway signs requests to the remote itself, and ignores s3proxy's.
+            return {
+                "jclouds.region": region,
+                "jclouds.provider": "s3",
+                "jclouds.endpoint": f"http://{CACHE_GATEWAY_ADDRESS}",
+                "jclouds.identity": "cache-gateway",
+                "jclouds.credential": "cache-gateway",
+                "jclouds.s3.virtual-host-buckets": "false",
+            }
         args = {
-            "LOG_LEVEL": "info",
-            "jclouds.region": "us-east-1",
-            "jclouds.provider": "filesystem",
-            "jclouds.identity": "remote-identity",
-            "jclouds.identity": "remote-identity",
-            "jclouds.filesystem.basedir": f"{DATA_DIR}/blobstore",
+            "jclouds.region": region,
+            "jclouds.provider": backend,
+            "jclouds.identity": self.config["backend-identity"],
+            "jclouds.credential": self.config["backend-credential"],
         }
+        if self.config.get("backend-endpoint"):
+            args["jclouds.endpoint"] = self.config["backend-endpoint"]
+        return args
+
+    def _build_layer(self, expiry: bool = False, read_only: bool = False) -> Layer:
+        args = {"LOG_LEVEL": self._log_level}
+        args.update(self._backend_args())
         args.update(self._config.as_args())
-        arg_str = " ".join([f'-D{k}="{v}"' for k, v in args.items()])
+        if read_only:
+            args["s3proxy.read-only-blobstore"] = "true"
+        services = {
+            "s3proxy": {
+                "override": "replace",
+                "summary": "s3proxy daemon",
+                "command": _s3proxy_command(args),
+                "startup": "enabled",
+            }
+        }
+        if self._migration_source:
+            services["s3proxy"]["after"] = ["migration"]
+            services.update(self._migration_services())
+        elif self._cache_size:
+            services["s3proxy"]["after"] = ["cache-gateway"]
+            services.update(self._cache_gateway_service())
+        if self._proxy_cache_enabled:
+            services.update(self._proxy_cache_service())
+        if expiry:
+            services.update(self._expiry_service())
+        if self._usage_interval:
+            services.update(self._usage_service())
+        if self._scrub_interval:
+            services.update(self._scrub_service())
+        if len(services) > 1 or self.config.get("export-metrics"):
+            services.update(self._metrics_service())
+        self._set_log_level(services)
         return Layer(
             {
                 "summary": "s3proxy layer",
                 "description": "s3proxy layer",
-                "services": {
-                    "s3proxy": {
-                        "override": "replace",
-                        "summary": "s3proxy daemon",
-                        "command": f"java {arg_str} -jar /usr/bin/s3proxy --properties /dev/null",
-                        "startup": "enabled",
-                    }
-                },
+                "services": services,
             }
         )
 
+    def _cache_gateway_service(self) -> Dict[str, Dict[str, Any]]:
+        """The read-through cache between s3proxy and the remote."""
+        gateway_args = {
+            "listen": CACHE_GATEWAY_ADDRESS,
+            "remote": self._remote_endpoint,
+            "region": self.config.get("backend-region") or "us-east-1",
+            "cache-dir": f"{DATA_DIR}/cache",
+            "cache-size": self._cache_size,
+            "metrics-dir": METRICS_DIR,
+        }
+        environment = {
+            "REMOTE_IDENTITY": self.config["backend-identity"],
+            "REMOTE_CREDENTIAL": self.config["backend-credential"],
+        }
+        return {
+            "cache-gateway": _python_service(
+                "cache_gateway.py",
+                "read-through cache of the remote store",
+                gateway_args,
+                environment=environment,
+            ),
+        }
+
+    def _set_log_level(self, services: Dict[str, Dict[str, Any]]):
+        """Pass log-level on to the charm's own services, which log at INFO by default."""
+        if self._log_level == "info":
+            return
+        for name, service in services.items():
+            if not name.startswith("s3proxy"):
+                environment = service.setdefault("environment", {})
+                environment["LOG_LEVEL"] = LOG_LEVELS[self._log_level]
+
+    def _proxy_cache_service(self) -> Dict[str, Dict[str, Any]]:
+        """The caching reverse proxy clients reach s3proxy through."""
+        memory, disk = (
+            int(parse_quantity(self.config.get(option) or "0"))
+            for option in ("proxy-cache-memory", "proxy-cache-disk")
+        )
+        proxy_args = {
+            "listen": f"0.0.0.0:{PROXY_CACHE_PORT}",
+            "upstream": f"http://{self.instance_addr}:{self.http_listen_port}",
+            "memory-size": memory,
+            "disk-size": disk,
+            "cache-dir": f"{DATA_DIR}/proxy-cache",
+            "metrics-dir": METRICS_DIR,
+        }
+        if self._access_log_ratio:
+            proxy_args["access-log-ratio"] = self._access_log_ratio
+            labels = {
+                "juju_model": self.model.name,
+                "juju_model_uuid": self.model.uuid,
+                "juju_application": self.app.name,
+                "juju_unit": self.unit.name,
+            }
+            proxy_args["log-labels"] = ",".join(f"{k}={v}" for k, v in labels.items())
+        proxy_args["loki-url"] = self._loki_urls
+        config = self._config
+        # The proxy only serves cached objects to requests it can authenticate.
+        environment = {}
+        if config.authorization != "none":
+            environment = {
+                "S3PROXY_IDENTITY": config.identity,
+                "S3PROXY_CREDENTIAL": config.credential,
+            }
+        return {
+            "proxy-cache": _python_service(
+                "front_cache.py",
+                "caching reverse proxy for hot objects",
+                proxy_args,
+                after=["s3proxy"],
+                environment=environment,
+            ),
+        }
+
+    def _migration_services(self) -> Dict[str, Dict[str, Any]]:
+        """The gateway migrating between backends, and s3proxy serving it the filesystem one."""
+        blobstore_args = {"LOG_LEVEL": self._log_level, **FILESYSTEM_ARGS}
+        blobstore_args["s3proxy.endpoint"] = f"http://{BLOBSTORE_ADDRESS}"
+        blobstore_args["s3proxy.authorization"] = "none"
+        local, remote = f"http://{BLOBSTORE_ADDRESS}", self._remote_endpoint
+        if self._migration_source == "filesystem":
+            old, new, remote_side = local, remote, "new"
+        else:
+            old, new, remote_side = remote, local, "old"
+        migration_args = {
+            "listen": MIGRATION_ADDRESS,
+            "old": old,
+            "new": new,
+            "remote": remote_side,
+            "region": self.config.get("backend-region") or "us-east-1",
+            "state": MIGRATION_STATE,
+            "spool-dir": f"{MIGRATION_DIR}/spool",
+            "workers": self.config.get("migration-workers", 4),
+            "metrics-dir": METRICS_DIR,
+            "source": self._migration_name,
+        }
+        environment = {
+            "REMOTE_IDENTITY": self.config["backend-identity"],
+            "REMOTE_CREDENTIAL": self.config["backend-credential"],
+        }
+        return {
+            "s3proxy-filesystem": {
+                "override": "replace",
+                "summary": "s3proxy serving the filesystem backend to the migration",
+                "command": _s3proxy_command(blobstore_args),
+                "startup": "enabled",
+            },
+            "migration": _python_service(
+                "migration.py",
+                "copies objects from the old backend to the new one",
+                migration_args,
+                after=["s3proxy-filesystem"],
+                environment=environment,
+            ),
+        }
+
+    def _expiry_service(self) -> Dict[str, Dict[str, Any]]:
+        """The job deleting objects past their bucket's expiry, every EXPIRY_INTERVAL."""
+        expiry_args = {
+            "basedir": f"{DATA_DIR}/blobstore",
+            "rules": EXPIRY_RULES,
+            "state": f"{LIFECYCLE_DIR}/state.json",
+            "interval": EXPIRY_INTERVAL,
+            "rate": self.config.get("expiry-rate", 500),
+            "metrics-dir": METRICS_DIR,
+        }
+        return {"expiry": _python_service("lifecycle.py", "deletes expired objects", expiry_args)}
+
+    def _usage_service(self) -> Dict[str, Dict[str, Any]]:
+        """The job keeping the bucket usage index and metrics up to date."""
+        usage_args = {
+            "basedir": f"{DATA_DIR}/blobstore",
+            "index-dir": f"{DATA_DIR}/usage",
+            "interval": self._usage_interval,
+            "metrics-dir": METRICS_DIR,
+        }
+        return {"usage": _python_service("usage.py", "indexes bucket usage", usage_args)}
+
+    def _scrub_service(self) -> Dict[str, Dict[str, Any]]:
+        """The job checking objects against their recorded MD5."""
+        scrub_args = {
+            "basedir": f"{DATA_DIR}/blobstore",
+            "state": SCRUB_STATE,
+            "interval": self._scrub_interval,
+            "rate": self.config.get("scrub-rate", 50) * MiB,
+            "workers": self.config.get("scrub-workers", 2),
+            "metrics-dir": METRICS_DIR,
+        }
+        return {
+            "scrub": _python_service("scrub.py", "checks objects against their MD5", scrub_args)
+        }
+
+    def _metrics_service(self) -> Dict[str, Dict[str, Any]]:
+        metrics_args = {"listen": f"0.0.0.0:{METRICS_PORT}", "directory": METRICS_DIR}
+        return {
+            "metrics": _python_service(
+                "metrics_exporter.py", "s3proxy metrics exporter", metrics_args
+            ),
+        }
+
     def _set_s3proxy_version(self) -> bool:
         version = self._workload_version
 
@@ -230,6 +1209,30 @@ class S3ProxyK8SOperatorCharm(CharmBase):
             return ver
         return result
 
+    @property
+    def _workload_python(self) -> Optional[str]:
+        """The workload image's python3 version, if recent enough for the charm's own services.
+
+        The image only changes with the container, so this is checked once per start of it.
+        """
+        if self._stored.workload_python is None:  # type: ignore
+            self._stored.workload_python = self._probe_workload_python() or ""  # type: ignore
+        return self._stored.workload_python or None  # type: ignore
+
+    def _probe_workload_python(self) -> Optional[str]:
+        try:
+            result, _ = self._container.exec(["python3", "--version"]).wait_output()
+        except (APIError, ExecError) as e:
+            logger.error("cannot run python3 in the workload container: %s", e)
+            return None
+        # The result looks like: Python 3.8.10
+        version = result.strip()
+        match = re.match(r"Python (\d+)\.(\d+)", version)
+        if not match or tuple(map(int, match.groups())) < WORKLOAD_PYTHON:
+            logger.error("the workload container's python3 is too old: %s", version)
+            return None
+        return version
+
     @property
     def hostname(self) -> str:
         """Unit's hostname."""
@@ -238,12 +1241,7 @@ class S3ProxyK8SOperatorCharm(CharmBase):
     @property
     def is_ready(self) -> bool:
         """Check whether the endpoint is really reachable."""
-        client = boto3.client(
-            service_name="s3",
-            endpoint_url="http://127.0.0.1:8080",
-            aws_access_key_id=self._credentials["identity"],
-            aws_secret_access_key=self._credentials["credential"],
-        )
+        client = self._s3_client()
         try:
             client.list_buckets()
             return True
@@ -251,5 +1249,34 @@ class S3ProxyK8SOperatorCharm(CharmBase):
             return False
 
 
+def _s3proxy_command(args: Dict[str, Any]) -> str:
+    """The command running s3proxy with `args` as its properties."""
+    arg_str = " ".join([f'-D{k}="{v}"' for k, v in args.items()])
+    return f"java {arg_str} -jar /usr/bin/s3proxy --properties /dev/null"
+
+
+def _python_service(script: str, summary: str, args: Dict[str, Any], **fields) -> Dict[str, Any]:
+    """A service running one of the charm's scripts, as a Pebble layer has it.
+
+    Each of `args` is passed as a `--name value` option, once per value of lists, and
+    `fields` are added to the service, e.g. its environment.
+    """
+    command = ["python3", f"{WORKLOAD_LIB}/{script}"]
+    for name, value in args.items():
+        for item in value if isinstance(value, list) else [value]:
+            command += [f"--{name}", str(item)]
+    return {
+        "override": "replace",
+        "summary": summary,
+        "command": " ".join(shlex.quote(part) for part in command),
+        "startup": "enabled",
+        **fields,
+    }
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat()
+
+
 if __name__ == "__main__":  # pragma: nocover
     main(S3ProxyK8SOperatorCharm)
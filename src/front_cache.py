@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A caching reverse proxy in front of s3proxy, for hot GETs.
+
+Clients reach s3proxy through this proxy. Objects read with plain GETs are kept in
+memory when they are small enough, and on disk, and later reads of the same objects are
+served from there instead of by s3proxy. Writes and deletes through the proxy invalidate
+what they touch.
+
+Cached objects are only served to requests the proxy authenticates itself: those signed
+with s3proxy's credentials in their Authorization header, with AWS Signature V4 or V2,
+or any request if s3proxy doesn't require authorization. Anything else, presigned URLs
+included, is forwarded to s3proxy, which remains the authority on what is allowed. So
+is every miss, and only its successful responses are cached.
+
+As every request passes through it, the proxy also keeps s3proxy's access log, sampled,
+see `access_log`.
+
+This module only uses the standard library, as it runs in the workload container.
+"""
+
+import argparse
+import base64
+import datetime
+import email.utils
+import hashlib
+import hmac
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from access_log import AccessLog, parse_labels
+from cache_gateway import (
+    HOP_BY_HOP,
+    MAX_ENTRY_SHARE,
+    CacheGateway,
+    CachingHandler,
+    DiskCache,
+    Invalidations,
+    Upstream,
+    canonical_request,
+    report_metrics,
+    signature_v4,
+)
+from metrics_exporter import labels
+
+logger = logging.getLogger(__name__)
+
+# How far a signed request's date may be from ours, as S3 allows.
+MAX_SKEW = datetime.timedelta(minutes=15)
+
+
+class SignatureVerifier:
+    """Checks that requests are signed with a given identity and credential."""
+
+    def __init__(self, identity: str, credential: str):
+        self.identity = identity
+        self.credential = credential
+
+    def verify(self, method: str, path: str, headers, now=None) -> bool:
+        """Whether a request without a query string carries a valid, current signature."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        authorization = headers.get("Authorization", "")
+        try:
+            if authorization.startswith("AWS4-HMAC-SHA256 "):
+                return self._verify_v4(method, path, headers, authorization, now)
+            if authorization.startswith("AWS "):
+                return self._verify_v2(method, path, headers, authorization, now)
+        except (KeyError, ValueError):
+            pass
+        return False
+
+    def _verify_v4(self, method, path, headers, authorization, now) -> bool:
+        fields = dict(
+            part.strip().partition("=")[::2] for part in authorization.split(" ", 1)[1].split(",")
+        )
+        identity, date, region, service, _ = fields["Credential"].split("/")
+        amz_date = headers["X-Amz-Date"]
+        signed_at = datetime.datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(
+            tzinfo=datetime.timezone.utc
+        )
+        if identity != self.identity or service != "s3" or date != amz_date[:8]:
+            return False
+        if abs(now - signed_at) > MAX_SKEW:
+            return False
+
+        signed = fields["SignedHeaders"].split(";")
+        values = {name: ",".join(headers.get_all(name) or ()) for name in signed}
+        request = canonical_request(
+            method, path, "", values, signed, headers["X-Amz-Content-SHA256"]
+        )
+        expected = signature_v4(request, amz_date, region, self.credential)
+        return hmac.compare_digest(expected, fields["Signature"])
+
+    def _verify_v2(self, method, path, headers, authorization, now) -> bool:
+        identity, _, signature = authorization.split(" ", 1)[1].rpartition(":")
+        date = headers.get("X-Amz-Date") or headers["Date"]
+        if identity != self.identity:
+            return False
+        if abs(now - email.utils.parsedate_to_datetime(date)) > MAX_SKEW:
+            return False
+
+        amz_headers = sorted(
+            (k.lower(), ",".join(v.strip() for v in headers.get_all(k)))
+            for k in set(headers.keys())
+            if k.lower().startswith("x-amz-")
+        )
+        to_sign = "\n".join(
+            [
+                method,
+                headers.get("Content-MD5", ""),
+                headers.get("Content-Type", ""),
+                "" if "X-Amz-Date" in headers else date,
+                *(f"{k}:{v}" for k, v in amz_headers),
+                path,
+            ]
+        )
+        digest = hmac.new(self.credential.encode(), to_sign.encode(), hashlib.sha1).digest()
+        return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
+class MemoryEntry:
+    """An object kept in memory."""
+
+    __slots__ = ("bucket", "key", "size", "headers", "data")
+
+    def __init__(self, bucket: str, key: str, headers: Dict[str, str], data: bytes):
+        self.bucket = bucket
+        self.key = key
+        self.size = len(data)
+        self.headers = headers
+        self.data = data
+
+    def open(self) -> BinaryIO:
+        """The object's data."""
+        return io.BytesIO(self.data)
+
+
+class MemoryCache:
+    """Small objects in memory, up to `max_bytes`, evicted least recently used first."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // MAX_ENTRY_SHARE
+        self.size = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, str], MemoryEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = Invalidations()
+
+    def get(self, bucket: str, key: str) -> Optional[MemoryEntry]:
+        """The entry for an object, if it is cached, marking it as recently used."""
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is not None:
+                self._entries.move_to_end((bucket, key))
+            return entry
+
+    def start_fill(self) -> int:
+        """Note that an object is about to be read, to add to the cache with `end_fill`."""
+        with self._lock:
+            return self._invalidations.start_fill()
+
+    def end_fill(self, bucket: str, key: str, sequence: int, entry: Optional[MemoryEntry]):
+        """Add `entry`, if any, unless its object was invalidated since it was read."""
+        with self._lock:
+            keep = self._invalidations.end_fill(bucket, key, sequence)
+            if not keep or entry is None or entry.size > self.max_entry_bytes:
+                return
+            self._remove((bucket, key))
+            self._entries[(bucket, key)] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, bucket: str, key: Optional[str] = None):
+        """Drop an object, or every object in `bucket` if `key` is None."""
+        with self._lock:
+            self._invalidations.record(bucket, key)
+            if key is not None:
+                self._remove((bucket, key))
+                return
+            for cached in [k for k in self._entries if k[0] == bucket]:
+                self._remove(cached)
+
+    def _remove(self, cached: Tuple[str, str]):
+        entry = self._entries.pop(cached, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+class TieredCache:
+    """A memory cache in front of a disk cache, either of which may be left out.
+
+    Objects read from disk which fit in memory are promoted there.
+    """
+
+    def __init__(self, memory: Optional[MemoryCache], disk: Optional[DiskCache]):
+        self.memory = memory
+        self.disk = disk
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, bucket: str, key: str, count: bool = True):
+        """The entry for an object, from whichever tier has it."""
+        entry, tier = None, None
+        if self.memory is not None:
+            entry, tier = self.memory.get(bucket, key), "memory"
+        if entry is None and self.disk is not None:
+            entry, tier = self.disk.get(bucket, key, count=False), "disk"
+            if entry is not None:
+                self._promote(entry)
+        if count:
+            with self._lock:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits[tier] += 1  # type: ignore
+        return entry
+
+    def _promote(self, entry):
+        if self.memory is None or entry.size > self.memory.max_entry_bytes:
+            return
+        sequence = self.memory.start_fill()
+        try:
+            with entry.open() as f:
+                promoted = MemoryEntry(entry.bucket, entry.key, entry.headers, f.read())
+        except FileNotFoundError:
+            promoted = None
+        self.memory.end_fill(entry.bucket, entry.key, sequence, promoted)
+
+    def fill(self, bucket: str, key: str, headers: Dict[str, str]) -> "TieredFill":
+        """Start caching an object, in whichever tiers it fits."""
+        return TieredFill(self, bucket, key, headers)
+
+    def invalidate(self, bucket: str, key: Optional[str] = None):
+        """Drop an object, or every object in `bucket` if `key` is None, from every tier."""
+        for tier in (self.memory, self.disk):
+            if tier is not None:
+                tier.invalidate(bucket, key)
+
+    def metrics(self):
+        """The cache's counters, by tier, as `metrics_exporter` metrics."""
+        tiers = {"memory": self.memory, "disk": self.disk}
+        present = {name: tier for name, tier in tiers.items() if tier is not None}
+        with self._lock:
+            hits = {labels(tier=name): self.hits[name] for name in present}
+            misses = self.misses
+        return {
+            "s3proxy_proxy_cache_hits_total": ("counter", "GETs served from the cache.", hits),
+            "s3proxy_proxy_cache_misses_total": (
+                "counter",
+                "GETs of uncached objects.",
+                {"": misses},
+            ),
+            "s3proxy_proxy_cache_evictions_total": (
+                "counter",
+                "Objects evicted to make room for others.",
+                {labels(tier=n): t.evictions for n, t in present.items()},  # type: ignore
+            ),
+            "s3proxy_proxy_cache_size_bytes": (
+                "gauge",
+                "Bytes of objects cached.",
+                {labels(tier=n): t.size for n, t in present.items()},  # type: ignore
+            ),
+            "s3proxy_proxy_cache_capacity_bytes": (
+                "gauge",
+                "Maximum cache size.",
+                {labels(tier=n): t.max_bytes for n, t in present.items()},  # type: ignore
+            ),
+        }
+
+
+class TieredFill:
+    """An object being added to the tiers of a `TieredCache` as it is read."""
+
+    def __init__(self, cache: TieredCache, bucket: str, key: str, headers: Dict[str, str]):
+        self.bucket = bucket
+        self.key = key
+        self.headers = headers
+        self.memory = cache.memory
+        self._chunks: Optional[List[bytes]] = None
+        self._size = 0
+        if self.memory is not None:
+            self._chunks = []
+            self._sequence = self.memory.start_fill()
+        self._disk = cache.disk.fill(bucket, key, headers) if cache.disk is not None else None
+
+    def write(self, data: bytes):
+        """Append data read from s3proxy."""
+        if self._chunks is not None:
+            self._size += len(data)
+            if self._size > self.memory.max_entry_bytes:  # type: ignore
+                self._end_memory(keep=False)
+            else:
+                self._chunks.append(data)
+        if self._disk is not None:
+            self._disk.write(data)
+
+    def _end_memory(self, keep: bool):
+        if self._chunks is None:
+            return
+        entry = None
+        if keep:
+            entry = MemoryEntry(self.bucket, self.key, self.headers, b"".join(self._chunks))
+        self._chunks = None
+        self.memory.end_fill(self.bucket, self.key, self._sequence, entry)  # type: ignore
+
+    def commit(self):
+        """Add the object to the tiers it fits in."""
+        self._end_memory(keep=True)
+        if self._disk is not None:
+            self._disk.commit()
+
+    def abort(self):
+        """Discard what was read."""
+        self._end_memory(keep=False)
+        if self._disk is not None:
+            self._disk.abort()
+
+
+class FrontCacheHandler(CachingHandler):
+    """Serves cached objects only to requests it can authenticate."""
+
+    # Signatures cover the Host and Authorization headers, so those are forwarded as is.
+    unforwarded = HOP_BY_HOP | {"expect"}
+    server: "FrontCache"
+    # What the access log records of the response being sent.
+    _status = 0
+    _length: Optional[int] = None
+    _cached = False
+
+    def _handle(self):
+        access_log = self.server.access_log
+        if access_log is None:
+            super()._handle()
+            return
+        started = time.monotonic()
+        self._status, self._length, self._cached = 0, None, False
+        try:
+            super()._handle()
+        finally:
+            target = urlsplit(self.path)
+            bucket, _, key = unquote(target.path).lstrip("/").partition("/")
+            access_log.record(
+                method=self.command,
+                bucket=bucket,
+                key=key,
+                # Only the names, as values may be signatures of presigned URLs.
+                query=sorted({name for name, _ in parse_qsl(target.query, True)}),
+                status=self._status,
+                bytes=self._length,
+                cached=self._cached,
+                duration_ms=round((time.monotonic() - started) * 1000, 3),
+                client=self.client_address[0],
+            )
+
+    def send_response_only(self, code, message=None):
+        """Send the status line, noting the status for the access log."""
+        self._status = code
+        super().send_response_only(code, message)
+
+    def send_header(self, keyword, value):
+        """Send a header, noting the response's length for the access log."""
+        if keyword.lower() == "content-length":
+            self._length = int(value)
+        super().send_header(keyword, value)
+
+    def _serve_cached(self, bucket: str, key: str) -> bool:
+        self._cached = super()._serve_cached(bucket, key)
+        return self._cached
+
+    def may_use_cache(self) -> bool:
+        """Whether the request is signed with s3proxy's credentials, if it requires any."""
+        verifier = self.server.verifier
+        return verifier is None or verifier.verify(self.command, self.path, self.headers)
+
+
+class FrontCache(CacheGateway):
+    """Forwards S3 requests to s3proxy at `upstream`, serving hot objects from `cache`."""
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        upstream: Upstream,
+        cache: TieredCache,
+        verifier: Optional[SignatureVerifier],
+        access_log: Optional[AccessLog] = None,
+    ):
+        super().__init__(address, upstream, cache, FrontCacheHandler)
+        self.verifier = verifier
+        self.access_log = access_log
+
+
+def main():
+    """Run the proxy, with s3proxy's credentials, if it requires them, from the environment."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", default="0.0.0.0:8090", help="address:port to serve on")
+    parser.add_argument("--upstream", default="http://127.0.0.1:8080", help="s3proxy's URL")
+    parser.add_argument("--memory-size", type=int, default=0, help="in bytes")
+    parser.add_argument("--disk-size", type=int, default=0, help="in bytes")
+    parser.add_argument("--cache-dir", help="directory for the disk cache")
+    parser.add_argument("--metrics-dir", help="directory to write metrics to")
+    parser.add_argument("--access-log-ratio", type=float, default=0, help="of requests to log")
+    parser.add_argument("--loki-url", action="append", default=[], help="Loki push API URL")
+    parser.add_argument("--log-labels", default="", help="name=value,... of the log stream")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    access_log = None
+    if args.access_log_ratio:
+        access_log = AccessLog(args.access_log_ratio, args.loki_url, parse_labels(args.log_labels))
+        access_log.start()
+    memory = MemoryCache(args.memory_size) if args.memory_size else None
+    disk = DiskCache(Path(args.cache_dir), args.disk_size) if args.disk_size else None
+    cache = TieredCache(memory, disk)
+    verifier = None
+    if os.environ.get("S3PROXY_IDENTITY"):
+        verifier = SignatureVerifier(
+            os.environ["S3PROXY_IDENTITY"], os.environ["S3PROXY_CREDENTIAL"]
+        )
+    if args.metrics_dir:
+        threading.Thread(
+            target=report_metrics,
+            args=(cache, Path(args.metrics_dir), "proxy-cache"),
+            daemon=True,
+        ).start()
+        if access_log is not None:
+            threading.Thread(
+                target=report_metrics,
+                args=(access_log, Path(args.metrics_dir), "access-log"),
+                daemon=True,
+            ).start()
+    host, port = args.listen.rsplit(":", 1)
+    logger.info(
+        "caching %s, %d bytes in memory, %d on disk",
+        args.upstream,
+        args.memory_size,
+        args.disk_size,
+    )
+    proxy = FrontCache((host, int(port)), Upstream(args.upstream), cache, verifier, access_log)
+    proxy.serve_forever()
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
@@ -0,0 +1,42 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""What the background jobs of the workload container share.
+
+The expiry, scrub and migration jobs keep their progress in a JSON file, saved
+atomically so that a job killed mid-write resumes from its previous checkpoint, and the
+last two check objects against their MD5. This module only uses the standard library,
+as it runs in the workload container.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict
+
+
+def save_state(path: Path, state: Dict[str, Any]):
+    """Replace the state at `path` with `state`, so that it is never left half written."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def load_state(path: Path) -> Dict[str, Any]:
+    """The state saved at `path`, or an empty one if there is none or it can't be read."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def md5():
+    """A new MD5 hash, used for checksums rather than security."""
+    try:
+        return hashlib.md5(usedforsecurity=False)
+    except TypeError:
+        # Python 3.8
+        return hashlib.md5()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Expiry of old objects in s3proxy's filesystem blobstore.
+
+The filesystem provider keeps each object of a bucket as a file under the bucket's
+directory, named after its key, and reports the file's modification time as the
+object's. Expiry rules give, for a bucket and optionally a key prefix, how many days
+objects are kept; older ones are deleted by a job which runs at an interval.
+
+A run walks the directories of the buckets with rules depth first, in name order, with
+`os.scandir`, so that only one directory's entries are held at a time. Expired files are
+deleted in batches, and after each batch the path reached is saved, so that a run which
+is interrupted resumes from there. Filesystem operations are rate limited, to leave
+I/O to s3proxy. Directories left empty are removed, as s3proxy does when deleting
+objects.
+
+Each run's totals are kept with the checkpoint, for the charm to report, and written as
+Prometheus metrics, see `metrics_exporter`. This module only uses the standard library,
+as it runs in the workload container.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from jobs import load_state, save_state
+from metrics_exporter import labels, write_textfile
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+BATCH_SIZE = 1000
+# Runs whose totals are kept.
+HISTORY = 10
+
+
+class Rule(NamedTuple):
+    """Objects of `bucket` whose keys start with `prefix` are kept for `days`."""
+
+    bucket: str
+    days: float
+    prefix: str = ""
+
+
+def parse_rules(rules: Any) -> List[Rule]:
+    """Rules from their JSON form, a list of {"bucket", "days", "prefix"} objects.
+
+    Raises:
+        ValueError: if `rules` are malformed.
+    """
+    if not isinstance(rules, list):
+        raise ValueError("expiry rules must be a list")
+    parsed = []
+    for rule in rules:
+        try:
+            parsed.append(
+                Rule(str(rule["bucket"]), float(rule["days"]), str(rule.get("prefix", "")))
+            )
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"invalid expiry rule {rule!r}") from None
+        if not parsed[-1].bucket or "/" in parsed[-1].bucket or parsed[-1].days <= 0:
+            raise ValueError(f"invalid expiry rule {rule!r}")
+    return parsed
+
+
+def merge_rules(*rule_sets: List[Rule]) -> List[Rule]:
+    """Combine rule sets, later ones overriding earlier ones for the same bucket and prefix."""
+    merged: Dict[Tuple[str, str], Rule] = {}
+    for rules in rule_sets:
+        merged.update(((rule.bucket, rule.prefix), rule) for rule in rules)
+    return sorted(merged.values())
+
+
+def rules_as_json(rules: List[Rule]) -> str:
+    """The JSON form of `rules`, as read by `parse_rules`."""
+    return json.dumps([rule._asdict() for rule in rules], sort_keys=True)
+
+
+class Throttle:
+    """Spaces operations out to at most `rate` per second, on average, across threads."""
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = clock()
+        self._lock = threading.Lock()
+
+    def __call__(self, operations: int = 1):
+        """Account for `operations`, sleeping first if running ahead of the rate."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = self._clock()
+            # Don't bank time while idle, so that bursts stay bounded.
+            start = max(self._next, now)
+            self._next = start + operations * self.interval
+        if start > now:
+            self._sleep(start - now)
+
+
+def walk(
+    directory: str, relative: Tuple[str, ...], resume: Tuple[str, ...]
+) -> Iterator[Tuple[Tuple[str, ...], os.DirEntry]]:
+    """Files under `directory`, depth first in name order, after `resume` if given.
+
+    Yields each file's path relative to the walk's root, as a tuple, with its entry.
+    Directories are yielded too, once everything in them has been.
+    """
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        path = relative + (entry.name,)
+        if resume and (path < resume[: len(path)] or path == resume):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            inner = resume if resume[: len(path)] == path else ()
+            yield from walk(entry.path, path, inner)
+        yield path, entry
+
+
+class Expiry:
+    """A run of the expiry job over `basedir`, resuming from the state at `state_path`."""
+
+    def __init__(
+        self,
+        basedir: Path,
+        rules: List[Rule],
+        state_path: Path,
+        throttle: Optional[Throttle] = None,
+        batch_size: int = BATCH_SIZE,
+        now: Optional[float] = None,
+    ):
+        self.basedir = Path(basedir)
+        self.rules = rules
+        self.state_path = Path(state_path)
+        self.throttle = throttle or Throttle(0)
+        self.batch_size = batch_size
+        self.state = load_state(self.state_path)
+
+        checkpoint = self.state.get("checkpoint")
+        if checkpoint and checkpoint.get("rules") == rules_as_json(rules):
+            self.run = checkpoint["run"]
+            self.resume = tuple(checkpoint["path"])
+        else:
+            started = now if now is not None else time.time()
+            self.run = {"started": started, "objects": 0, "bytes": 0, "scanned": 0, "buckets": {}}
+            self.resume = ()
+        # A run which is resumed keeps judging ages against the time it started.
+        self.now = self.run["started"]
+
+    def _expired(self, bucket: str, key: str, mtime: float) -> bool:
+        days = [r.days for r in self.rules if r.bucket == bucket and key.startswith(r.prefix)]
+        # Where rules overlap, the one keeping objects the longest wins.
+        return bool(days) and mtime < self.now - max(days) * DAY
+
+    def __call__(self) -> Dict[str, Any]:
+        """Run to completion, returning the run's totals."""
+        batch: List[Tuple[Tuple[str, ...], os.DirEntry]] = []
+        walked = 0
+        for path, entry in self._walk():
+            walked += 1
+            if entry is not None:
+                batch.append((path, entry))
+            # Checkpoint long stretches of unexpired objects as well as deletions.
+            if len(batch) >= self.batch_size or walked >= 10 * self.batch_size:
+                self._delete(batch, path)
+                batch, walked = [], 0
+        self._delete(batch, None)
+
+        self.run["finished"] = time.time()
+        self.state = {"runs": (self.state.get("runs", []) + [self.run])[-HISTORY:]}
+        save_state(self.state_path, self.state)
+        return self.run
+
+    def _walk(self) -> Iterator[Tuple[Tuple[str, ...], Optional[os.DirEntry]]]:
+        """Every path walked, with its entry if it is to be deleted.
+
+        That is expired files, and directories which files were deleted from, as those
+        may be left empty.
+        """
+        for bucket in sorted({rule.bucket for rule in self.rules}):
+            if self.resume and (bucket,) < self.resume[:1]:
+                continue
+            root = self.basedir / bucket
+            if not root.is_dir():
+                continue
+            resume = self.resume[1:] if self.resume[:1] == (bucket,) else ()
+            emptied = set()
+            for path, entry in walk(str(root), (), resume):
+                self.throttle()
+                if entry.is_dir(follow_symlinks=False):
+                    yield (bucket,) + path, entry if path in emptied else None
+                    emptied.discard(path)
+                    continue
+                self.run["scanned"] += 1
+                try:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                except FileNotFoundError:
+                    continue
+                if self._expired(bucket, "/".join(path), mtime):
+                    emptied.update(path[:i] for i in range(1, len(path)))
+                    yield (bucket,) + path, entry
+                else:
+                    yield (bucket,) + path, None
+
+    def _delete(self, batch: List[Tuple[Tuple[str, ...], os.DirEntry]], reached):
+        """Delete `batch`, then checkpoint at `reached`, or at the end of the run if None."""
+        for path, entry in batch:
+            self.throttle()
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    os.rmdir(entry.path)
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+                os.unlink(entry.path)
+            except OSError:
+                # Not empty, or gone already.
+                continue
+            self.run["objects"] += 1
+            self.run["bytes"] += size
+            totals = self.run["buckets"].setdefault(path[0], {"objects": 0, "bytes": 0})
+            totals["objects"] += 1
+            totals["bytes"] += size
+        if reached is not None:
+            self.state["checkpoint"] = {
+                "rules": rules_as_json(self.rules),
+                "path": list(reached),
+                "run": self.run,
+            }
+            save_state(self.state_path, self.state)
+
+
+def metrics(state: Dict[str, Any]):
+    """What the last run reclaimed, by bucket, as metrics."""
+    runs = state.get("runs", [])
+    last = runs[-1] if runs else {"objects": 0, "bytes": 0, "finished": 0, "buckets": {}}
+    return {
+        "s3proxy_expiry_last_run_timestamp_seconds": (
+            "gauge",
+            "When the last expiry run finished.",
+            {"": last["finished"]},
+        ),
+        "s3proxy_expiry_last_run_objects": (
+            "gauge",
+            "Objects deleted by the last expiry run.",
+            {labels(bucket=b): t["objects"] for b, t in last["buckets"].items()} or {"": 0},
+        ),
+        "s3proxy_expiry_last_run_bytes": (
+            "gauge",
+            "Bytes reclaimed by the last expiry run.",
+            {labels(bucket=b): t["bytes"] for b, t in last["buckets"].items()} or {"": 0},
+        ),
+    }
+
+
+def main():
+    """Expire objects at an interval, with rules re-read before each run."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--basedir", required=True, help="the filesystem provider's basedir")
+    parser.add_argument("--rules", required=True, help="JSON file of expiry rules")
+    parser.add_argument("--state", required=True, help="file to keep checkpoints and totals in")
+    parser.add_argument("--interval", type=float, default=3600, help="seconds between runs")
+    parser.add_argument("--rate", type=float, default=0, help="filesystem operations per second")
+    parser.add_argument("--metrics-dir", help="directory to write metrics to")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    while True:
+        started = time.monotonic()
+        try:
+            rules = parse_rules(json.loads(Path(args.rules).read_text()))
+        except (OSError, ValueError) as e:
+            logger.error("cannot read expiry rules: %s", e)
+            rules = []
+        if rules:
+            run = Expiry(Path(args.basedir), rules, Path(args.state), Throttle(args.rate))()
+            logger.info("expired %d objects, %d bytes", run["objects"], run["bytes"])
+            if args.metrics_dir:
+                write_textfile(args.metrics_dir, "expiry", metrics(load_state(Path(args.state))))
+        time.sleep(max(0, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
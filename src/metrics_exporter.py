@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Prometheus metrics for the s3proxy workload, kept as text files.
+
+Whatever produces metrics, be it a service in the workload container or the charm itself,
+writes them to its own `*.prom` file in a shared directory, in the Prometheus text format,
+with `write_textfile`. Run as a script, this module serves the concatenation of those
+files on `/metrics`, so a producer only pays for its metrics when it updates them, and
+not for every scrape.
+
+This module only uses the standard library, as it also runs in the workload container.
+"""
+
+import argparse
+import os
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, Tuple, Union
+
+# name -> (type, help, samples), where samples map a label string (or "") to a value.
+Metrics = Dict[str, Tuple[str, str, Dict[str, Union[int, float]]]]
+
+
+def format_metrics(metrics: Metrics) -> str:
+    """Render `metrics` in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, description, samples) in metrics.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples.items():
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def labels(**values: str) -> str:
+    """Format label values for a sample's label string, escaping them as needed."""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in values.items()
+    )
+    return ",".join(f'{k}="{v}"' for k, v in escaped)
+
+
+def write_textfile(directory: Union[str, Path], name: str, metrics: Metrics) -> None:
+    """Atomically replace `name`.prom in `directory` with `metrics`."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(format_metrics(metrics))
+        os.replace(tmp, directory / f"{name}.prom")
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def collect(directory: Union[str, Path]) -> Iterable[bytes]:
+    """The contents of every metrics file in `directory`."""
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name.endswith(".prom") and entry.is_file():
+            try:
+                with open(entry.path, "rb") as f:
+                    yield f.read()
+            except FileNotFoundError:
+                continue
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def do_GET(self):  # noqa: N802
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = b"".join(collect(self.server.directory))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves the metrics files in `directory` on `/metrics`."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], directory: Union[str, Path]):
+        super().__init__(address, _Handler)
+        self.directory = directory
+
+
+def main():
+    """Serve the metrics files in a directory."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", default="0.0.0.0:9102", help="address:port to serve on")
+    parser.add_argument("--directory", required=True, help="directory of *.prom files")
+    args = parser.parse_args()
+
+    host, port = args.listen.rsplit(":", 1)
+    MetricsServer((host, int(port)), args.directory).serve_forever()
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Online migration of s3proxy's objects from one backend to another.
+
+While the backend is being switched, s3proxy's jclouds backend is pointed at this
+gateway, which stands in front of both the old backend and the new one. Each is an S3
+endpoint: a remote store, whose requests the gateway signs, or for the filesystem
+provider a second s3proxy serving the blobstore on the loopback interface.
+
+Writes go to the new backend, and deletes to both, so that nothing deleted comes back
+from the old one. Until the migration is done, reads which the new backend can't serve
+fall through to the old one, and bucket listings merge both backends' objects.
+
+Meanwhile, a bounded pool of threads copies every object the new backend doesn't have,
+bucket by bucket in key order. Objects are checked against their MD5 on the way: when
+read from a filesystem s3proxy, whose ETags are the MD5 of single-part objects, against
+the ETag, and when written, with a Content-MD5 for the new backend to refuse damaged
+uploads. A remote's ETags aren't checked, as with server-side encryption, among others,
+they aren't MD5s. An object is locked against writes through the gateway while it is copied, so
+that a copy never overwrites a newer write. As with `transfer`, the bucket and key
+reached are saved regularly, and an interrupted migration resumes from there. Objects
+which can't be copied are retried by another pass, and the migration is done once a pass
+copied everything. The state records which migration it is the progress of, so that a
+migration from another source starts afresh.
+
+This module only uses the standard library, as it runs in the workload container.
+"""
+
+import argparse
+import base64
+import http.client
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+from xml.etree import ElementTree
+
+from cache_gateway import (
+    CHUNK_SIZE,
+    HOP_BY_HOP,
+    CacheGateway,
+    CachingHandler,
+    Remote,
+    Upstream,
+)
+from jobs import load_state, md5, save_state
+from metrics_exporter import write_textfile
+from transfer import in_order
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SECONDS = 5
+RETRIES = 3
+# Objects up to this size are copied through memory rather than a temporary file.
+SPOOL_SIZE = 8 * 1024 * 1024
+# Failures kept per pass; any more are only counted.
+MAX_REPORTED = 100
+COPIED, SKIPPED, FAILED = "copied", "skipped", "failed"
+
+# Response headers describing the object, which are copied along with it.
+_OBJECT_HEADERS = {
+    "cache-control",
+    "content-disposition",
+    "content-encoding",
+    "content-language",
+    "content-type",
+    "expires",
+}
+# Query parameters of the object listings whose results are merged from both backends.
+_LISTING_PARAMS = {"delimiter", "encoding-type", "marker", "max-keys", "prefix"}
+
+
+def object_path(bucket: str, key: str = "") -> str:
+    """The URL path of an object, or of a bucket if `key` is empty."""
+    return quote(f"/{bucket}/{key}" if key else f"/{bucket}", safe="/~")
+
+
+def _call(
+    upstream: Upstream,
+    method: str,
+    path: str,
+    query: str = "",
+    headers: Optional[Dict[str, str]] = None,
+    body=None,
+) -> Tuple[int, Dict[str, str], bytes]:
+    """Send a request, returning its response's status, lowercase headers and body."""
+    response = upstream.request(method, path, query, headers or {}, body)
+    with response:
+        data = response.read()
+    return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+
+
+def _local(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def _tostring(root: ElementTree.Element) -> bytes:
+    """Serialize `root` in the default namespace it has, as S3 responses are."""
+    namespace = root.tag.partition("}")[0].lstrip("{") if root.tag.startswith("{") else None
+    return ElementTree.tostring(
+        root, encoding="UTF-8", xml_declaration=True, default_namespace=namespace
+    )
+
+
+def _children(element: ElementTree.Element, name: str) -> List[ElementTree.Element]:
+    return [child for child in element if _local(child.tag) == name]
+
+
+def _text(element: ElementTree.Element, name: str, default: str = "") -> str:
+    found = _children(element, name)
+    return (found[0].text or "") if found else default
+
+
+def list_buckets(upstream: Upstream) -> List[str]:
+    """The names of the buckets at `upstream`."""
+    status, _, data = _call(upstream, "GET", "/")
+    if status != 200:
+        raise OSError(f"listing buckets failed: {status}")
+    root = ElementTree.fromstring(data)
+    return sorted(_text(b, "Name") for buckets in _children(root, "Buckets") for b in buckets)
+
+
+def list_objects(upstream: Upstream, bucket: str, marker: str = "") -> Iterator[str]:
+    """The keys in `bucket` at `upstream` after `marker`, in order."""
+    while True:
+        query = urlencode({"marker": marker, "max-keys": 1000}, quote_via=quote)
+        status, _, data = _call(upstream, "GET", object_path(bucket), query)
+        if status == 404:
+            return
+        if status != 200:
+            raise OSError(f"listing {bucket} failed: {status}")
+        root = ElementTree.fromstring(data)
+        keys = [_text(c, "Key") for c in _children(root, "Contents")]
+        yield from keys
+        if _text(root, "IsTruncated") != "true" or not keys:
+            return
+        marker = _text(root, "NextMarker") or keys[-1]
+
+
+def merge_listings(new: bytes, old: bytes, max_keys: int) -> bytes:
+    """Merge the objects of two ListObjects (v1) results, the new backend's first.
+
+    Where either is truncated, the merged listing only goes as far as that listing did, so
+    that the next page's marker doesn't skip what the other listing hasn't got to yet.
+    """
+    new_root, old_root = ElementTree.fromstring(new), ElementTree.fromstring(old)
+    entries: Dict[str, ElementTree.Element] = {}
+    ends = []
+    for root in (old_root, new_root):
+        names = []
+        for element in root:
+            if _local(element.tag) in ("Contents", "CommonPrefixes"):
+                name = _text(element, "Key") or _text(element, "Prefix")
+                entries[name] = element
+                names.append(name)
+        if _text(root, "IsTruncated") == "true" and names:
+            ends.append(max(names))
+    end = min(ends) if ends else None
+    names = sorted(name for name in entries if end is None or name <= end)
+    truncated = end is not None or len(names) > max_keys
+    names = names[:max_keys]
+
+    for element in list(new_root):
+        if _local(element.tag) in ("Contents", "CommonPrefixes", "NextMarker"):
+            new_root.remove(element)
+        elif _local(element.tag) == "IsTruncated":
+            element.text = "true" if truncated else "false"
+    if truncated and names:
+        namespace, brace, _ = new_root.tag.rpartition("}")
+        ElementTree.SubElement(new_root, f"{namespace}{brace}NextMarker").text = names[-1]
+    new_root.extend(entries[name] for name in names)
+    return _tostring(new_root)
+
+
+def merge_bucket_lists(new: bytes, old: bytes) -> bytes:
+    """Merge the buckets of two ListBuckets results, the new backend's first."""
+    new_root, old_root = ElementTree.fromstring(new), ElementTree.fromstring(old)
+    new_buckets = _children(new_root, "Buckets")[0]
+    names = {_text(b, "Name") for b in new_buckets}
+    for buckets in _children(old_root, "Buckets"):
+        new_buckets.extend(b for b in buckets if _text(b, "Name") not in names)
+    return _tostring(new_root)
+
+
+def create_bucket(upstream: Upstream, bucket: str):
+    """Create `bucket` at `upstream` unless it exists, in the remote's region if it has one."""
+    region = getattr(upstream, "region", "us-east-1")
+    body = None
+    if region != "us-east-1":
+        body = (
+            '<CreateBucketConfiguration xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<LocationConstraint>{region}</LocationConstraint></CreateBucketConfiguration>"
+        ).encode()
+    status, _, _ = _call(upstream, "PUT", object_path(bucket), body=body)
+    if status not in (200, 409):
+        raise OSError(f"creating {bucket} failed: {status}")
+
+
+class KeyLocks:
+    """Locks of single objects, held while they are copied or written to."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held: Dict[Tuple[str, str], List[Any]] = {}
+
+    @contextmanager
+    def hold(self, bucket: str, key: str):
+        """Hold the lock of an object, which only exists while held or waited for."""
+        with self._lock:
+            entry = self._held.setdefault((bucket, key), [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._held[(bucket, key)]
+
+
+class Migration:
+    """Copies the objects of `old` to `new`, keeping its progress at `state_path`.
+
+    `source` names the migration; progress saved by a migration with another name,
+    such as one from a previous source, is discarded. With `md5_etags`, objects read are
+    checked against the ETags of `old`, which must then be MD5s except for multipart uploads.
+    """
+
+    def __init__(
+        self,
+        old: Upstream,
+        new: Upstream,
+        state_path: Path,
+        workers: int = 4,
+        spool_dir: Optional[Path] = None,
+        metrics_dir: Optional[Path] = None,
+        source: str = "",
+        md5_etags: bool = False,
+    ):
+        self.old = old
+        self.md5_etags = md5_etags
+        self.new = new
+        self.state_path = Path(state_path)
+        self.workers = max(1, workers)
+        self.spool_dir = spool_dir
+        self.metrics_dir = metrics_dir
+        self.locks = KeyLocks()
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.state = {
+            "source": source,
+            "done": False,
+            "copied": 0,
+            "bytes": 0,
+            "skipped": 0,
+            "failed": 0,
+            "failures": [],
+            "buckets": [],
+            "bucket": "",
+            "marker": "",
+        }
+        saved = load_state(self.state_path)
+        if saved.get("source", "") == source:
+            self.state.update(saved)
+
+    @property
+    def done(self) -> bool:
+        """Whether every object was copied, so the old backend is no longer needed."""
+        return self.state["done"]
+
+    def run(self) -> bool:
+        """Make a pass over the old backend's objects, returning whether it copied them all."""
+        if not (self.state["buckets"] or self.state["bucket"]):
+            # A new pass, so whatever failed is tried again.
+            self.state.update(failed=0, failures=[])
+        saved = time.monotonic()
+        for bucket in list_buckets(self.old):
+            if bucket in self.state["buckets"]:
+                continue
+            marker = self.state["marker"] if bucket == self.state["bucket"] else ""
+            create_bucket(self.new, bucket)
+            jobs = (
+                (key, lambda key=key: self.copy(bucket, key))
+                for key in list_objects(self.old, bucket, marker)
+            )
+            with ThreadPoolExecutor(self.workers) as executor:
+                for key, (outcome, detail) in in_order(executor, 2 * self.workers, jobs):
+                    self._account(bucket, key, outcome, detail)
+                    if time.monotonic() - saved >= CHECKPOINT_SECONDS:
+                        self.state.update(bucket=bucket, marker=key)
+                        self._save()
+                        saved = time.monotonic()
+            self.state["buckets"].append(bucket)
+            self.state.update(bucket="", marker="")
+            self._save()
+
+        self.state.update(done=not self.state["failed"], buckets=[])
+        self._save()
+        return self.done
+
+    def _account(self, bucket: str, key: str, outcome: str, detail):
+        self.state[outcome] += 1
+        if outcome == COPIED:
+            self.state["bytes"] += detail
+        elif outcome == FAILED:
+            logger.warning("cannot copy %s/%s: %s", bucket, key, detail)
+            if len(self.state["failures"]) < MAX_REPORTED:
+                self.state["failures"].append({"object": f"{bucket}/{key}", "error": detail})
+
+    def copy(self, bucket: str, key: str) -> Tuple[str, Any]:
+        """Copy an object unless the new backend has it, returning the outcome and its size.
+
+        If the object can't be copied, the error stands for its size.
+        """
+        path = object_path(bucket, key)
+        with self.locks.hold(bucket, key):
+            error = ""
+            for _ in range(RETRIES):
+                try:
+                    status, _, _ = _call(self.new, "HEAD", path)
+                    if status == 200:
+                        return SKIPPED, 0
+                    outcome, detail = self._copy(path)
+                except (OSError, http.client.HTTPException) as e:
+                    outcome, detail = FAILED, str(e)
+                if outcome != FAILED:
+                    return outcome, detail
+                error = detail
+            return FAILED, error
+
+    def _copy(self, path: str) -> Tuple[str, Any]:
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, dir=self.spool_dir) as spool:
+            response = self.old.request("GET", path, "", {}, None)
+            with response:
+                if response.status != 200:
+                    response.read()
+                    if response.status == 404:
+                        # Deleted since it was listed.
+                        return SKIPPED, 0
+                    return FAILED, f"reading it returned {response.status}"
+                md5, size = self._spool(response, spool)
+                headers = {k.lower(): v for k, v in response.getheaders()}
+            etag = headers.get("etag", "").strip('"')
+            if self.md5_etags and etag and "-" not in etag and etag != md5.hex():
+                return FAILED, f"read with MD5 {md5.hex()}, not {etag}"
+
+            copied = {
+                k: v
+                for k, v in headers.items()
+                if k in _OBJECT_HEADERS or k.startswith("x-amz-meta-")
+            }
+            copied["content-md5"] = base64.b64encode(md5).decode()
+            copied["content-length"] = str(size)
+            spool.seek(0)
+            status, _, _ = _call(self.new, "PUT", path, "", copied, spool)
+        if status != 200:
+            return FAILED, f"writing it returned {status}"
+        return COPIED, size
+
+    @staticmethod
+    def _spool(response: http.client.HTTPResponse, spool: BinaryIO) -> Tuple[bytes, int]:
+        digest, size = md5(), 0
+        for data in iter(lambda: response.read(CHUNK_SIZE), b""):
+            digest.update(data)
+            spool.write(data)
+            size += len(data)
+        return digest.digest(), size
+
+    def _save(self):
+        save_state(self.state_path, self.state)
+        if self.metrics_dir:
+            write_textfile(self.metrics_dir, "migration", self.metrics())
+
+    def metrics(self):
+        """The migration's progress, as `metrics_exporter` metrics."""
+        values = {
+            "s3proxy_migration_done": ("Whether every object was copied.", int(self.done)),
+            "s3proxy_migration_objects_copied": ("Objects copied.", self.state["copied"]),
+            "s3proxy_migration_bytes_copied": ("Bytes of objects copied.", self.state["bytes"]),
+            "s3proxy_migration_objects_skipped": (
+                "Objects the new backend already had.",
+                self.state["skipped"],
+            ),
+            "s3proxy_migration_objects_failed": (
+                "Objects which couldn't be copied in the last pass.",
+                self.state["failed"],
+            ),
+        }
+        return {name: ("gauge", text, {"": value}) for name, (text, value) in values.items()}
+
+
+class MigratingHandler(CachingHandler):
+    """Writes to the new backend, reading from the old one what the new one lacks."""
+
+    # Requests are re-signed for a remote, and sent unsigned to a local s3proxy.
+    unforwarded = CachingHandler.unforwarded | {"x-amz-content-sha256"}
+    server: "MigrationGateway"
+
+    def _handle(self):
+        target = urlsplit(self.path)
+        bucket, _, key = unquote(target.path).lstrip("/").partition("/")
+        migration = self.server.migration
+        if self.command in ("GET", "HEAD"):
+            self._read(target.path, target.query, bucket, key)
+        elif migration.done:
+            self._forward(target.path, target.query, bucket, key)
+        elif self.command == "DELETE":
+            self._delete(target.path, target.query, bucket, key)
+        elif self.command == "POST" and "delete" in dict(parse_qsl(target.query, True)):
+            self._delete_objects(target.path, target.query, bucket)
+        elif key:
+            source = self.headers.get("x-amz-copy-source")
+            if source:
+                # Copied from the object as it is in the new backend, so it must be there.
+                source_bucket, _, source_key = (
+                    unquote(source.split("?")[0]).lstrip("/").partition("/")
+                )
+                migration.copy(source_bucket, source_key)
+            with migration.locks.hold(bucket, key):
+                self._forward(target.path, target.query, bucket, key)
+        else:
+            self._forward(target.path, target.query, bucket, key)
+
+    def _request(self, upstream: Upstream, path: str, query: str, body=None):
+        headers = {
+            k: v
+            for k, v in self.headers.items()
+            if k.lower() not in self.unforwarded | {"content-length"}
+        }
+        if body is not None:
+            headers["Content-Length"] = str(len(body))
+        return upstream.request(self.command, path, query, headers, body)
+
+    def _read(self, path: str, query: str, bucket: str, key: str):
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        if self.server.migration.done:
+            self._relay(self._request(self.server.upstream, path, query), None)
+        elif self.command == "GET" and not bucket:
+            self._merged(path, query, merge_bucket_lists)
+        elif self.command == "GET" and not key and set(params) <= _LISTING_PARAMS:
+            max_keys = int(params.get("max-keys") or 1000)
+            self._merged(path, query, lambda new, old: merge_listings(new, old, max_keys))
+        else:
+            response = self._request(self.server.upstream, path, query)
+            if response.status == 404:
+                response.read()
+                response = self._request(self.server.old, path, query)
+            self._relay(response, None)
+
+    def _merged(self, path: str, query: str, merge):
+        new = self._request(self.server.upstream, path, query)
+        new_body = new.read()
+        old = self._request(self.server.old, path, query)
+        old_body = old.read()
+        if new.status == 200 and old.status == 200:
+            self._send(new, merge(new_body, old_body))
+        elif new.status == 404:
+            # Listed from whichever backend has the bucket.
+            self._send(old, old_body)
+        else:
+            self._send(new, new_body)
+
+    def _send(self, response: http.client.HTTPResponse, body: bytes):
+        """Relay `response`, whose body was read, with `body` instead."""
+        self.send_response_only(response.status, response.reason)
+        for name, value in response.getheaders():
+            if name.lower() not in HOP_BY_HOP | {"content-length"}:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _delete(self, path: str, query: str, bucket: str, key: str):
+        if not key:
+            # A bucket the old backend still has objects in may not be deleted.
+            old = self._request(self.server.old, path, query)
+            old_body = old.read()
+            if old.status not in (204, 404):
+                self._send(old, old_body)
+                return
+            new = self._request(self.server.upstream, path, query)
+            new_body = new.read()
+            # The new backend may not have the bucket yet.
+            self._send(*((old, old_body) if new.status == 404 else (new, new_body)))
+            return
+        with self.server.migration.locks.hold(bucket, key):
+            self._forward(path, query, bucket, key)
+            with self._request(self.server.old, path, query) as old:
+                old.read()
+
+    def _delete_objects(self, path: str, query: str, bucket: str):
+        reader, _ = self.request_body()
+        body = reader.read() if reader is not None else b""
+        keys = sorted({_text(o, "Key") for o in _children(ElementTree.fromstring(body), "Object")})
+        with ExitStack() as stack:
+            # In order, so that deletes of overlapping objects can't deadlock.
+            for key in keys:
+                stack.enter_context(self.server.migration.locks.hold(bucket, key))
+            response = self._request(self.server.upstream, path, query, body)
+            data = response.read()
+            with self._request(self.server.old, path, query, body) as old:
+                old.read()
+        self._send(response, data)
+
+
+class MigrationGateway(CacheGateway):
+    """Serves S3 requests from the `new` backend, and the `old` one until `migration` is done."""
+
+    def __init__(self, address: Tuple[str, int], old: Upstream, new: Upstream, migration):
+        super().__init__(address, new, None, MigratingHandler)
+        self.old = old
+        self.migration = migration
+
+
+def _copy_until_done(migration: Migration, interval: float):
+    while not migration.done:
+        try:
+            if migration.run():
+                logger.info("migration done: %d objects copied", migration.state["copied"])
+                return
+        except (OSError, http.client.HTTPException, ElementTree.ParseError) as e:
+            logger.warning("migration pass failed: %s", e)
+        time.sleep(interval)
+
+
+def main():
+    """Run the gateway and the migration, with the remote's credentials from the environment."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", default="127.0.0.1:8083", help="address:port to serve on")
+    parser.add_argument("--old", required=True, help="endpoint URL of the old backend")
+    parser.add_argument("--new", required=True, help="endpoint URL of the new backend")
+    parser.add_argument("--remote", choices=("old", "new"), help="which backend is remote")
+    parser.add_argument("--region", default="us-east-1", help="the remote's region")
+    parser.add_argument("--state", required=True, help="file to keep progress in")
+    parser.add_argument("--spool-dir", help="directory for large objects being copied")
+    parser.add_argument("--workers", type=int, default=4, help="objects copied at once")
+    parser.add_argument("--interval", type=float, default=300, help="seconds between passes")
+    parser.add_argument("--metrics-dir", help="directory to write metrics to")
+    parser.add_argument("--source", default="", help="name of the migration, to resume it")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    backends = {}
+    for side in ("old", "new"):
+        endpoint = getattr(args, side)
+        if side == args.remote:
+            backends[side] = Remote(
+                endpoint,
+                args.region,
+                os.environ["REMOTE_IDENTITY"],
+                os.environ["REMOTE_CREDENTIAL"],
+            )
+        else:
+            backends[side] = Upstream(endpoint)
+    if args.spool_dir:
+        os.makedirs(args.spool_dir, exist_ok=True)
+    migration = Migration(
+        backends["old"],
+        backends["new"],
+        Path(args.state),
+        args.workers,
+        args.spool_dir,
+        args.metrics_dir,
+        args.source,
+        # The old backend is a filesystem s3proxy unless it is the remote.
+        md5_etags=args.remote != "old",
+    )
+    threading.Thread(target=_copy_until_done, args=(migration, args.interval), daemon=True).start()
+    host, port = args.listen.rsplit(":", 1)
+    logger.info("migrating from %s to %s", args.old, args.new)
+    gateway = MigrationGateway((host, int(port)), backends["old"], backends["new"], migration)
+    gateway.serve_forever()
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
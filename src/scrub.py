@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Detection of silently corrupted objects in s3proxy's filesystem blobstore.
+
+The filesystem provider records the MD5 of each object's content, which is also its
+ETag, as the object's `user.content-md5` attribute. Java keeps such attributes in the
+"user." namespace of extended attributes, so on disk it is `user.user.content-md5`. A
+scrub recomputes the MD5 of every object and reports the ones which differ, or which
+can't be read at all. Objects without a recorded MD5, e.g. where the filesystem doesn't
+support extended attributes, are counted as unverified.
+
+Objects are read in large chunks into a buffer reused by each of a bounded pool of
+threads, and reads are rate limited, to leave I/O to s3proxy. As with `lifecycle`, the
+blobstore is walked in a set order and the path reached is saved regularly, so that an
+interrupted scrub resumes from there. Objects are verified in parallel but accounted for
+in order, so that everything before a checkpoint is known to be done.
+
+Each run's totals, and the first of the mismatches it found, are kept with the
+checkpoint, for the charm to report, and written as Prometheus metrics.
+"""
+
+import argparse
+import base64
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from jobs import load_state, md5, save_state
+from lifecycle import HISTORY, Throttle, walk
+from metrics_exporter import write_textfile
+from transfer import in_order
+
+logger = logging.getLogger(__name__)
+
+# jclouds' "user.content-md5", in the "user." namespace Java puts user-defined attributes in.
+CONTENT_MD5 = "user.user.content-md5"
+CHUNK_SIZE = 8 * 1024 * 1024
+CHECKPOINT_SECONDS = 10
+# Mismatches kept per run; any more are only counted.
+MAX_REPORTED = 100
+
+
+def stored_md5(path: Union[str, int]) -> Optional[bytes]:
+    """The MD5 recorded for the object at `path`, or open as file descriptor `path`, if any."""
+    try:
+        value = os.getxattr(path, CONTENT_MD5)
+    except OSError:
+        return None
+    if len(value) == 16:
+        return value
+    # Not as the filesystem provider records it, but as an ETag or Content-MD5 header.
+    text = value.decode("ascii", "replace").strip('"')
+    try:
+        return bytes.fromhex(text) if len(text) == 32 else base64.b64decode(text, validate=True)
+    except ValueError:
+        return None
+
+
+class Scrub:
+    """A run of the scrub over `basedir`, resuming from the state at `state_path`."""
+
+    def __init__(
+        self,
+        basedir: Path,
+        state_path: Path,
+        workers: int = 2,
+        throttle: Optional[Throttle] = None,
+        metrics_dir: Optional[Path] = None,
+    ):
+        self.basedir = Path(basedir)
+        self.state_path = Path(state_path)
+        self.workers = max(1, workers)
+        self.throttle = throttle or Throttle(0)
+        self.metrics_dir = metrics_dir
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.state = load_state(self.state_path)
+        self._buffers = threading.local()
+
+        checkpoint = self.state.get("checkpoint")
+        if checkpoint:
+            self.run = checkpoint["run"]
+            self.resume = tuple(checkpoint["path"])
+        else:
+            self.run = {
+                "started": time.time(),
+                "objects": 0,
+                "bytes": 0,
+                "unverified": 0,
+                "mismatched": 0,
+                "mismatches": [],
+            }
+            self.resume = ()
+
+    def _verify(self, path: str) -> Optional[Tuple[int, Optional[bytes], Union[bytes, str]]]:
+        """The size of the object at `path`, its recorded MD5 and its actual one.
+
+        If the object can't be read, the error stands for its MD5. Returns None if the
+        object was deleted since it was listed.
+        """
+        if not hasattr(self._buffers, "view"):
+            self._buffers.view = memoryview(bytearray(CHUNK_SIZE))
+        view = self._buffers.view
+        digest, size = md5(), 0
+        try:
+            f = open(path, "rb", buffering=0)
+        except FileNotFoundError:
+            return None
+        with f:
+            # Read from the file opened, should the object be replaced meanwhile.
+            expected = stored_md5(f.fileno())
+            try:
+                while True:
+                    read = f.readinto(view)
+                    if not read:
+                        break
+                    self.throttle(read)
+                    digest.update(view[:read])
+                    size += read
+            except OSError as e:
+                return size, expected, e.strerror or str(e)
+        return size, expected, digest.digest()
+
+    def _account(self, parts: Tuple[str, ...], result):
+        size, expected, actual = result
+        self.run["objects"] += 1
+        self.run["bytes"] += size
+        if isinstance(actual, bytes):
+            if expected is None:
+                self.run["unverified"] += 1
+                return
+            if expected == actual:
+                return
+            actual = actual.hex()
+        key = "/".join(parts)
+        expected = expected.hex() if expected else None
+        logger.warning("%s is corrupt: %s, not MD5 %s", key, actual, expected)
+        self.run["mismatched"] += 1
+        if len(self.run["mismatches"]) < MAX_REPORTED:
+            self.run["mismatches"].append({"object": key, "expected": expected, "actual": actual})
+
+    def __call__(self) -> Dict[str, Any]:
+        """Run to completion, returning the run's totals."""
+        # Until a first bucket is created, s3proxy has no blobstore, so there's nothing to read.
+        entries = walk(str(self.basedir), (), self.resume) if self.basedir.is_dir() else ()
+        jobs = (
+            (parts, lambda path=entry.path: self._verify(path))
+            for parts, entry in entries
+            # Objects are in buckets, not at the top level.
+            if len(parts) > 1 and not entry.is_dir(follow_symlinks=False)
+        )
+        saved = time.monotonic()
+        with ThreadPoolExecutor(self.workers) as executor:
+            for parts, result in in_order(executor, 2 * self.workers, jobs):
+                if result is not None:
+                    self._account(parts, result)
+                if time.monotonic() - saved >= CHECKPOINT_SECONDS:
+                    self.state["checkpoint"] = {"path": list(parts), "run": self.run}
+                    self._save()
+                    saved = time.monotonic()
+
+        self.run["finished"] = time.time()
+        self.state = {"runs": (self.state.get("runs", []) + [self.run])[-HISTORY:]}
+        self._save()
+        return self.run
+
+    def _save(self):
+        save_state(self.state_path, self.state)
+        if self.metrics_dir:
+            write_textfile(self.metrics_dir, "scrub", metrics(self.state))
+
+
+def corrupt_objects(state: Dict[str, Any]) -> int:
+    """Corrupt objects found by the last complete run, or more by the run in progress."""
+    runs = state.get("runs", [])
+    last = runs[-1]["mismatched"] if runs else 0
+    current = state.get("checkpoint", {}).get("run", {}).get("mismatched", 0)
+    return max(last, current)
+
+
+def metrics(state: Dict[str, Any]):
+    """The scrub's progress and findings, as metrics."""
+    runs = state.get("runs", [])
+    last = runs[-1] if runs else {"finished": 0, "objects": 0, "unverified": 0}
+    current = state.get("checkpoint", {}).get("run", {})
+    return {
+        "s3proxy_scrub_corrupt_objects": (
+            "gauge",
+            "Objects whose content doesn't match their MD5.",
+            {"": corrupt_objects(state)},
+        ),
+        "s3proxy_scrub_last_run_timestamp_seconds": (
+            "gauge",
+            "When the last complete scrub finished.",
+            {"": last["finished"]},
+        ),
+        "s3proxy_scrub_last_run_objects": (
+            "gauge",
+            "Objects checked by the last complete scrub, verified or not.",
+            {"": last["objects"]},
+        ),
+        "s3proxy_scrub_last_run_unverified_objects": (
+            "gauge",
+            "Objects without a recorded MD5 in the last complete scrub.",
+            {"": last["unverified"]},
+        ),
+        "s3proxy_scrub_progress_bytes": (
+            "gauge",
+            "Bytes checked so far by the scrub in progress.",
+            {"": current.get("bytes", 0)},
+        ),
+    }
+
+
+def main():
+    """Scrub the blobstore at an interval."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--basedir", required=True, help="the filesystem provider's basedir")
+    parser.add_argument("--state", required=True, help="file to keep checkpoints and totals in")
+    parser.add_argument("--interval", type=float, default=86400, help="seconds between runs")
+    parser.add_argument("--rate", type=float, default=0, help="bytes read per second")
+    parser.add_argument("--workers", type=int, default=2, help="objects read at once")
+    parser.add_argument("--metrics-dir", help="directory to write metrics to")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    throttle = Throttle(args.rate)
+    while True:
+        started = time.monotonic()
+        run = Scrub(
+            Path(args.basedir), Path(args.state), args.workers, throttle, args.metrics_dir
+        )()
+        logger.info(
+            "scrubbed %d objects, %d bytes: %d corrupt, %d unverified",
+            run["objects"],
+            run["bytes"],
+            run["mismatched"],
+            run["unverified"],
+        )
+        time.sleep(max(0, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
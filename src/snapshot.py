@@ -0,0 +1,170 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Incremental snapshots of s3proxy's filesystem blobstore, sharing unchanged files.
+
+A snapshot is a directory next to the blobstore, on the same filesystem, with a copy of
+its tree. Files unchanged since the previous snapshot are hard links to that snapshot's
+files, so only changed ones take I/O and space.
+
+Each snapshot has an index of the blobstore as it was taken: every directory's mtime,
+subdirectories, and files' mtimes and sizes. s3proxy writes objects to a temporary
+file which it renames in place, so a directory whose mtime is unchanged has the same
+files as before, and they can be linked without even being looked at. In others, files
+whose mtime and size are unchanged are linked too, and the rest copied. For the same
+reason, the live files are never linked into snapshots: s3proxy replaces them rather
+than writing to them, but copies keep snapshots safe from anything which doesn't.
+
+As with `usage`, directories modified too recently for their mtime to be trusted are
+indexed as unknown, and looked at again by the next snapshot.
+"""
+
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from usage import RACY_SECONDS
+
+# Relative path -> (mtime_ns, subdirectories, {file: (mtime_ns, size)})
+Index = Dict[str, Tuple[int, List[str], Dict[str, Tuple[int, int]]]]
+
+
+class Result(NamedTuple):
+    """What taking a snapshot did."""
+
+    name: str
+    linked: int
+    copied: int
+    copied_bytes: int
+    pruned: List[str]
+
+
+class Snapshots:
+    """Snapshots of `basedir`, kept in `snapshot_dir`, which must be on the same filesystem."""
+
+    def __init__(self, basedir: Path, snapshot_dir: Path):
+        self.basedir = Path(basedir)
+        self.snapshot_dir = Path(snapshot_dir)
+
+    def names(self) -> List[str]:
+        """The complete snapshots, oldest first."""
+        try:
+            return sorted(
+                path.stem
+                for path in self.snapshot_dir.glob("*.json")
+                if (self.snapshot_dir / path.stem).is_dir()
+            )
+        except FileNotFoundError:
+            return []
+
+    def _load(self, name: str) -> Index:
+        try:
+            return json.loads((self.snapshot_dir / f"{name}.json").read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def take(self, keep: int, now: Optional[float] = None) -> Result:
+        """Snapshot the blobstore, then prune all but the `keep` most recent snapshots."""
+        now = time.time() if now is None else now
+        name = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now))
+        names = self.names()
+        if names and names[-1] >= name:
+            raise ValueError(f"snapshot {names[-1]} is already as recent")
+        previous = names[-1] if names else None
+        old = self._load(previous) if previous else {}
+
+        # Left over by snapshots which didn't complete.
+        for stale in self.snapshot_dir.glob(".*.partial"):
+            shutil.rmtree(stale, ignore_errors=True)
+        # Built aside and renamed once complete, so that a snapshot is never partial.
+        partial = self.snapshot_dir / f".{name}.partial"
+        partial.mkdir(parents=True)
+        builder = _Builder(self.basedir, partial, self.snapshot_dir / (previous or ""), old)
+        index = builder.build((now - RACY_SECONDS) * 1e9)
+        (self.snapshot_dir / f".{name}.json").write_text(json.dumps(index, separators=(",", ":")))
+        os.replace(partial, self.snapshot_dir / name)
+        os.replace(self.snapshot_dir / f".{name}.json", self.snapshot_dir / f"{name}.json")
+
+        pruned = self.names()[:-keep] if keep > 0 else []
+        for stale in pruned:
+            self.delete(stale)
+        return Result(name, builder.linked, builder.copied, builder.copied_bytes, pruned)
+
+    def delete(self, name: str):
+        """Delete snapshot `name`: its index first, so that it is no longer listed."""
+        (self.snapshot_dir / f"{name}.json").unlink(missing_ok=True)
+        shutil.rmtree(self.snapshot_dir / name, ignore_errors=True)
+
+
+class _Builder:
+    """Fills `target` with the tree of `source`, linking what `previous` already has."""
+
+    def __init__(self, source: Path, target: Path, previous: Path, old: Index):
+        self.source, self.target, self.previous, self.old = source, target, previous, old
+        self.linked = self.copied = self.copied_bytes = 0
+
+    def build(self, racy: float) -> Index:
+        index: Index = {}
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            try:
+                mtime = os.stat(os.path.join(self.source, relative)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            os.makedirs(os.path.join(self.target, relative), exist_ok=True)
+            old = self.old.get(relative)
+            if old and old[0] == mtime:
+                subdirectories, files = old[1], old[2]
+                for name, stat in files.items():
+                    self._link_or_copy(os.path.join(relative, name), stat, linkable=True)
+            else:
+                subdirectories, files = self._scan(relative, old[2] if old else {})
+            index[relative] = (mtime if mtime < racy else -1, subdirectories, files)
+            pending.extend(os.path.join(relative, name) for name in subdirectories)
+        return index
+
+    def _scan(self, relative: str, old_files: Dict[str, Tuple[int, int]]):
+        subdirectories, files = [], {}
+        with os.scandir(os.path.join(self.source, relative)) as it:
+            entries = list(it)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.name)
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            stat = (st.st_mtime_ns, st.st_size)
+            old = old_files.get(entry.name)
+            linkable = old is not None and tuple(old) == stat
+            if self._link_or_copy(os.path.join(relative, entry.name), stat, linkable):
+                files[entry.name] = stat
+        return sorted(subdirectories), files
+
+    def _link_or_copy(self, relative: str, stat: Tuple[int, int], linkable: bool) -> bool:
+        """Link the file at `relative` from the previous snapshot if `linkable`, else copy it.
+
+        Returns whether the file made it into the snapshot.
+        """
+        target = os.path.join(self.target, relative)
+        if linkable:
+            try:
+                os.link(os.path.join(self.previous, relative), target)
+                self.linked += 1
+                return True
+            except FileNotFoundError:
+                # Gone from the previous snapshot, so copied afresh.
+                pass
+        try:
+            # Along with its mtime and extended attributes, where s3proxy keeps metadata.
+            shutil.copy2(os.path.join(self.source, relative), target)
+        except FileNotFoundError:
+            return False
+        self.copied += 1
+        self.copied_bytes += stat[1]
+        return True
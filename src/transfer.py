@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Bulk export and import of buckets of s3proxy's filesystem blobstore.
+
+A bucket is exported to, or imported from, one of two formats on a path of the workload
+container, such as a mounted volume:
+
+- "tar": a tar archive (pax format) with one member per object, named after its key.
+- "directory": a directory with an `objects` tree holding the objects under their keys,
+  and `manifest.jsonl`, a line per object giving its key, size and mtime.
+
+Either way, objects keep their mtime, which s3proxy reports as their last modification,
+and their `user.*` extended attributes, where the filesystem provider keeps their content
+type, user metadata and so on; in tar archives as `SCHILY.xattr.*` pax headers, as GNU
+tar does.
+
+Objects are copied in chunks, never held in memory whole. With the directory format,
+several are copied at once, by a bounded pool of threads; a tar archive is sequential,
+so it is read or written one object at a time. Objects are imported through a staging
+directory on the same filesystem, then renamed in place, so that s3proxy never serves a
+partly written one.
+
+A transfer records how far it got in a checkpoint file, and one which is interrupted
+resumes from there when run again with the same arguments. Progress is reported on
+stdout as JSON lines.
+
+This module only uses the standard library, as it runs in the workload container.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Any, Callable, Deque, Dict, Iterable, Iterator, Tuple
+
+from lifecycle import walk
+
+CHUNK_SIZE = 1024 * 1024
+XATTR_PREFIX = "user."
+PAX_XATTR = "SCHILY.xattr."
+MANIFEST = "manifest.jsonl"
+# How often progress is saved and reported.
+CHECKPOINT_SECONDS = 5
+
+
+def _xattrs(path: str) -> Dict[str, bytes]:
+    try:
+        names = os.listxattr(path)
+    except OSError:
+        # Not supported by the filesystem.
+        return {}
+    return {name: os.getxattr(path, name) for name in names if name.startswith(XATTR_PREFIX)}
+
+
+def _set_xattrs(path: str, xattrs: Dict[str, bytes]):
+    for name, value in xattrs.items():
+        try:
+            os.setxattr(path, name, value)
+        except OSError:
+            return
+
+
+def _key_path(root: Path, key: str) -> Path:
+    """Where object `key` goes under `root`, refusing keys which would escape it."""
+    parts = key.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"unsafe key {key!r}")
+    return root.joinpath(*parts)
+
+
+class Checkpoint:
+    """How far a transfer got, kept at `path`, for it to resume from if interrupted."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self.state: Dict[str, Any] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.state = {}
+        self.objects = self.state.get("objects", 0)
+        self.bytes = self.state.get("bytes", 0)
+        self._saved = time.monotonic()
+
+    def done(self, size: int, **position):
+        """Count an object done, saving the `position` reached and reporting progress."""
+        self.objects += 1
+        self.bytes += size
+        if time.monotonic() - self._saved >= CHECKPOINT_SECONDS:
+            self.save(**position)
+
+    def save(self, **position):
+        """Record `position`, along with the totals so far."""
+        self.state = dict(position, objects=self.objects, bytes=self.bytes)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+        self._saved = time.monotonic()
+        _report(objects=self.objects, bytes=self.bytes)
+
+    def finish(self):
+        """Remove the checkpoint, as there is nothing left to resume."""
+        self.path.unlink(missing_ok=True)
+        _report(objects=self.objects, bytes=self.bytes, done=True)
+
+
+def _report(**progress):
+    print(json.dumps(progress), flush=True)
+
+
+def in_order(
+    executor: ThreadPoolExecutor, window: int, jobs: Iterable[Tuple[Any, Callable[[], Any]]]
+) -> Iterator[Tuple[Any, Any]]:
+    """Run `jobs` on `executor`, yielding each (tag, result) in the order they were given.
+
+    At most `window` are pending at once, so that however many jobs there are, only that
+    many are held, and whatever precedes a yielded result is known to be done too.
+    """
+    pending: Deque[Tuple[Any, Future]] = deque()
+    for tag, job in jobs:
+        pending.append((tag, executor.submit(job)))
+        if len(pending) >= window:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+    while pending:
+        tag, future = pending.popleft()
+        yield tag, future.result()
+
+
+class Transfer:
+    """Copies between bucket `bucket` under `basedir`, and `path`.
+
+    The checkpoint and staged objects are kept in `work_dir`, which must be on the same
+    filesystem as `basedir`.
+    """
+
+    def __init__(self, basedir: Path, bucket: str, path: Path, work_dir: Path, parallel: int = 4):
+        self.bucket_dir = _key_path(Path(basedir), bucket)
+        self.path = Path(path)
+        self.staging = Path(work_dir) / "staging"
+        self.parallel = max(1, parallel)
+        self._work_dir = Path(work_dir)
+        self._bucket = bucket
+
+    def _checkpoint(self, direction: str, fmt: str) -> Checkpoint:
+        transfer = f"{direction}\0{fmt}\0{self._bucket}\0{self.path.resolve()}"
+        name = hashlib.sha256(transfer.encode()).hexdigest()[:16]
+        return Checkpoint(self._work_dir / f"{direction}-{self._bucket}-{name}.json")
+
+    def _objects(self, after: Tuple[str, ...]) -> Iterator[Tuple[Tuple[str, ...], os.DirEntry]]:
+        for parts, entry in walk(str(self.bucket_dir), (), after):
+            if not entry.is_dir(follow_symlinks=False):
+                yield parts, entry
+
+    def _stage(self, source: IO[bytes], key: str, mtime: float, xattrs: Dict[str, bytes]):
+        """Copy `source` to object `key`, through the staging directory."""
+        target = _key_path(self.bucket_dir, key)
+        self.staging.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.staging)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            _set_xattrs(tmp, xattrs)
+            os.utime(tmp, (mtime, mtime))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def export_directory(self):
+        """Export the bucket to a manifest and objects tree at `path`."""
+        checkpoint = self._checkpoint("export", "directory")
+        after = tuple(checkpoint.state.get("after", ()))
+        objects_dir = self.path / "objects"
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest = open(self.path / MANIFEST, "ab")
+        # Drop whatever was written after the checkpoint, as it will be written again.
+        manifest.truncate(checkpoint.state.get("offset", 0))
+
+        def copy(entry: os.DirEntry, key: str) -> Dict[str, Any]:
+            target = _key_path(objects_dir, key)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(entry.path, target)
+            st = os.stat(entry.path)
+            os.utime(target, (st.st_mtime, st.st_mtime))
+            xattrs = _xattrs(entry.path)
+            return {
+                "key": key,
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "xattrs": {k: base64.b64encode(v).decode() for k, v in xattrs.items()},
+            }
+
+        jobs = (
+            (parts, lambda e=entry, k="/".join(parts): copy(e, k))
+            for parts, entry in self._objects(after)
+        )
+        with manifest, ThreadPoolExecutor(self.parallel) as executor:
+            for parts, record in in_order(executor, 2 * self.parallel, jobs):
+                manifest.write(json.dumps(record).encode() + b"\n")
+                manifest.flush()
+                checkpoint.done(record["size"], after=parts, offset=manifest.tell())
+        checkpoint.finish()
+
+    def import_directory(self):
+        """Import the bucket from a manifest and objects tree at `path`."""
+        checkpoint = self._checkpoint("import", "directory")
+        objects_dir = self.path / "objects"
+
+        def copy(record: Dict[str, Any]) -> int:
+            xattrs = {k: base64.b64decode(v) for k, v in record.get("xattrs", {}).items()}
+            with open(_key_path(objects_dir, record["key"]), "rb") as source:
+                self._stage(source, record["key"], record["mtime"], xattrs)
+            return record["size"]
+
+        def records(manifest: IO[bytes]) -> Iterator[Tuple[int, Callable[[], int]]]:
+            offset = manifest.tell()
+            for line in iter(manifest.readline, b""):
+                offset += len(line)
+                record = json.loads(line)
+                _key_path(self.bucket_dir, record["key"])
+                yield offset, lambda r=record: copy(r)
+
+        self.bucket_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path / MANIFEST, "rb") as manifest, ThreadPoolExecutor(
+            self.parallel
+        ) as executor:
+            manifest.seek(checkpoint.state.get("offset", 0))
+            for offset, size in in_order(executor, 2 * self.parallel, records(manifest)):
+                checkpoint.done(size, offset=offset)
+        checkpoint.finish()
+
+    def export_tar(self):
+        """Export the bucket to a tar archive at `path`."""
+        checkpoint = self._checkpoint("export", "tar")
+        after = tuple(checkpoint.state.get("after", ()))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "r+b" if after else "wb") as f:
+            # Pick up right after the last member checkpointed.
+            f.truncate(checkpoint.state.get("offset", 0))
+            f.seek(checkpoint.state.get("offset", 0))
+            with tarfile.open(fileobj=f, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                for parts, entry in self._objects(after):
+                    st = entry.stat(follow_symlinks=False)
+                    info = tarfile.TarInfo("/".join(parts))
+                    info.size, info.mtime, info.mode = st.st_size, st.st_mtime, 0o644
+                    info.pax_headers = {
+                        PAX_XATTR + name: value.decode("utf-8", "surrogateescape")
+                        for name, value in _xattrs(entry.path).items()
+                    }
+                    with open(entry.path, "rb") as source:
+                        tar.addfile(info, source)
+                    f.flush()
+                    checkpoint.done(st.st_size, after=parts, offset=tar.offset)
+        checkpoint.finish()
+
+    def import_tar(self):
+        """Import the bucket from a tar archive at `path`."""
+        checkpoint = self._checkpoint("import", "tar")
+        self.bucket_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "rb") as f:
+            f.seek(checkpoint.state.get("offset", 0))
+            tar = tarfile.open(fileobj=f, mode="r:")
+            while (info := tar.next()) is not None:
+                # Don't keep every member seen, as a listing would.
+                tar.members = []
+                if not info.isfile():
+                    continue
+                xattrs = {
+                    name.partition(PAX_XATTR)[2]: value.encode("utf-8", "surrogateescape")
+                    for name, value in info.pax_headers.items()
+                    if name.startswith(PAX_XATTR + XATTR_PREFIX)
+                }
+                self._stage(tar.extractfile(info), info.name, info.mtime, xattrs)
+                checkpoint.done(info.size, offset=tar.offset)
+        checkpoint.finish()
+
+
+def main():
+    """Export or import a bucket, as given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("direction", choices=("export", "import"))
+    parser.add_argument("--basedir", required=True, help="the filesystem provider's basedir")
+    parser.add_argument("--work-dir", required=True, help="where to keep checkpoints")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--path", required=True, help="the archive or directory")
+    parser.add_argument("--format", choices=("tar", "directory"), default="directory")
+    parser.add_argument("--parallel", type=int, default=4, help="objects copied at once")
+    args = parser.parse_args()
+
+    transfer = Transfer(
+        Path(args.basedir), args.bucket, Path(args.path), Path(args.work_dir), args.parallel
+    )
+    if args.direction == "export" and not transfer.bucket_dir.is_dir():
+        sys.exit(f"no such bucket {args.bucket!r}")
+    try:
+        getattr(transfer, f"{args.direction}_{args.format}")()
+    except (OSError, ValueError, tarfile.TarError) as e:
+        sys.exit(f"{args.direction} failed: {e}")
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
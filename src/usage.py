@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Object count and size of each bucket of s3proxy's filesystem blobstore.
+
+Counting means visiting every object, so the counts of each directory's own files are
+kept in an index, one file per bucket, along with the directory's modification time and
+subdirectories. s3proxy writes objects to a temporary file which it then renames, and
+deletes them by unlinking, so any change to a directory's files changes its mtime. An
+update therefore only stats directories, and only lists those whose mtime changed.
+
+A directory modified in the same instant it is indexed could change again without its
+mtime moving, so directories modified too recently are indexed as unknown, and listed
+again on the next update.
+
+This module only uses the standard library, as it also runs in the workload container.
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from metrics_exporter import labels, write_textfile
+
+logger = logging.getLogger(__name__)
+
+# How long ago a directory must have been modified for its mtime to be trusted.
+RACY_SECONDS = 2
+
+# Relative path -> (mtime_ns, objects, bytes, subdirectories)
+Index = Dict[str, Tuple[int, int, int, List[str]]]
+
+
+class Usage(NamedTuple):
+    """A bucket's usage, and how many of its directories had to be listed to get it."""
+
+    bucket: str
+    objects: int
+    bytes: int
+    directories: int
+    listed: int
+
+
+class BucketUsage:
+    """Usage of the buckets under `basedir`, indexed in `index_dir`."""
+
+    def __init__(self, basedir: Path, index_dir: Path):
+        self.basedir = Path(basedir)
+        self.index_dir = Path(index_dir)
+
+    def buckets(self) -> List[str]:
+        """The buckets in the blobstore."""
+        try:
+            with os.scandir(self.basedir) as it:
+                return sorted(e.name for e in it if e.is_dir(follow_symlinks=False))
+        except FileNotFoundError:
+            return []
+
+    def update(self, buckets: Optional[Iterable[str]] = None) -> Iterator[Usage]:
+        """Bring the index of `buckets`, or all, up to date, yielding each's usage in turn."""
+        if buckets is None:
+            buckets = self.buckets()
+            self._forget_deleted(buckets)
+        for bucket in buckets:
+            yield self._update(bucket)
+
+    def _forget_deleted(self, buckets: List[str]):
+        try:
+            indexed = [path for path in self.index_dir.iterdir() if path.suffix == ".json"]
+        except FileNotFoundError:
+            return
+        for path in indexed:
+            if path.stem not in buckets:
+                path.unlink()
+
+    def _index_path(self, bucket: str) -> Path:
+        return self.index_dir / f"{bucket}.json"
+
+    def _load(self, bucket: str) -> Index:
+        try:
+            return json.loads(self._index_path(bucket).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, bucket: str, index: Index):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.index_dir, prefix=f".{bucket}.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp, self._index_path(bucket))
+
+    def _update(self, bucket: str) -> Usage:
+        old = self._load(bucket)
+        new: Index = {}
+        objects = size = listed = 0
+        root = self.basedir / bucket
+        racy = (time.time() - RACY_SECONDS) * 1e9
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            path = os.path.join(root, relative)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if relative in old and old[relative][0] == mtime:
+                    entry = old[relative]
+                else:
+                    listed += 1
+                    entry = _list(path, mtime if mtime < racy else -1)
+            except FileNotFoundError:
+                continue
+            new[relative] = entry
+            objects += entry[1]
+            size += entry[2]
+            pending.extend(os.path.join(relative, name) for name in entry[3])
+
+        if root.is_dir():
+            self._save(bucket, new)
+        elif self._index_path(bucket).exists():
+            self._index_path(bucket).unlink()
+        return Usage(bucket, objects, size, len(new), listed)
+
+
+def _list(path: str, mtime: int) -> Tuple[int, int, int, List[str]]:
+    """Index the directory at `path`: its own files' count and size, and subdirectories."""
+    objects = size = 0
+    subdirectories = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.name)
+                continue
+            try:
+                size += entry.stat(follow_symlinks=False).st_size
+                objects += 1
+            except FileNotFoundError:
+                continue
+    return mtime, objects, size, sorted(subdirectories)
+
+
+def metrics(usages: Iterable[Usage]):
+    """Usage of each bucket, as metrics."""
+    usages = list(usages)
+    return {
+        "s3proxy_bucket_objects": (
+            "gauge",
+            "Objects in the bucket.",
+            {labels(bucket=u.bucket): u.objects for u in usages},
+        ),
+        "s3proxy_bucket_size_bytes": (
+            "gauge",
+            "Bytes of objects in the bucket.",
+            {labels(bucket=u.bucket): u.bytes for u in usages},
+        ),
+    }
+
+
+def main():
+    """Keep the index and metrics up to date, at an interval."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--basedir", required=True, help="the filesystem provider's basedir")
+    parser.add_argument("--index-dir", required=True, help="directory to keep the index in")
+    parser.add_argument("--interval", type=float, default=300, help="seconds between updates")
+    parser.add_argument("--metrics-dir", required=True, help="directory to write metrics to")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    usage = BucketUsage(Path(args.basedir), Path(args.index_dir))
+    while True:
+        started = time.monotonic()
+        usages = list(usage.update())
+        write_textfile(args.metrics_dir, "usage", metrics(usages))
+        logger.debug(
+            "listed %d of %d directories",
+            sum(u.listed for u in usages),
+            sum(u.directories for u in usages),
+        )
+        time.sleep(max(0, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
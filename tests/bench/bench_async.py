@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Throughput of AsyncObjectStorageClient bulk operations as concurrency grows.
+
+Runs against an in-process moto server, or against a real s3proxy if
+S3_ENDPOINT, S3_ACCESS_KEY and S3_SECRET_KEY are set.
+
+A loopback stand-in has no network latency, so concurrency has nothing to hide and the
+stand-in's own CPU is the limit. Requests are therefore relayed through a proxy which
+delays each one by BENCH_LATENCY_MS (default 10ms), like a hop across a cluster network.
+Set it to 0 to talk to the endpoint directly.
+
+Run with:
+    PYTHONPATH=lib python tests/bench/bench_async.py
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from charms.s3proxy_k8s.v0.object_storage import (
+    AsyncObjectStorageClient,
+    BucketInfo,
+    build_s3_client,
+)
+
+CONCURRENCY = (1, 4, 16, 64)
+OBJECTS = 256
+OBJECT_SIZE = 64 * 1024
+
+
+class _LatencyProxy:
+    """TCP relay which delays every chunk sent towards the server."""
+
+    def __init__(self, endpoint: str, latency: float):
+        url = urlsplit(endpoint)
+        self.upstream = (url.hostname, url.port)
+        self.latency = latency
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        started = threading.Event()
+        threading.Thread(target=self._serve, args=(started,), daemon=True).start()
+        started.wait()
+
+    def _serve(self, started: threading.Event):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+
+    async def _pipe(self, reader, writer, delay: float):
+        try:
+            while chunk := await reader.read(65536):
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(*self.upstream)
+        await asyncio.gather(
+            self._pipe(client_reader, server_writer, self.latency),
+            self._pipe(server_reader, client_writer, 0),
+            return_exceptions=True,
+        )
+
+
+async def _run(info: BucketInfo, concurrency: int):
+    body = os.urandom(OBJECT_SIZE)
+    objects = {f"bench/{concurrency}/{i}": body for i in range(OBJECTS)}
+    async with AsyncObjectStorageClient(info, concurrency=concurrency) as s3:
+        start = time.perf_counter()
+        await s3.put_many(objects)
+        put = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await s3.get_many(objects)
+        get = time.perf_counter() - start
+    return OBJECTS / put, OBJECTS / get
+
+
+def main():
+    """Print PUT and GET throughput for each concurrency level."""
+    server = None
+    if os.environ.get("S3_ENDPOINT"):
+        info = BucketInfo(
+            "bench",
+            os.environ["S3_ENDPOINT"],
+            os.environ["S3_ACCESS_KEY"],
+            os.environ["S3_SECRET_KEY"],
+        )
+    else:
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        info = BucketInfo("bench", f"http://{host}:{port}", "access", "secret")
+
+    latency = float(os.environ.get("BENCH_LATENCY_MS", "10")) / 1000
+    if latency:
+        proxy = _LatencyProxy(info.endpoint, latency)
+        info = BucketInfo(
+            info.bucket, f"http://127.0.0.1:{proxy.port}", info.access_key, info.secret_key
+        )
+
+    try:
+        build_s3_client(info).create_bucket(Bucket=info.bucket)
+        print(f"{'concurrency':>11} {'PUT obj/s':>10} {'GET obj/s':>10}")
+        for concurrency in CONCURRENCY:
+            put, get = asyncio.run(_run(info, concurrency))
+            print(f"{concurrency:>11} {put:>10.0f} {get:>10.0f}")
+    finally:
+        if server:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""How hook time grows with the number of `s3` relations on the provider.
+
+Builds a model with 10, 100 and 1000 related applications under the ops testing
+harness, then times the hooks which touch every relation: leader-elected, pebble-ready,
+an endpoint refresh and config-changed. S3 calls are mocked out, so only the charm's
+and the library's own work is measured.
+
+Each hook should cost about the same per relation at every scale. If the per-relation
+cost at the largest scale is more than GROWTH_LIMIT times that at the smallest, the
+growth is flagged as super-linear and the exit status is non-zero.
+
+Setting the model up takes longer than the hooks themselves: the harness rebuilds every
+relation's model object each time one is added, which is quadratic but only affects the
+harness, not a deployed charm.
+
+Run with:
+    PYTHONPATH=.:lib:src python tests/bench/bench_scale.py
+"""
+
+import sys
+import time
+from typing import Callable, Dict
+from unittest.mock import PropertyMock, patch
+
+import ops.testing
+from ops.testing import Harness
+
+from charm import S3ProxyK8SOperatorCharm
+
+RELATION_COUNTS = (10, 100, 1000)
+# Allow for noise and fixed per-hook costs, but not for another factor of N.
+GROWTH_LIMIT = 3.0
+
+ops.testing.SIMULATE_CAN_CONNECT = True
+
+
+def _build(relations: int) -> Harness:
+    harness = Harness(S3ProxyK8SOperatorCharm)
+    harness.update_config({"identity": "scale", "credential": "scale"})
+    harness.begin()
+    # Relate as a non-leader, so that setting up doesn't publish anything yet.
+    for i in range(relations):
+        app = f"app-{i}"
+        rel_id = harness.add_relation("s3", app)
+        harness.add_relation_unit(rel_id, f"{app}/0")
+        harness.update_relation_data(rel_id, app, {"bucket": app})
+    harness.framework.commit()
+    return harness
+
+
+def _timed(harness: Harness, hook: Callable[[], object]) -> float:
+    # Every dispatch starts with an empty model cache, as it runs in a new process.
+    harness.model.relations._invalidate("s3")
+    start = time.perf_counter()
+    hook()
+    harness.framework.commit()
+    return time.perf_counter() - start
+
+
+def measure(relations: int) -> Dict[str, float]:
+    """Seconds taken by each hook with `relations` related applications."""
+    harness = _build(relations)
+    charm = harness.charm
+    try:
+        return {
+            "leader-elected": _timed(harness, lambda: harness.set_leader(True)),
+            "pebble-ready": _timed(harness, lambda: harness.container_pebble_ready("s3proxy")),
+            "refresh": _timed(harness, lambda: charm.object_storage.on.refresh.emit()),
+            "config-changed": _timed(harness, lambda: harness.update_config({"cpu": "2"})),
+        }
+    finally:
+        harness.cleanup()
+
+
+def main() -> int:
+    """Print the per-relation cost of each hook at each scale, and flag super-linear growth."""
+    with patch("charm.KubernetesServicePatch", lambda *_: None), patch(
+        "lightkube.core.client.GenericSyncClient"
+    ), patch("charm.boto3.client"), patch.object(
+        S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+    ) as version:
+        version.return_value = "scale"
+        results = {count: measure(count) for count in RELATION_COUNTS}
+
+    hooks = list(results[RELATION_COUNTS[0]])
+    print(f"{'hook':>15}" + "".join(f"{f'{n} rel (ms)':>16}" for n in RELATION_COUNTS))
+    failed = False
+    for hook in hooks:
+        row = "".join(f"{results[n][hook] * 1000:>16.1f}" for n in RELATION_COUNTS)
+        smallest, largest = RELATION_COUNTS[0], RELATION_COUNTS[-1]
+        growth = (results[largest][hook] / largest) / (results[smallest][hook] / smallest)
+        flag = ""
+        if growth > GROWTH_LIMIT:
+            failed = True
+            flag = f"  super-linear: {growth:.1f}x per relation"
+        print(f"{hook:>15}{row}{flag}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Benchmarks for the charm's S3 operations and the data path, against a local S3.
+
+The stand-in is s3proxy itself if S3PROXY_JAR points at its jar (and `java` is on the
+PATH), started with the filesystem backend in a temporary directory, like the charm
+runs it. Otherwise it is an in-process moto server.
+
+Two groups of benchmarks run against it:
+
+- charm: bucket provisioning and relation fan-out as `S3ProxyK8SOperatorCharm` does
+  them under the ops testing harness, and its readiness probe;
+- data: PUT, GET and LIST of objects of several sizes, with a client from the
+  object_storage library.
+
+Results are written as JSON. Given the results of an earlier revision as a baseline,
+changes past a threshold are reported, and the exit status is non-zero if any got
+slower, so revisions can be compared locally or in CI.
+
+Run with:
+    tox -e bench -- --output bench.json [--baseline previous.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List
+from unittest.mock import PropertyMock, patch
+
+import ops.testing
+from charms.s3proxy_k8s.v0.object_storage import BucketInfo, build_s3_client
+from ops.testing import Harness
+
+from charm import S3ProxyK8SOperatorCharm
+
+RELATION_COUNTS = (1, 10, 100)
+OBJECT_SIZES = (1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+# Keep every size to roughly the same number of bytes, with enough requests for p99.
+BYTES_PER_SIZE = 64 * 1024 * 1024
+MIN_OBJECTS, MAX_OBJECTS = 8, 200
+PROBES = 50
+# Metrics are durations, so "worse" is "larger".
+DEFAULT_THRESHOLD = 0.2
+
+ops.testing.SIMULATE_CAN_CONNECT = True
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def s3proxy_backend(jar: str) -> Iterator[BucketInfo]:
+    """Run s3proxy from `jar` with a throwaway filesystem backend."""
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as basedir:
+        args = {
+            "s3proxy.endpoint": f"http://127.0.0.1:{port}",
+            "s3proxy.authorization": "none",
+            "jclouds.provider": "filesystem",
+            "jclouds.identity": "bench",
+            "jclouds.credential": "bench",
+            "jclouds.filesystem.basedir": basedir,
+        }
+        command = ["java", *(f"-D{k}={v}" for k, v in args.items())]
+        command += ["-jar", jar, "--properties", "/dev/null"]
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        try:
+            info = BucketInfo("bench", f"http://127.0.0.1:{port}", "bench", "bench")
+            client = build_s3_client(info, max_attempts=1)
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    client.list_buckets()
+                    break
+                except Exception:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("s3proxy did not start")
+                    time.sleep(0.2)
+            yield info
+        finally:
+            process.terminate()
+            process.wait()
+
+
+@contextmanager
+def moto_backend() -> Iterator[BucketInfo]:
+    """Run an in-process moto server."""
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        yield BucketInfo("bench", f"http://{host}:{port}", "bench", "bench")
+    finally:
+        server.stop()
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    """Latency summary, in milliseconds, of per-operation durations in seconds."""
+    ordered = sorted(samples)
+    return {
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+    }
+
+
+def _timed(operation: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    operation()
+    return time.perf_counter() - start
+
+
+class CharmBench:
+    """Drives `S3ProxyK8SOperatorCharm` under the harness, with its S3 calls hitting `info`."""
+
+    def __init__(self, info: BucketInfo):
+        self.info = info
+
+    @contextmanager
+    def _harness(self) -> Iterator[Harness]:
+        host, port = self.info.endpoint.rsplit("//", 1)[1].rsplit(":", 1)
+        with patch("charm.KubernetesServicePatch", lambda *_: None), patch(
+            "lightkube.core.client.GenericSyncClient"
+        ), patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        ) as version, patch.object(
+            S3ProxyK8SOperatorCharm, "instance_addr", host
+        ), patch.object(
+            S3ProxyK8SOperatorCharm, "http_listen_port", int(port)
+        ):
+            version.return_value = "bench"
+            harness = Harness(S3ProxyK8SOperatorCharm)
+            try:
+                harness.set_leader(True)
+                harness.update_config({"identity": "bench", "credential": "bench"})
+                harness.begin()
+                harness.container_pebble_ready("s3proxy")
+                harness.framework.commit()
+                yield harness
+            finally:
+                harness.cleanup()
+
+    def run(self) -> Dict[str, Dict[str, float]]:
+        results = {"readiness_probe": self.readiness_probe()}
+        for count in RELATION_COUNTS:
+            results[f"provision_{count}_relations"] = self.provision(count)
+            results[f"fan_out_{count}_relations"] = self.fan_out(count)
+        return results
+
+    def readiness_probe(self) -> Dict[str, float]:
+        """The probe is memoized per dispatch, so each sample is a fresh dispatch."""
+        with self._harness() as harness:
+            charm = harness.charm
+            samples = []
+            for _ in range(PROBES):
+                harness.framework.commit()
+                samples.append(_timed(charm._workload_ready))
+        return _summary(samples)
+
+    def provision(self, relations: int) -> Dict[str, float]:
+        """Relate `relations` apps, each asking for its own bucket, one hook at a time."""
+        with self._harness() as harness:
+            samples = []
+            for i in range(relations):
+                app = f"prov-{relations}-{i}"
+                rel_id = harness.add_relation("s3", app)
+                harness.add_relation_unit(rel_id, f"{app}/0")
+                samples.append(
+                    _timed(lambda: harness.update_relation_data(rel_id, app, {"bucket": app}))
+                )
+                harness.framework.commit()
+        return _summary(samples)
+
+    def fan_out(self, relations: int) -> Dict[str, float]:
+        """Config-changed republishing the endpoint and hints to every relation."""
+        with self._harness() as harness:
+            for i in range(relations):
+                app = f"fan-{relations}-{i}"
+                rel_id = harness.add_relation("s3", app)
+                harness.add_relation_unit(rel_id, f"{app}/0")
+                harness.update_relation_data(rel_id, app, {"bucket": app})
+                harness.framework.commit()
+            samples = []
+            for cpu in ("1", "2") * 5:
+                samples.append(_timed(lambda: harness.update_config({"cpu": cpu})))
+                harness.framework.commit()
+        return _summary(samples)
+
+
+class DataBench:
+    """PUT, GET and LIST against the bucket in `info`, one size at a time."""
+
+    def __init__(self, info: BucketInfo):
+        self.info = info
+        self.client = build_s3_client(info)
+
+    def run(self) -> Dict[str, Dict[str, float]]:
+        self.client.create_bucket(Bucket=self.info.bucket)
+        results = {}
+        for size in OBJECT_SIZES:
+            results.update(self.sized(size))
+        return results
+
+    def sized(self, size: int) -> Dict[str, Dict[str, float]]:
+        count = max(MIN_OBJECTS, min(MAX_OBJECTS, BYTES_PER_SIZE // size))
+        body = os.urandom(size)
+        keys = [f"data/{size}/{i}" for i in range(count)]
+        bucket = self.info.bucket
+        client = self.client
+
+        put = [_timed(lambda: client.put_object(Bucket=bucket, Key=k, Body=body)) for k in keys]
+        get = [
+            _timed(lambda: client.get_object(Bucket=bucket, Key=k)["Body"].read()) for k in keys
+        ]
+        listing = [
+            _timed(lambda: client.list_objects_v2(Bucket=bucket, Prefix=f"data/{size}/"))
+            for _ in range(10)
+        ]
+        client.delete_objects(
+            Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True}
+        )
+
+        results = {}
+        for name, samples in (("put", put), ("get", get)):
+            summary = _summary(samples)
+            summary["mib_per_s"] = size * len(samples) / sum(samples) / (1024 * 1024)
+            results[f"{name}_{size}b"] = summary
+        results[f"list_{count}_objects"] = _summary(listing)
+        return results
+
+
+def _revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Describe latencies which grew by more than `threshold` since `baseline`."""
+    regressions = []
+    for group, benches in results["benchmarks"].items():
+        for name, metrics in benches.items():
+            before = baseline.get("benchmarks", {}).get(group, {}).get(name, {})
+            for metric in ("p50_ms", "p99_ms"):
+                if before.get(metric) and metrics[metric] > before[metric] * (1 + threshold):
+                    regressions.append(
+                        f"{group}.{name}.{metric}: "
+                        f"{before[metric]:.2f} -> {metrics[metric]:.2f} "
+                        f"(+{metrics[metric] / before[metric] - 1:.0%})"
+                    )
+    return regressions
+
+
+def main() -> int:
+    """Run the benchmarks, write the results, and compare them with a baseline if given."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="file to write JSON results to (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--only", choices=("charm", "data"), help="run one group only")
+    args = parser.parse_args()
+
+    jar = os.environ.get("S3PROXY_JAR")
+    use_s3proxy = bool(jar) and shutil.which("java") is not None
+    backend = s3proxy_backend(jar) if use_s3proxy else moto_backend()  # type: ignore
+
+    with backend as info:
+        benchmarks = {}
+        if args.only in (None, "charm"):
+            benchmarks["charm"] = CharmBench(info).run()
+        if args.only in (None, "data"):
+            benchmarks["data"] = DataBench(info).run()
+
+    results = {
+        "revision": _revision(),
+        "backend": "s3proxy" if use_s3proxy else "moto",
+        "python": platform.python_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "benchmarks": benchmarks,
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"slower: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Microbenchmark for relation data validation in the object_storage library.
+
+Compares the per-relation cost of validating the databag with a fresh
+`jsonschema.validate` call (which re-checks the schema and builds a new validator
+every time) against the library's cached validators.
+
+Run with:
+    PYTHONPATH=lib python tests/bench/bench_validation.py
+"""
+
+import time
+
+import jsonschema
+from charms.s3proxy_k8s.v0.object_storage import (
+    ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA,
+    _validate_data,
+)
+
+RELATION_COUNTS = (1, 100, 1000)
+
+
+def _uncached(data, schema):
+    jsonschema.validate(instance=data, schema=schema)
+
+
+def _time_per_relation(validate, relations: int) -> float:
+    schema = ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA
+    databags = [
+        {
+            "bucket": f"app-{i}",
+            "endpoint": "http://s3proxy-0.s3proxy-endpoints:8080",
+            "access-key": "a" * 20,
+            "secret-key": "s" * 40,
+        }
+        for i in range(relations)
+    ]
+    start = time.perf_counter()
+    for data in databags:
+        validate(data, schema)
+    return (time.perf_counter() - start) / relations
+
+
+def main():
+    """Print the per-relation validation cost before and after caching."""
+    # Warm the cache so the one-off compilation isn't attributed to the first relation.
+    _validate_data({"bucket": "warmup"}, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
+
+    print(f"{'relations':>10} {'uncached (us)':>15} {'cached (us)':>13} {'speedup':>9}")
+    for count in RELATION_COUNTS:
+        before = _time_per_relation(_uncached, count)
+        after = _time_per_relation(_validate_data, count)
+        print(f"{count:>10} {before * 1e6:>15.1f} {after * 1e6:>13.1f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
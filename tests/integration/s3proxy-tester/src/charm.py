@@ -7,9 +7,13 @@
 import logging
 from pathlib import Path
 
-from boto3 import client
-from charms.s3proxy_k8s.v0.object_storage import ObjectStorageRequirer
-from ops.charm import CharmBase
+from charms.s3proxy_k8s.v0.object_storage import (
+    ObjectStorageRequirer,
+    build_s3_client,
+    build_transfer_config,
+)
+from load import LoadProfile, LoadRun, parse_size_distribution
+from ops.charm import ActionEvent, CharmBase
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus
 
@@ -30,6 +34,7 @@ class S3ProxyTesterCharm(CharmBase):
         )
 
         self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.run_load_action, self._on_run_load)
 
     def _on_s3proxy_tester_pebble_ready(self, _):
         """Just set it ready. It's a pause image."""
@@ -46,16 +51,41 @@ class S3ProxyTesterCharm(CharmBase):
 
     def on_storage_ready(self, event):
         """Create some test data in s3."""
-        s3client = client(
-            service_name="s3",
-            endpoint_url=event.endpoint,
-            aws_access_key_id=event.access_key,
-            aws_secret_access_key=event.secret_key,
-        )
+        s3client = build_s3_client(event)
         _ = Path("./s3proxy-tester.txt").write_text("some test data")
         s3client.upload_file(
-            Bucket=event.bucket, Filename="./s3proxy-tester.txt", Key="s3proxy-tester.txt"
+            Bucket=event.bucket,
+            Filename="./s3proxy-tester.txt",
+            Key="s3proxy-tester.txt",
+            Config=build_transfer_config(),
+        )
+
+    def _on_run_load(self, event: ActionEvent):
+        """Generate load against the related bucket and report how it went."""
+        info = self.object_storage.bucket_details
+        if info is None:
+            event.fail("Object storage is not ready")
+            return
+
+        try:
+            profile = LoadProfile(
+                sizes=parse_size_distribution(self.config["load_object_sizes"]),
+                read_ratio=float(self.config["load_read_ratio"]),
+                concurrency=int(self.config["load_concurrency"]),
+                duration=float(event.params.get("duration") or self.config["load_duration"]),
+            )
+        except ValueError as e:
+            event.fail(str(e))
+            return
+
+        run = LoadRun(
+            build_s3_client(info, max_pool_connections=profile.concurrency), info.bucket, profile
         )
+        event.log(f"Running {profile.concurrency} workers for {profile.duration:.0f}s")
+        results = run.run()
+        if event.params.get("cleanup", True):
+            run.cleanup()
+        event.set_results(results)
 
 
 if __name__ == "__main__":
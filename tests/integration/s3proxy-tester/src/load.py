@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A small S3 load generator, driven by the tester charm's `run-load` action."""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_UNITS = {"": 1, "B": 1, "KIB": 1024, "MIB": 1024**2, "GIB": 1024**3}
+_SIZE = re.compile(r"^\s*(\d+)\s*([KMG]iB|B)?\s*$", re.IGNORECASE)
+
+
+def parse_size(value: str) -> int:
+    """Parse a size like "4KiB", "16MiB" or "512" into bytes."""
+    match = _SIZE.match(value)
+    if not match:
+        raise ValueError(f"invalid size {value!r}; expected e.g. 4KiB, 16MiB or 512")
+    number, unit = match.groups()
+    return int(number) * _UNITS[(unit or "").upper()]
+
+
+def parse_size_distribution(spec: str) -> List[Tuple[int, int]]:
+    """Parse "size:weight,..." (e.g. "4KiB:70,1MiB:25,64MiB:5") into (bytes, weight) pairs."""
+    distribution = []
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        size, _, weight = entry.partition(":")
+        distribution.append((parse_size(size), int(weight or 1)))
+    if not distribution or any(weight <= 0 for _, weight in distribution):
+        raise ValueError(f"invalid object size distribution {spec!r}")
+    return distribution
+
+
+@dataclass(frozen=True)
+class LoadProfile:
+    """What a load run does, and for how long."""
+
+    sizes: List[Tuple[int, int]]
+    read_ratio: float
+    concurrency: int
+    duration: float
+
+    def __post_init__(self):
+        """Reject profiles which can't be run."""
+        if not 0 <= self.read_ratio <= 1:
+            raise ValueError("read ratio must be between 0 and 1")
+        if self.concurrency < 1 or self.duration <= 0:
+            raise ValueError("concurrency and duration must be positive")
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list; 0 if it is empty."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class _Worker(threading.Thread):
+    """Issues requests until the deadline, recording its own latencies."""
+
+    def __init__(self, run: "LoadRun", seed: int):
+        super().__init__(daemon=True)
+        self.run_ = run
+        self.random = random.Random(seed)
+        self.latencies = {"get": [], "put": []}  # type: Dict[str, List[float]]
+        self.errors = 0
+        self.bytes = 0
+
+    def run(self):
+        run = self.run_
+        sizes, weights = zip(*run.profile.sizes)
+        while time.monotonic() < run.deadline:
+            keys = run.keys
+            reading = keys and self.random.random() < run.profile.read_ratio
+            start = time.perf_counter()
+            try:
+                if reading:
+                    body = run.client.get_object(Bucket=run.bucket, Key=self.random.choice(keys))
+                    transferred = len(body["Body"].read())
+                else:
+                    size = self.random.choices(sizes, weights)[0]
+                    key = f"{run.prefix}{self.name}-{len(self.latencies['put'])}"
+                    run.client.put_object(Bucket=run.bucket, Key=key, Body=run.payloads[size])
+                    keys.append(key)
+                    transferred = size
+            except Exception as e:
+                logger.debug("Request failed: %r", e)
+                self.errors += 1
+                continue
+            self.latencies["get" if reading else "put"].append(time.perf_counter() - start)
+            self.bytes += transferred
+
+
+class LoadRun:
+    """A timed mix of PUTs and GETs against one bucket, from `concurrency` threads.
+
+    Payloads are generated once per object size and shared by every request, so the
+    generator itself stays cheap next to the requests it measures.
+    """
+
+    def __init__(self, client, bucket: str, profile: LoadProfile, prefix: str = "load/"):
+        self.client = client
+        self.bucket = bucket
+        self.profile = profile
+        self.prefix = prefix
+        self.payloads = {size: os.urandom(size) for size, _ in profile.sizes}
+        self.keys = []  # type: List[str]
+        self.deadline = 0.0
+
+    def run(self) -> Dict[str, Dict[str, str]]:
+        """Generate load for the profile's duration and summarise it."""
+        workers = [_Worker(self, seed) for seed in range(self.profile.concurrency)]
+        start = time.monotonic()
+        self.deadline = start + self.profile.duration
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self._summary(workers, time.monotonic() - start)
+
+    def cleanup(self):
+        """Delete every object written by the run."""
+        for i in range(0, len(self.keys), 1000):
+            batch = self.keys[i : i + 1000]  # noqa: E203
+            self.client.delete_objects(
+                Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True}
+            )
+
+    def _summary(self, workers: List[_Worker], elapsed: float) -> Dict[str, Dict[str, str]]:
+        errors = sum(w.errors for w in workers)
+        summary = {}  # type: Dict[str, Dict[str, str]]
+        requests = 0
+        for op in ("get", "put"):
+            latencies = sorted(lat for w in workers for lat in w.latencies[op])
+            requests += len(latencies)
+            summary[op] = {
+                "requests": str(len(latencies)),
+                **{f"p{p}-ms": f"{percentile(latencies, p) * 1000:.1f}" for p in (50, 90, 99)},
+            }
+        total = requests + errors
+        summary["total"] = {
+            "requests": str(requests),
+            "errors": str(errors),
+            "error-rate": f"{errors / total if total else 0:.4f}",
+            "seconds": f"{elapsed:.1f}",
+            "requests-per-second": f"{requests / elapsed:.1f}",
+            "mib-per-second": f"{sum(w.bytes for w in workers) / elapsed / 1024**2:.2f}",
+        }
+        return summary
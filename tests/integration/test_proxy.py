@@ -54,3 +54,52 @@ async def test_object_storage_works(ops_test, s3proxy_charm, s3proxy_tester_char
     )
     assert any([tester_app_name == bucket["Name"] for bucket in client.list_buckets()])
     assert len(client.list_objects(bucket=tester_app_name)["Contents"]) > 0
+
+
+async def test_load_generator_reports_results(ops_test):
+    """Run the tester's load generator briefly against the related bucket."""
+    unit = ops_test.model.applications[tester_app_name].units[0]
+    action = await unit.run_action("run-load", duration=5)
+    action = await action.wait()
+    assert action.status == "completed"
+    assert int(action.results["total"]["requests"]) > 0
+    assert action.results["total"]["errors"] == "0"
+
+
+async def test_charm_services_run_in_workload_image(ops_test):
+    """Start the charm's own services, which need the workload image's python3."""
+    application = ops_test.model.applications[app_name]
+    await application.set_config({"proxy-cache-memory": "64Mi", "scrub-interval": "24"})
+    await ops_test.model.wait_for_idle(apps=[app_name], status="active")
+
+    unit = f"{app_name}/0"
+    rc, stdout, stderr = await ops_test.juju(
+        "ssh", "--container", "s3proxy", unit, "python3", "--version"
+    )
+    assert rc == 0, stderr
+    logger.info("workload image has %s", stdout.strip())
+    # access_log is only imported, by front_cache.
+    scripts = (
+        "cache_gateway",
+        "front_cache",
+        "lifecycle",
+        "metrics_exporter",
+        "migration",
+        "scrub",
+        "transfer",
+        "usage",
+    )
+    for script in scripts:
+        rc, _, stderr = await ops_test.juju(
+            "ssh",
+            "--container",
+            "s3proxy",
+            unit,
+            "python3",
+            f"/usr/local/lib/s3proxy-charm/{script}.py",
+            "--help",
+        )
+        assert rc == 0, f"{script}: {stderr}"
+
+    await application.set_config({"proxy-cache-memory": "", "scrub-interval": "0"})
+    await ops_test.model.wait_for_idle(apps=[app_name], status="active")
@@ -0,0 +1,198 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Hook execution time and StoredState size regression tests.
+
+Representative playbooks are replayed against S3ProxyK8SOperatorCharm with the
+harness extensions' Scenario runner, one fresh charm per scene as Juju would dispatch
+them, spread over a process pool. For every event in a playbook, the wall time taken
+to handle it (median over the playbook) and the largest StoredState left behind are
+compared with baselines.json.
+
+A test fails when an event takes more than PERF_TOLERANCE (default 3) times its
+baseline, plus a couple of milliseconds to absorb timer noise, or when StoredState
+grows by more than 10%. After an intended change, refresh the baselines with:
+
+    PERF_UPDATE_BASELINES=1 tox -e perf
+
+Set PERF_RESULTS to a path to also write the measurements there as JSON, and
+PERF_PROCESSES to change the number of worker processes; using more than there are
+CPUs skews the timings.
+"""
+
+import json
+import multiprocessing
+import os
+import statistics
+import unittest
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from unittest.mock import PropertyMock, patch
+
+import ops.testing
+from charms.harness_extensions.v0.evt_sequences import (
+    Context,
+    Event,
+    InjectRelation,
+    RelationMeta,
+    RelationSpec,
+    Scenario,
+    Scene,
+    _Event,
+)
+
+from charm import S3ProxyK8SOperatorCharm
+
+BASELINES = Path(__file__).parent / "baselines.json"
+TOLERANCE = float(os.environ.get("PERF_TOLERANCE", "3"))
+TIME_SLACK = 0.002
+SIZE_TOLERANCE = 0.1
+
+CONFIG = {"identity": "perfidentity", "credential": "perfcredential"}
+
+
+def _context(relations: int = 0, **config) -> Context:
+    return Context(
+        config={**CONFIG, **config},
+        relations=tuple(
+            RelationSpec(
+                meta=RelationMeta(
+                    endpoint="s3", interface="s3", remote_app_name=f"app{i}", relation_id=i
+                ),
+                application_data={"bucket": f"app{i}"},
+                units_data={0: {}},
+            )
+            for i in range(relations)
+        ),
+        leader=True,
+        containers=("s3proxy",),
+    )
+
+
+def _relation_changed(relation_id: int) -> _Event:
+    return _Event("s3-relation-changed", args=(InjectRelation("s3", relation_id),))
+
+
+PLAYBOOKS = {
+    "startup": [
+        Scene(Event(name), _context())
+        for name in (
+            "install",
+            "leader-elected",
+            "config-changed",
+            "start",
+            "s3proxy-pebble-ready",
+        )
+    ],
+    "relate-many-apps": [Scene(_relation_changed(i), _context(relations=20)) for i in range(20)],
+    "config-churn": [
+        Scene(Event("config-changed"), _context(relations=10, cpu=cpu, memory=memory))
+        for cpu, memory in (("1", "1Gi"), ("2", "2Gi"), ("4", "4Gi"), ("500m", "512Mi")) * 3
+    ],
+    "upgrade": [
+        Scene(Event(name), _context(relations=10))
+        for name in ("upgrade-charm", "config-changed", "start", "leader-elected")
+    ],
+}
+
+
+def _stored_state_size(harness: ops.testing.Harness) -> int:
+    """Bytes of StoredState the framework persisted, as it would to the unit's state."""
+    rows = harness._storage._db.execute(  # type: ignore
+        "SELECT SUM(LENGTH(data)) FROM snapshot WHERE handle LIKE '%StoredStateData%'"
+    ).fetchone()
+    return rows[0] or 0
+
+
+def _measure(result) -> Tuple[float, int]:
+    _, _, emitter = result
+    return emitter.duration, _stored_state_size(emitter.harness)
+
+
+def replay(playbooks: Dict[str, List[Scene]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Play every scene of `playbooks` and summarise time and StoredState per event.
+
+    Scenes are independent, so they are spread over PERF_PROCESSES (default: one per
+    CPU) worker processes; results come back in playbook order either way.
+    """
+    scenes = [(name, scene) for name, playbook in playbooks.items() for scene in playbook]
+    scenario = Scenario.from_scenes(scene for _, scene in scenes).bind(S3ProxyK8SOperatorCharm)
+    # Warm up lazy imports and caches before forking, so no worker's first scene is slow.
+    Scenario.from_scenes(PLAYBOOKS["startup"]).bind(S3ProxyK8SOperatorCharm).play_parallel(
+        processes=1
+    )
+    measurements = scenario.play_parallel(
+        collect=_measure,
+        processes=int(os.environ.get("PERF_PROCESSES", "0")) or None,
+        # Forked workers inherit the patches made by the test.
+        mp_context=multiprocessing.get_context("fork"),
+    )
+
+    samples: Dict[str, Dict[str, List[Tuple[float, int]]]] = defaultdict(lambda: defaultdict(list))
+    for (playbook, scene), measured in zip(scenes, measurements):
+        samples[playbook][scene.event.name].append(measured)
+    return {
+        playbook: {
+            name: {
+                "seconds": statistics.median(duration for duration, _ in values),
+                "stored_state_bytes": max(size for _, size in values),
+            }
+            for name, values in events.items()
+        }
+        for playbook, events in samples.items()
+    }
+
+
+class TestHookTimes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+        with patch("charm.KubernetesServicePatch", lambda x, y: None), patch(
+            "lightkube.core.client.GenericSyncClient"
+        ), patch("charm.boto3.client"), patch.object(
+            ops.testing, "SIMULATE_CAN_CONNECT", True
+        ), patch.object(
+            S3ProxyK8SOperatorCharm,
+            "_workload_version",
+            new_callable=PropertyMock,
+            return_value="2.0.0",
+        ):
+            cls.results = replay(PLAYBOOKS)
+
+        if os.environ.get("PERF_UPDATE_BASELINES"):
+            BASELINES.write_text(json.dumps(cls.results, indent=2, sort_keys=True) + "\n")
+        if os.environ.get("PERF_RESULTS"):
+            Path(os.environ["PERF_RESULTS"]).write_text(json.dumps(cls.results, indent=2))
+
+    def _check(self, playbook: str):
+        results = self.results[playbook]
+        if os.environ.get("PERF_UPDATE_BASELINES"):
+            return
+
+        baselines = self.baselines.get(playbook, {})
+        for event, measured in results.items():
+            with self.subTest(event=event):
+                baseline = baselines.get(event)
+                self.assertIsNotNone(baseline, f"no baseline for {playbook}/{event}")
+                self.assertLessEqual(
+                    measured["seconds"],
+                    baseline["seconds"] * TOLERANCE + TIME_SLACK,
+                    f"{playbook}/{event} got slower",
+                )
+                self.assertLessEqual(
+                    measured["stored_state_bytes"],
+                    baseline["stored_state_bytes"] * (1 + SIZE_TOLERANCE),
+                    f"{playbook}/{event} stores more state",
+                )
+
+    def test_startup(self):
+        self._check("startup")
+
+    def test_relate_many_apps(self):
+        self._check("relate-many-apps")
+
+    def test_config_churn(self):
+        self._check("config-churn")
+
+    def test_upgrade(self):
+        self._check("upgrade")
@@ -0,0 +1,62 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import io
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import access_log
+from access_log import AccessLog, parse_labels
+from metrics_exporter import format_metrics
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.samples = iter([0.5, 0.05, 0.9, 0.9])
+        self.log = AccessLog(
+            0.1,
+            ["http://loki-0/loki/api/v1/push", "http://loki-1/loki/api/v1/push"],
+            parse_labels("juju_unit=s3proxy/0,job=s3proxy-access"),
+            stream=self.stream,
+            sample=lambda: next(self.samples),
+        )
+
+    def _lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_requests_are_sampled_but_errors_always_logged(self):
+        for status in (200, 200, 200, 503):
+            self.log.record(method="GET", bucket="b", key="k", status=status)
+        self.assertEqual([line["status"] for line in self._lines()], [200, 503])
+        self.assertEqual(self._lines()[0]["key"], "k")
+        self.assertIn("s3proxy_access_log_sampled_total 2\n", format_metrics(self.log.metrics()))
+
+    def test_lines_are_pushed_in_batches(self):
+        for _ in range(2):
+            self.log.record(status=500)
+        with patch.object(access_log, "FLUSH_SECONDS", 0):
+            batch = self.log.next_batch()
+        self.assertEqual(len(batch), 2)
+
+        with patch("urllib.request.urlopen", MagicMock()) as urlopen:
+            urlopen.side_effect = [OSError("unreachable"), MagicMock()]
+            self.assertTrue(self.log.push(batch))
+        request = urlopen.call_args[0][0]
+        self.assertEqual(request.full_url, "http://loki-1/loki/api/v1/push")
+        stream = json.loads(request.data)["streams"][0]
+        self.assertEqual(stream["stream"], {"juju_unit": "s3proxy/0", "job": "s3proxy-access"})
+        self.assertEqual([json.loads(line) for _, line in stream["values"]], self._lines())
+        self.assertEqual((self.log.pushed, self.log.dropped), (2, 0))
+
+        with patch("urllib.request.urlopen", side_effect=OSError("unreachable")):
+            self.assertFalse(self.log.push(batch))
+        self.assertEqual((self.log.pushed, self.log.dropped), (2, 2))
+
+    def test_full_queue_drops_lines(self):
+        with patch.object(access_log, "QUEUE_SIZE", 1):
+            log = AccessLog(1, ["http://loki/loki/api/v1/push"], stream=io.StringIO())
+        for _ in range(3):
+            log.record(status=200)
+        self.assertEqual((log.sampled, log.dropped), (3, 2))
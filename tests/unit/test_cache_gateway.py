@@ -0,0 +1,268 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import datetime
+import http.client
+import importlib.util
+import io
+import logging
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import boto3
+from botocore.auth import S3SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.credentials import Credentials
+
+from cache_gateway import (
+    CacheGateway,
+    DiskCache,
+    Remote,
+    _ChunkedReader,
+    _parse_range,
+    canonical_target,
+    sign_v4,
+)
+from metrics_exporter import format_metrics
+
+HAS_MOTO_SERVER = all(importlib.util.find_spec(module) for module in ("moto", "flask"))
+
+
+def _put(cache: DiskCache, key: str, data: bytes, bucket: str = "bucket"):
+    fill = cache.fill(bucket, key, {"etag": f'"{key}"'})
+    fill.write(data)
+    return fill.commit()
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = DiskCache(self.root, max_bytes=800)
+        for key in "abcd":
+            self.assertTrue(_put(cache, key, b"x" * 100))
+        cache.get("bucket", "a")
+        for key in "efghi":
+            _put(cache, key, b"x" * 100)
+
+        self.assertEqual(cache.size, 800)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get("bucket", "b"))
+        self.assertIsNotNone(cache.get("bucket", "a"))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_large_objects_are_not_cached(self):
+        cache = DiskCache(self.root, max_bytes=800)
+        self.assertFalse(_put(cache, "big", b"x" * 101))
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(list(self.root.glob("*/.fill-*")), [])
+
+    def test_invalidation_during_fill_is_not_overwritten(self):
+        cache = DiskCache(self.root, max_bytes=800)
+        fill = cache.fill("bucket", "a", {})
+        fill.write(b"stale")
+        cache.invalidate("bucket", "a")
+        self.assertFalse(fill.commit())
+        self.assertIsNone(cache.get("bucket", "a"))
+
+        fill = cache.fill("bucket", "b", {})
+        cache.invalidate("bucket")
+        self.assertFalse(fill.commit())
+
+    def test_bucket_invalidation(self):
+        cache = DiskCache(self.root, max_bytes=800)
+        _put(cache, "a", b"1")
+        _put(cache, "a", b"2", bucket="other")
+        cache.invalidate("bucket")
+        self.assertIsNone(cache.get("bucket", "a"))
+        self.assertEqual(cache.get("other", "a").path.read_bytes(), b"2")
+
+    def test_reopened_cache_keeps_order(self):
+        cache = DiskCache(self.root, max_bytes=800)
+        for key in "abc":
+            _put(cache, key, b"x" * 100)
+        cache.get("bucket", "a")
+
+        reopened = DiskCache(self.root, max_bytes=200)
+        self.assertEqual(reopened.size, 200)
+        self.assertIsNotNone(reopened.get("bucket", "a"))
+        self.assertIsNotNone(reopened.get("bucket", "c"))
+        self.assertEqual(reopened.get("bucket", "a").headers, {"etag": '"a"'})
+
+    def test_metrics(self):
+        cache = DiskCache(self.root, max_bytes=800)
+        _put(cache, "a", b"x" * 10)
+        cache.get("bucket", "a")
+        text = format_metrics(cache.metrics())
+        self.assertIn("s3proxy_cache_hits_total 1\n", text)
+        self.assertIn("s3proxy_cache_size_bytes 10\n", text)
+        self.assertIn("# TYPE s3proxy_cache_misses_total counter\n", text)
+
+
+class TestSigning(unittest.TestCase):
+    def test_matches_botocore(self):
+        now = datetime.datetime(2023, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        path, query = canonical_target("/bucket/some key+1", "list-type=2&prefix=a b")
+        headers = sign_v4(
+            "GET",
+            "s3.example.com",
+            path,
+            query,
+            {"Content-Type": "text/plain"},
+            "eu-west-1",
+            "AKID",
+            "SECRET",
+            now=now,
+        )
+
+        request = AWSRequest(
+            method="GET",
+            url=f"https://s3.example.com{path}?{query}",
+            headers={"Content-Type": "text/plain"},
+        )
+        request.context["client_config"] = Config(s3={"payload_signing_enabled": False})
+        auth = S3SigV4Auth(Credentials("AKID", "SECRET"), "s3", "eu-west-1")
+        with patch("botocore.auth.get_current_datetime", return_value=now):
+            auth.add_auth(request)
+        self.assertEqual(headers["authorization"], request.headers["Authorization"])
+
+    def test_ranges(self):
+        self.assertEqual(_parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(_parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(_parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(_parse_range("bytes=50-500", 100), (50, 99))
+        self.assertIsNone(_parse_range("bytes=100-", 100))
+        self.assertIsNone(_parse_range("bytes=0-1,5-6", 100))
+
+    def test_chunked_bodies(self):
+        stream = io.BytesIO(b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nx-trailer: 1\r\n\r\nnext")
+        reader = _ChunkedReader(stream)
+        self.assertEqual(reader.read(4), b"hell")
+        self.assertEqual(reader.read(), b"o world")
+        self.assertEqual(reader.read(), b"")
+        # Only the body was consumed, not what follows it on the connection.
+        self.assertEqual(stream.read(), b"next")
+
+        with self.assertRaises(ConnectionResetError):
+            _ChunkedReader(io.BytesIO(b"10\r\nshort")).read()
+        with self.assertRaises(ConnectionAbortedError):
+            _ChunkedReader(io.BytesIO(b"zz\r\n")).read()
+
+
+@unittest.skipUnless(HAS_MOTO_SERVER, "needs moto[server]")
+class TestCacheGateway(unittest.TestCase):
+    """The gateway in front of a local moto server, standing in for the remote store."""
+
+    @classmethod
+    def setUpClass(cls):
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        cls.remote = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.remote.start()
+        host, port = cls.remote.get_host_and_port()
+        cls.remote_client = cls._client(f"http://{host}:{port}")
+        cls.remote_client.create_bucket(Bucket="bucket")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.remote.stop()
+
+    @staticmethod
+    def _client(endpoint: str):
+        return boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id="remoteid",
+            aws_secret_access_key="remotecredential",
+            region_name="us-east-1",
+            config=Config(
+                s3={"addressing_style": "path"}, request_checksum_calculation="when_required"
+            ),
+        )
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        host, port = self.remote.get_host_and_port()
+        remote = Remote(f"http://{host}:{port}", "us-east-1", "remoteid", "remotecredential")
+        self.cache = DiskCache(Path(tmp.name), max_bytes=8 * 1024 * 1024)
+        self.gateway = CacheGateway(("127.0.0.1", 0), remote, self.cache)
+        threading.Thread(target=self.gateway.serve_forever, daemon=True).start()
+        self.addCleanup(self.gateway.server_close)
+        self.addCleanup(self.gateway.shutdown)
+        self.client = self._client(f"http://127.0.0.1:{self.gateway.server_address[1]}")
+
+    def test_hot_objects_are_served_from_disk(self):
+        self.client.put_object(Bucket="bucket", Key="hot", Body=b"hello", ContentType="text/x")
+        self.assertEqual(
+            self.client.get_object(Bucket="bucket", Key="hot")["Body"].read(), b"hello"
+        )
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+        # Changed behind the gateway's back, so only the cache has the old content.
+        self.remote_client.put_object(Bucket="bucket", Key="hot", Body=b"remote")
+        response = self.client.get_object(Bucket="bucket", Key="hot")
+        self.assertEqual(response["Body"].read(), b"hello")
+        self.assertEqual(response["ContentType"], "text/x")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.cache.size, 5)
+
+        ranged = self.client.get_object(Bucket="bucket", Key="hot", Range="bytes=1-3")
+        self.assertEqual(ranged["Body"].read(), b"ell")
+        self.assertEqual(ranged["ContentRange"], "bytes 1-3/5")
+        head = self.client.head_object(Bucket="bucket", Key="hot")
+        self.assertEqual(head["ContentLength"], 5)
+
+    def test_writes_invalidate(self):
+        self.client.put_object(Bucket="bucket", Key="key", Body=b"one")
+        self.client.get_object(Bucket="bucket", Key="key")["Body"].read()
+        self.client.put_object(Bucket="bucket", Key="key", Body=b"two")
+        self.assertEqual(self.client.get_object(Bucket="bucket", Key="key")["Body"].read(), b"two")
+
+        self.client.delete_object(Bucket="bucket", Key="key")
+        with self.assertRaises(self.client.exceptions.NoSuchKey):
+            self.client.get_object(Bucket="bucket", Key="key")
+        self.assertEqual(self.cache.size, 0)
+
+    def test_chunked_uploads_are_streamed(self):
+        self.client.put_object(Bucket="bucket", Key="chunked", Body=b"old")
+        self.client.get_object(Bucket="bucket", Key="chunked")["Body"].read()
+        body = [b"x" * 100000, b"y" * 3]
+
+        connection = http.client.HTTPConnection("127.0.0.1", self.gateway.server_address[1])
+        self.addCleanup(connection.close)
+        connection.request("PUT", "/bucket/chunked", body=iter(body), encode_chunked=True)
+        response = connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 200)
+
+        stored = self.remote_client.get_object(Bucket="bucket", Key="chunked")["Body"].read()
+        self.assertEqual(stored, b"".join(body))
+        self.assertEqual(
+            self.client.get_object(Bucket="bucket", Key="chunked")["Body"].read(), stored
+        )
+        # The connection is still in step for the next request.
+        connection.request("HEAD", "/bucket/chunked")
+        self.assertEqual(connection.getresponse().getheader("Content-Length"), "100003")
+
+    def test_other_requests_are_forwarded(self):
+        self.client.put_object(Bucket="bucket", Key="dir/a b", Body=b"x")
+        listing = self.client.list_objects_v2(Bucket="bucket", Prefix="dir/")
+        self.assertEqual([o["Key"] for o in listing["Contents"]], ["dir/a b"])
+        self.assertEqual(self.cache.misses, 0)
+
+        large = b"x" * (2 * 1024 * 1024)
+        self.client.put_object(Bucket="bucket", Key="large", Body=large)
+        for _ in range(2):
+            self.assertEqual(
+                self.client.get_object(Bucket="bucket", Key="large")["Body"].read(), large
+            )
+        self.assertEqual((self.cache.hits, self.cache.misses, self.cache.size), (0, 2, 0))
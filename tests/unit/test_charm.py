@@ -3,14 +3,19 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import json
+import os
+import shlex
 import unittest
 from unittest.mock import MagicMock, PropertyMock, patch
 
 import ops.testing
-from ops.model import ActiveStatus, WaitingStatus
+from lightkube.core.exceptions import ApiError
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.pebble import APIError, ExecError
 from ops.testing import Harness
 
-from charm import S3ProxyK8SOperatorCharm
+from charm import S3ProxyK8SOperatorCharm, _python_service
 
 ops.testing.SIMULATE_CAN_CONNECT = True
 
@@ -27,6 +32,11 @@ class TestCharm(unittest.TestCase):
         self.mock_version = patcher.start()
         self.mock_version.return_value = "2.0.0"
         self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
         self.harness.begin()
 
     def test_pebble_ready_with_anonymous_access(self):
@@ -47,6 +57,7 @@ class TestCharm(unittest.TestCase):
                     '-Ds3proxy.credential="unittestcredential" '
                     '-Ds3proxy.cors-allow-all="true" '
                     '-Ds3proxy.endpoint="http://0.0.0.0:8080" '
+                    '-Ds3proxy.v4-max-non-chunked-request-size="33554432" '
                     "-jar /usr/bin/s3proxy --properties "
                     "/dev/null",
                     "startup": "enabled",
@@ -85,6 +96,7 @@ class TestCharm(unittest.TestCase):
                     '-Ds3proxy.credential="unittestcredential" '
                     '-Ds3proxy.cors-allow-all="true" '
                     '-Ds3proxy.endpoint="http://0.0.0.0:8080" '
+                    '-Ds3proxy.v4-max-non-chunked-request-size="33554432" '
                     "-jar /usr/bin/s3proxy --properties "
                     "/dev/null",
                     "startup": "enabled",
@@ -118,3 +130,1094 @@ class TestCharm(unittest.TestCase):
         event.set_results.assert_called_with(
             {"identity": "unittestid", "credential": "unittestcredential"}
         )
+
+
+class TestPythonService(unittest.TestCase):
+    def test_arguments_are_quoted(self):
+        service = _python_service(
+            "front_cache.py",
+            "proxy",
+            {"cache-dir": "/data/a dir", "loki-url": ["http://l/push?a=1&b=2", "http://m"]},
+            after=["s3proxy"],
+        )
+        self.assertEqual(
+            shlex.split(service["command"]),
+            [
+                "python3",
+                "/usr/local/lib/s3proxy-charm/front_cache.py",
+                "--cache-dir",
+                "/data/a dir",
+                "--loki-url",
+                "http://l/push?a=1&b=2",
+                "--loki-url",
+                "http://m",
+            ],
+        )
+        self.assertEqual(service["after"], ["s3proxy"])
+        self.assertEqual((service["override"], service["startup"]), ("replace", "enabled"))
+
+
+class TestWorkloadPython(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        # The harness can't exec in containers.
+        patcher = patch.object(self.harness.charm._container, "exec")
+        self.exec = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_recent_python(self):
+        self.exec.return_value.wait_output.return_value = ("Python 3.8.10\n", "")
+        self.assertEqual(self.harness.charm._workload_python, "Python 3.8.10")
+        self.assertEqual(self.exec.call_args[0][0], ["python3", "--version"])
+
+    def test_old_python(self):
+        self.exec.return_value.wait_output.return_value = ("Python 3.6.9\n", "")
+        self.assertIsNone(self.harness.charm._workload_python)
+
+    def test_missing_python(self):
+        self.exec.side_effect = APIError(
+            {}, 500, "Internal Server Error", 'cannot find executable "python3"'
+        )
+        self.assertIsNone(self.harness.charm._workload_python)
+
+    def test_checked_once_per_container_start(self):
+        self.exec.return_value.wait_output.return_value = ("Python 3.8.10\n", "")
+        self.assertEqual(self.harness.charm._workload_python, "Python 3.8.10")
+        self.assertEqual(self.harness.charm._workload_python, "Python 3.8.10")
+        self.assertEqual(self.exec.call_count, 1)
+
+        self.exec.side_effect = APIError(
+            {}, 500, "Internal Server Error", 'cannot find executable "python3"'
+        )
+        with patch.object(S3ProxyK8SOperatorCharm, "_configure"), patch.object(
+            S3ProxyK8SOperatorCharm, "_set_s3proxy_version"
+        ):
+            self.harness.container_pebble_ready("s3proxy")
+        self.assertIsNone(self.harness.charm._workload_python)
+        self.assertIsNone(self.harness.charm._workload_python)
+        self.assertEqual(self.exec.call_count, 2)
+
+
+class TestRemoteBackend(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        self.harness.update_config(
+            {
+                "identity": "unittestid",
+                "credential": "unittestcredential",
+                "backend": "s3",
+                "backend-endpoint": "https://s3.example.com",
+                "backend-identity": "remoteid",
+                "backend-credential": "remotecredential",
+            }
+        )
+        self.harness.begin()
+
+    def _services(self):
+        return self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+
+    def test_remote_backend_without_cache(self):
+        self.harness.container_pebble_ready("s3proxy")
+        services = self._services()
+        self.assertEqual(list(services), ["s3proxy"])
+        command = services["s3proxy"]["command"]
+        self.assertIn('-Djclouds.provider="s3"', command)
+        self.assertIn('-Djclouds.endpoint="https://s3.example.com"', command)
+        self.assertIn('-Djclouds.identity="remoteid"', command)
+        self.assertIn('-Djclouds.credential="remotecredential"', command)
+        self.assertNotIn("basedir", command)
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_cache_gateway_between_s3proxy_and_remote(self):
+        self.harness.update_config({"cache-size": "2Gi", "backend-region": "eu-west-1"})
+        self.harness.container_pebble_ready("s3proxy")
+        services = self._services()
+        self.assertEqual(sorted(services), ["cache-gateway", "metrics", "s3proxy"])
+
+        s3proxy = services["s3proxy"]
+        self.assertEqual(s3proxy["after"], ["cache-gateway"])
+        self.assertIn('-Djclouds.endpoint="http://127.0.0.1:8081"', s3proxy["command"])
+        self.assertNotIn("remotecredential", s3proxy["command"])
+
+        gateway = services["cache-gateway"]
+        self.assertIn("--remote https://s3.example.com", gateway["command"])
+        self.assertIn("--region eu-west-1", gateway["command"])
+        self.assertIn(f"--cache-size {2 * 1024 ** 3}", gateway["command"])
+        self.assertEqual(
+            gateway["environment"],
+            {"REMOTE_IDENTITY": "remoteid", "REMOTE_CREDENTIAL": "remotecredential"},
+        )
+
+        container = self.harness.model.unit.get_container("s3proxy")
+        for script in ("cache_gateway.py", "metrics_exporter.py"):
+            self.assertIn(
+                "def main", container.pull(f"/usr/local/lib/s3proxy-charm/{script}").read()
+            )
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_disabled_services_are_stopped_once(self):
+        self.harness.update_config({"cache-size": "2Gi"})
+        self.harness.container_pebble_ready("s3proxy")
+        self.harness.update_config({"cache-size": ""})
+
+        services = self._services()
+        self.assertEqual(services["cache-gateway"]["startup"], "disabled")
+        self.assertEqual(services["metrics"]["startup"], "disabled")
+        self.assertNotIn("after", services["s3proxy"])
+        container = self.harness.model.unit.get_container("s3proxy")
+        self.assertFalse(container.get_service("cache-gateway").is_running())
+        self.assertTrue(container.get_service("s3proxy").is_running())
+
+        # Nothing changes from then on, so later hooks leave the plan alone.
+        with patch("ops.model.Container.add_layer") as add_layer:
+            self.harness.charm.on.update_status.emit()
+        add_layer.assert_not_called()
+
+        self.harness.update_config({"cache-size": "1Gi"})
+        self.assertEqual(self._services()["cache-gateway"]["startup"], "enabled")
+        self.assertTrue(container.get_service("cache-gateway").is_running())
+
+    def test_cache_is_ignored_with_filesystem_backend(self):
+        self.harness.update_config({"backend": "filesystem", "cache-size": "2Gi"})
+        self.harness.container_pebble_ready("s3proxy")
+        self.assertEqual(list(self._services()), ["s3proxy"])
+
+    def test_invalid_backend_settings_block(self):
+        self.harness.container_pebble_ready("s3proxy")
+        for config, message in (
+            ({"backend": "gcs"}, "invalid backend 'gcs'"),
+            ({"backend-endpoint": ""}, "backend-endpoint must be set"),
+            ({"backend-identity": ""}, "backend-identity and backend-credential must be set"),
+            ({"cache-size": "lots"}, "invalid cache-size 'lots'"),
+        ):
+            with self.subTest(config=config):
+                self.harness.update_config(config)
+                self.assertEqual(self.harness.model.unit.status, BlockedStatus(message))
+                self.harness.update_config(
+                    {
+                        "backend": "s3",
+                        "backend-endpoint": "https://s3.example.com",
+                        "backend-identity": "remoteid",
+                        "cache-size": "",
+                    }
+                )
+                self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_migration_from_filesystem(self):
+        self.harness.update_config({"migrate-from": "filesystem", "cache-size": "2Gi"})
+        self.harness.container_pebble_ready("s3proxy")
+        services = self._services()
+        self.assertEqual(
+            sorted(services), ["metrics", "migration", "s3proxy", "s3proxy-filesystem"]
+        )
+        s3proxy = services["s3proxy"]
+        self.assertEqual(s3proxy["after"], ["migration"])
+        self.assertIn('-Djclouds.endpoint="http://127.0.0.1:8083"', s3proxy["command"])
+        self.assertNotIn("remotecredential", s3proxy["command"])
+
+        blobstore = services["s3proxy-filesystem"]["command"]
+        self.assertIn('-Djclouds.provider="filesystem"', blobstore)
+        self.assertIn('-Ds3proxy.endpoint="http://127.0.0.1:8082"', blobstore)
+        self.assertIn('-Ds3proxy.authorization="none"', blobstore)
+        migration = services["migration"]
+        self.assertIn(
+            "--old http://127.0.0.1:8082 --new https://s3.example.com --remote new",
+            migration["command"],
+        )
+        source = "filesystem-to-s3@https://s3.example.com"
+        self.assertIn(f"--source {source}", migration["command"])
+        self.assertEqual(migration["environment"]["REMOTE_IDENTITY"], "remoteid")
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ActiveStatus("migrating from filesystem: 0 objects copied"),
+        )
+
+        container = self.harness.model.unit.get_container("s3proxy")
+        state = {"source": source, "done": False, "copied": 7, "failed": 2}
+        container.push("/data/migration/state.json", json.dumps(state), make_dirs=True)
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ActiveStatus("migrating from filesystem: 7 objects copied, 2 failed"),
+        )
+        state = {"source": source, "done": True, "copied": 9, "failed": 0}
+        container.push("/data/migration/state.json", json.dumps(state))
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ActiveStatus("migrated from filesystem, unset migrate-from"),
+        )
+
+    def test_finished_migration_is_taken_down(self):
+        self.harness.update_config({"migrate-from": "filesystem"})
+        self.harness.container_pebble_ready("s3proxy")
+        container = self.harness.model.unit.get_container("s3proxy")
+        state = {"source": "filesystem-to-s3@https://s3.example.com", "done": True}
+        container.push("/data/migration/state.json", json.dumps(state), make_dirs=True)
+
+        self.harness.update_config({"migrate-from": ""})
+        services = self._services()
+        for name in ("migration", "s3proxy-filesystem"):
+            self.assertEqual(services[name]["startup"], "disabled")
+            self.assertFalse(container.get_service(name).is_running())
+        self.assertNotIn("after", services["s3proxy"])
+        self.assertIn(
+            '-Djclouds.endpoint="https://s3.example.com"', services["s3proxy"]["command"]
+        )
+        self.assertFalse(container.exists("/data/migration"))
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_progress_of_another_migration_is_ignored(self):
+        self.harness.update_config({"migrate-from": "filesystem"})
+        self.harness.container_pebble_ready("s3proxy")
+        container = self.harness.model.unit.get_container("s3proxy")
+        state = {"source": "filesystem-to-s3@https://old.example.com", "done": True}
+        container.push("/data/migration/state.json", json.dumps(state), make_dirs=True)
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ActiveStatus("migrating from filesystem: 0 objects copied"),
+        )
+
+    def test_migration_to_filesystem(self):
+        self.harness.update_config({"backend": "filesystem", "migrate-from": "s3"})
+        self.harness.container_pebble_ready("s3proxy")
+        command = self._services()["migration"]["command"]
+        self.assertIn(
+            "--old https://s3.example.com --new http://127.0.0.1:8082 --remote old", command
+        )
+
+    def test_invalid_migration_settings_block(self):
+        self.harness.container_pebble_ready("s3proxy")
+        for config, message in (
+            ({"migrate-from": "gcs"}, "invalid migrate-from 'gcs'"),
+            ({"migrate-from": "aws-s3"}, "either backend or migrate-from must be filesystem"),
+            (
+                {"backend": "filesystem", "migrate-from": "s3", "backend-endpoint": ""},
+                "backend-endpoint must be set",
+            ),
+        ):
+            with self.subTest(config=config):
+                self.harness.update_config(config)
+                self.assertEqual(self.harness.model.unit.status, BlockedStatus(message))
+                self.harness.update_config(
+                    {
+                        "backend": "s3",
+                        "backend-endpoint": "https://s3.example.com",
+                        "migrate-from": "",
+                    }
+                )
+                self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+
+class TestProxyCache(unittest.TestCase):
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        patcher = patch("charm.KubernetesServicePatch")
+        self.service_patch = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        patcher = patch("charm.Client")
+        self.patch_service = patcher.start().return_value.patch
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        self.mock_python = patcher.start()
+        self.mock_python.return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        patcher = patch("charm.boto3.client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+
+    def test_proxy_cache_fronts_s3proxy(self):
+        rel_id = self.harness.add_relation("s3", "app")
+        self.harness.add_relation_unit(rel_id, "app/0")
+        self.harness.update_relation_data(rel_id, "app", {"bucket": "app"})
+        self.harness.update_config({"proxy-cache-memory": "64Mi", "proxy-cache-disk": "1Gi"})
+
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(sorted(services), ["metrics", "proxy-cache", "s3proxy"])
+        proxy = services["proxy-cache"]
+        self.assertIn("--listen 0.0.0.0:8090", proxy["command"])
+        self.assertIn("--upstream http://127.0.0.1:8080", proxy["command"])
+        self.assertIn(f"--memory-size {64 * 1024 ** 2}", proxy["command"])
+        self.assertIn(f"--disk-size {1024 ** 3}", proxy["command"])
+        self.assertEqual(
+            proxy["environment"],
+            {"S3PROXY_IDENTITY": "unittestid", "S3PROXY_CREDENTIAL": "unittestcredential"},
+        )
+        container = self.harness.model.unit.get_container("s3proxy")
+        self.assertIn(
+            "def main", container.pull("/usr/local/lib/s3proxy-charm/front_cache.py").read()
+        )
+
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        self.assertTrue(data["endpoint"].endswith(":8090"))
+
+    def test_missing_python_blocks_charm_services(self):
+        self.mock_python.return_value = None
+        self.harness.update_config({"proxy-cache-memory": "64Mi"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("the workload image has no python3 >= 3.8, for metrics, proxy-cache"),
+        )
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(sorted(services), ["s3proxy"])
+
+    def test_service_is_routed_through_proxy_once(self):
+        patch_service = self.patch_service
+        self.harness.update_config({"proxy-cache-memory": "64Mi"})
+        self.assertEqual(patch_service.call_count, 1)
+        self.assertIs(patch_service.call_args.args[2], self.service_patch.service)
+        self.harness.update_config({"proxy-cache-memory": "128Mi"})
+        self.assertEqual(patch_service.call_count, 1)
+        self.harness.update_config({"proxy-cache-memory": ""})
+        self.assertEqual(patch_service.call_count, 2)
+
+    def test_failed_routing_is_retried(self):
+        response = MagicMock(json=lambda: {"code": 403, "message": "forbidden"})
+        self.patch_service.side_effect = ApiError(response=response)
+        self.harness.update_config({"proxy-cache-memory": "64Mi"})
+        self.patch_service.side_effect = None
+        self.harness.update_config({"proxy-cache-memory": "128Mi"})
+        self.assertEqual(self.patch_service.call_count, 2)
+
+    def test_anonymous_access_needs_no_credentials(self):
+        self.harness.update_config({"authorization": "none", "proxy-cache-disk": "1Gi"})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertNotIn("environment", services["proxy-cache"])
+
+    def test_log_level_applies_to_every_service(self):
+        self.harness.update_config({"log-level": "warn", "proxy-cache-memory": "64Mi"})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertIn('-DLOG_LEVEL="warn"', services["s3proxy"]["command"])
+        self.assertEqual(services["proxy-cache"]["environment"]["LOG_LEVEL"], "WARNING")
+        self.assertEqual(services["metrics"]["environment"], {"LOG_LEVEL": "WARNING"})
+
+    def test_invalid_logging_settings_block(self):
+        for config, message in [
+            ({"log-level": "verbose"}, "invalid log-level 'verbose'"),
+            ({"access-log-ratio": 1.5}, "access-log-ratio must be between 0 and 1"),
+        ]:
+            with self.subTest(config=config):
+                self.harness.update_config(config)
+                self.assertEqual(self.harness.model.unit.status, BlockedStatus(message))
+                self.harness.update_config(unset=list(config))
+
+    def test_access_log_alone_does_not_add_the_proxy(self):
+        self.harness.update_config({"access-log-ratio": 0.01})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(list(services), ["s3proxy"])
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ActiveStatus("access-log-ratio needs proxy-cache-memory or proxy-cache-disk"),
+        )
+
+    def test_access_log_is_kept_by_the_proxy(self):
+        self.harness.update_config({"access-log-ratio": 0.01, "proxy-cache-memory": "64Mi"})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(sorted(services), ["metrics", "proxy-cache", "s3proxy"])
+        command = services["proxy-cache"]["command"]
+        self.assertIn("--access-log-ratio 0.01", command)
+        self.assertIn("juju_unit=s3proxy-k8s/0", command)
+        self.assertNotIn("--loki-url", command)
+
+        rel_id = self.harness.add_relation("logging", "loki")
+        self.harness.add_relation_unit(rel_id, "loki/0")
+        url = "http://loki-0.loki-endpoints:3100/loki/api/v1/push"
+        self.harness.update_relation_data(rel_id, "loki/0", {"endpoint": json.dumps({"url": url})})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertIn(f"--loki-url {url}", services["proxy-cache"]["command"])
+
+        self.harness.remove_relation_unit(rel_id, "loki/0")
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertNotIn("--loki-url", services["proxy-cache"]["command"])
+
+
+class TestExpiry(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+        self.container = self.harness.model.unit.get_container("s3proxy")
+
+    def _services(self):
+        return self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+
+    def _rules(self):
+        return json.loads(self.container.pull("/data/lifecycle/rules.json").read())
+
+    def test_expiry_job_runs_with_rules(self):
+        self.assertNotIn("expiry", self._services())
+        self.harness.update_config(
+            {"expiry-rules": '[{"bucket": "logs", "days": 30}]', "expiry-rate": 100}
+        )
+        services = self._services()
+        self.assertEqual(sorted(services), ["expiry", "metrics", "s3proxy"])
+        command = services["expiry"]["command"]
+        self.assertIn("lifecycle.py --basedir /data/blobstore", command)
+        self.assertIn("--rate 100", command)
+        self.assertEqual(self._rules(), [{"bucket": "logs", "days": 30.0, "prefix": ""}])
+        self.assertIn(
+            "def main", self.container.pull("/usr/local/lib/s3proxy-charm/lifecycle.py").read()
+        )
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_clearing_rules_stops_the_job(self):
+        self.harness.update_config({"expiry-rules": '[{"bucket": "logs", "days": 1}]'})
+        self.assertTrue(self.container.get_service("expiry").is_running())
+
+        self.harness.update_config({"expiry-rules": ""})
+        self.assertEqual(self._services()["expiry"]["startup"], "disabled")
+        self.assertFalse(self.container.get_service("expiry").is_running())
+        self.assertFalse(self.container.exists("/data/lifecycle/rules.json"))
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_action_rules_override_config(self):
+        self.harness.update_config({"expiry-rules": '[{"bucket": "logs", "days": 30}]'})
+        event = MagicMock(params={"bucket": "logs", "days": 7, "prefix": ""})
+        self.harness.charm._on_set_expiry(event)
+        event.set_results.assert_called_once()
+        self.assertEqual(self._rules(), [{"bucket": "logs", "days": 7.0, "prefix": ""}])
+
+        # Removing the action's rule leaves the configured one.
+        event = MagicMock(params={"bucket": "logs", "days": 0, "prefix": ""})
+        self.harness.charm._on_set_expiry(event)
+        self.assertEqual(self._rules(), [{"bucket": "logs", "days": 30.0, "prefix": ""}])
+
+        event = MagicMock(params={"bucket": "a/b", "days": 1, "prefix": ""})
+        self.harness.charm._on_set_expiry(event)
+        event.fail.assert_called_once()
+
+    def test_action_rules_alone_start_the_job(self):
+        event = MagicMock(params={"bucket": "ci", "days": 1.5, "prefix": "tmp/"})
+        self.harness.charm._on_set_expiry(event)
+        self.assertIn("expiry", self._services())
+        self.assertEqual(self._rules(), [{"bucket": "ci", "days": 1.5, "prefix": "tmp/"}])
+
+    def test_invalid_rules_block(self):
+        for rules in ("nope", '[{"bucket": "logs"}]'):
+            with self.subTest(rules=rules):
+                self.harness.update_config({"expiry-rules": rules})
+                self.assertEqual(
+                    self.harness.model.unit.status, BlockedStatus("invalid expiry-rules")
+                )
+        self.harness.update_config(
+            {
+                "expiry-rules": '[{"bucket": "logs", "days": 1}]',
+                "backend": "s3",
+                "backend-endpoint": "https://s3.example.com",
+                "backend-identity": "remoteid",
+                "backend-credential": "remotecredential",
+            }
+        )
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("expiry-rules need the filesystem backend"),
+        )
+
+    def test_report(self):
+        event = MagicMock()
+        self.harness.charm._on_expiry_report(event)
+        event.set_results.assert_called_with({"runs": "none"})
+
+        run = {"started": 0, "finished": 60, "objects": 3, "bytes": 300, "buckets": {}}
+        state = {
+            "runs": [run, dict(run, objects=1)],
+            "checkpoint": {"path": ["logs", "x"], "run": dict(run, objects=2)},
+        }
+        self.container.push("/data/lifecycle/state.json", json.dumps(state), make_dirs=True)
+        self.harness.charm._on_expiry_report(event)
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(
+            results["run-0"],
+            {"finished": "1970-01-01T00:01:00+00:00", "objects": 1, "bytes": 300},
+        )
+        self.assertEqual(results["run-1"]["objects"], 3)
+        self.assertEqual(results["in-progress"]["reached"], "logs/x")
+
+
+class TestScrub(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+        self.container = self.harness.model.unit.get_container("s3proxy")
+
+    def _push_state(self, mismatches: int, in_progress: int = 0):
+        run = {
+            "started": 0,
+            "finished": 60,
+            "objects": 5,
+            "bytes": 500,
+            "unverified": 1,
+            "mismatched": mismatches,
+            "mismatches": [
+                {"object": f"logs/{i}", "expected": "00" * 16, "actual": "ff" * 16}
+                for i in range(mismatches)
+            ],
+        }
+        state = {"runs": [run]}
+        if in_progress:
+            state["checkpoint"] = {
+                "path": ["logs", "x"],
+                "run": dict(run, mismatched=in_progress, mismatches=[]),
+            }
+        self.container.push("/data/scrub/state.json", json.dumps(state), make_dirs=True)
+
+    def test_scrub_job_runs_at_interval(self):
+        self.assertNotIn("scrub", self.harness.get_container_pebble_plan("s3proxy").services)
+        self.harness.update_config({"scrub-interval": 24, "scrub-rate": 10, "scrub-workers": 4})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(sorted(services), ["metrics", "s3proxy", "scrub"])
+        command = services["scrub"]["command"]
+        self.assertIn("scrub.py --basedir /data/blobstore --state /data/scrub/state.json", command)
+        self.assertIn("--interval 86400 --rate 10485760 --workers 4", command)
+
+    def test_corrupt_objects_block(self):
+        self._push_state(2)
+        self.harness.update_config({"scrub-interval": 24})
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("scrub found 2 corrupt objects, see the scrub-report action"),
+        )
+        self._push_state(0)
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+        # Found by the run in progress, before it completes.
+        self._push_state(0, in_progress=1)
+        self.harness.charm.on.update_status.emit()
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test_report(self):
+        event = MagicMock()
+        self.harness.charm._on_scrub_report(event)
+        event.set_results.assert_called_with({"runs": "none"})
+
+        self._push_state(2)
+        self.harness.charm._on_scrub_report(event)
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(
+            results["last-run"],
+            {
+                "finished": "1970-01-01T00:01:00+00:00",
+                "objects": 5,
+                "bytes": 500,
+                "unverified": 1,
+                "corrupt": 2,
+            },
+        )
+        self.assertEqual(
+            results["corrupt-objects"].splitlines()[1],
+            f"logs/1: {'ff' * 16}, expected {'00' * 16}",
+        )
+
+
+class TestStorageActions(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.add_storage("s3proxy-store", attach=True)
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+        self.root = self.harness.model.storages["s3proxy-store"][0].location
+
+    def test_usage_is_logged_and_exported_per_bucket(self):
+        for path, size in (("logs/a", 10), ("logs/b/c", 20), ("ci/x", 5)):
+            (self.root / "blobstore" / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.root / "blobstore" / path).write_bytes(b"x" * size)
+
+        event = MagicMock(params={})
+        self.harness.charm._on_bucket_usage(event)
+        event.log.assert_any_call("logs: 2 objects, 30 bytes")
+        event.set_results.assert_called_with(
+            {
+                "bucket-0": {"name": "ci", "objects": 1, "bytes": 5},
+                "bucket-1": {"name": "logs", "objects": 2, "bytes": 30},
+            }
+        )
+        metrics = (self.root / "metrics" / "usage.prom").read_text()
+        self.assertIn('s3proxy_bucket_size_bytes{bucket="logs"} 30\n', metrics)
+
+        event = MagicMock(params={"bucket": "ci"})
+        self.harness.charm._on_bucket_usage(event)
+        event.set_results.assert_called_with(
+            {"bucket-0": {"name": "ci", "objects": 1, "bytes": 5}}
+        )
+
+    def test_snapshots_are_taken_and_pruned(self):
+        (self.root / "blobstore" / "logs").mkdir(parents=True)
+        (self.root / "blobstore" / "logs" / "a").write_bytes(b"data")
+        self.harness.update_config({"snapshot-retention": 1})
+
+        event = MagicMock(params={})
+        with patch("snapshot.time.time", return_value=1_700_000_000):
+            self.harness.charm._on_snapshot(event)
+        first = event.set_results.call_args[0][0]
+        self.assertEqual((first["copied"], first["copied-bytes"], first["pruned"]), (1, 4, "none"))
+        self.assertEqual(first["path"], f"/data/snapshots/{first['name']}")
+
+        with patch("snapshot.time.time", return_value=1_700_000_060):
+            self.harness.charm._on_snapshot(event)
+        second = event.set_results.call_args[0][0]
+        self.assertEqual(second["pruned"], first["name"])
+        self.assertTrue((self.root / "snapshots" / second["name"] / "logs" / "a").exists())
+
+    def test_usage_service(self):
+        self.harness.update_config({"usage-interval": 5})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(sorted(services), ["metrics", "s3proxy", "usage"])
+        self.assertIn("usage.py --basedir /data/blobstore", services["usage"]["command"])
+        self.assertIn("--interval 300", services["usage"]["command"])
+
+
+def _statvfs(percent: float, inodes_percent: float = 0) -> os.statvfs_result:
+    """A filesystem of 1000 4k blocks and inodes, with the given percentages used."""
+    free, free_inodes = int(1000 - 10 * percent), int(1000 - 10 * inodes_percent)
+    return os.statvfs_result(
+        (4096, 4096, 1000, free, free, 1000, free_inodes, free_inodes, 0, 255)
+    )
+
+
+class TestStoragePressure(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        patcher = patch("charm.os.statvfs", return_value=_statvfs(50))
+        self.statvfs = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.add_storage("s3proxy-store", attach=True)
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+        self.root = self.harness.model.storages["s3proxy-store"][0].location
+
+    def _update_status(self, statvfs: os.statvfs_result):
+        self.statvfs.return_value = statvfs
+        self.harness.charm.on.update_status.emit()
+
+    def _read_only(self) -> bool:
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        return "read-only-blobstore" in services["s3proxy"]["command"]
+
+    def test_blocked_past_threshold(self):
+        self._update_status(_statvfs(95))
+        self.assertEqual(self.harness.model.unit.status, BlockedStatus("storage 95% full"))
+        self._update_status(_statvfs(40, inodes_percent=92))
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("storage 92% of inodes used")
+        )
+        self.assertFalse(self._read_only())
+
+        self.harness.update_config({"storage-threshold": 95})
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_read_only_until_space_is_freed(self):
+        self.harness.update_config({"storage-read-only": True})
+        self._update_status(_statvfs(91))
+        self.assertTrue(self._read_only())
+        self.assertEqual(
+            self.harness.model.unit.status,
+            WaitingStatus("read-only until storage is freed: 91% full"),
+        )
+
+        # Some, but not enough, space freed.
+        self._update_status(_statvfs(87))
+        self.assertTrue(self._read_only())
+        self._update_status(_statvfs(84))
+        self.assertFalse(self._read_only())
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_services_are_only_applied_when_read_only_changes(self):
+        with patch.object(S3ProxyK8SOperatorCharm, "_configure") as configure:
+            self._update_status(_statvfs(60))
+            self._update_status(_statvfs(80, inodes_percent=95))
+            configure.assert_not_called()
+            self.assertEqual(
+                self.harness.model.unit.status, BlockedStatus("storage 95% of inodes used")
+            )
+        self.harness.update_config({"storage-read-only": True})
+        self.assertTrue(self._read_only())
+        with patch.object(S3ProxyK8SOperatorCharm, "_configure") as configure:
+            self._update_status(_statvfs(89))
+            configure.assert_not_called()
+            self._update_status(_statvfs(84))
+            configure.assert_called_once_with()
+
+    def test_blocked_config_is_applied_again(self):
+        self.harness.update_config({"log-level": "loud"})
+        self._update_status(_statvfs(50))
+        self.assertEqual(self.harness.model.unit.status, BlockedStatus("invalid log-level 'loud'"))
+
+    def test_metrics(self):
+        self.harness.update_config({"export-metrics": True})
+        services = self.harness.get_container_pebble_plan("s3proxy").to_dict()["services"]
+        self.assertEqual(sorted(services), ["metrics", "s3proxy"])
+        metrics = (self.root / "metrics" / "storage.prom").read_text()
+        self.assertIn("s3proxy_storage_size_bytes 4096000\n", metrics)
+        self.assertIn("s3proxy_storage_available_bytes 2048000\n", metrics)
+        self.assertIn("s3proxy_storage_read_only 0\n", metrics)
+
+
+class TestTransfer(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        self.mock_python = patcher.start()
+        self.mock_python.return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+        # The harness can't exec in containers.
+        patcher = patch.object(self.harness.charm._container, "exec")
+        self.exec = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _event(self, kind: str, **params):
+        event = MagicMock(params={"bucket": "logs", "path": "/mnt/backup/logs.tar", **params})
+        event.handle.kind = kind
+        return event
+
+    def test_export_runs_in_workload_and_logs_progress(self):
+        self.exec.return_value.stdout = [
+            '{"objects": 1000, "bytes": 4096}\n',
+            '{"objects": 1500, "bytes": 8192, "done": true}\n',
+        ]
+        event = self._event("export_bucket_action", format="tar", parallel=8)
+        self.harness.charm._on_transfer(event)
+
+        command = self.exec.call_args[0][0]
+        self.assertEqual(
+            command[:3], ["python3", "/usr/local/lib/s3proxy-charm/transfer.py", "export"]
+        )
+        self.assertIn("--path=/mnt/backup/logs.tar", command)
+        self.assertIn("--format=tar", command)
+        self.assertIn("--parallel=8", command)
+        event.log.assert_any_call("1000 objects, 4096 bytes")
+        event.set_results.assert_called_with({"objects": 1500, "bytes": 8192})
+        container = self.harness.model.unit.get_container("s3proxy")
+        self.assertIn(
+            "def main", container.pull("/usr/local/lib/s3proxy-charm/transfer.py").read()
+        )
+
+    def test_failed_import(self):
+        self.exec.return_value.stdout = ["import failed: [Errno 2] No such file\n"]
+        self.exec.return_value.wait.side_effect = ExecError(["python3"], 1, None, None)
+        event = self._event("import_bucket_action")
+        self.harness.charm._on_transfer(event)
+        self.assertEqual(self.exec.call_args[0][0][2], "import")
+        event.log.assert_called_with("import failed: [Errno 2] No such file")
+        event.fail.assert_called_with("import of logs failed (1)")
+
+    def test_missing_python(self):
+        self.mock_python.return_value = None
+        event = self._event("export_bucket_action")
+        self.harness.charm._on_transfer(event)
+        self.exec.assert_not_called()
+        event.fail.assert_called_with("the workload image has no python3 >= 3.8")
+
+
+class TestClientRequested(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("charm.boto3.client")
+        self.s3 = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+        # Juju gives every dispatch a unique context id, within which requests are deduplicated.
+        self.dispatches = 0
+        patcher = patch.dict(os.environ, {"JUJU_CONTEXT_ID": "s3proxy-k8s/0-0"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.harness.set_leader(True)
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.begin()
+        self.harness.container_pebble_ready("s3proxy")
+        self._end_dispatch()
+
+    def _end_dispatch(self):
+        self.harness.framework.commit()
+        self.dispatches += 1
+        os.environ["JUJU_CONTEXT_ID"] = f"s3proxy-k8s/0-{self.dispatches}"
+        self.s3.reset_mock()
+
+    def _relate(self, app: str, units: int) -> int:
+        rel_id = self.harness.add_relation("s3", app)
+        for unit in range(units):
+            self.harness.add_relation_unit(rel_id, f"{app}/{unit}")
+        self.harness.update_relation_data(rel_id, app, {"bucket": app})
+        return rel_id
+
+    def test_one_reconcile_per_relation_per_hook(self):
+        rel_id = self.harness.add_relation("s3", "app")
+        for unit in range(5):
+            self.harness.add_relation_unit(rel_id, f"app/{unit}")
+        # Until the requirer asks for a bucket, the provider falls back to a default one.
+        self.assertEqual(self.s3.list_buckets.call_count, 1)
+        self.s3.create_bucket.assert_called_once_with(Bucket="app-0")
+        self._end_dispatch()
+
+        self.harness.update_relation_data(rel_id, "app", {"bucket": "app"})
+        for unit in range(5, 10):
+            self.harness.add_relation_unit(rel_id, f"app/{unit}")
+        self.assertEqual(self.s3.list_buckets.call_count, 1)
+        self.s3.create_bucket.assert_called_once_with(Bucket="app")
+
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        self.assertEqual(data["bucket"], "app")
+        self.assertEqual(data["access-key"], "unittestid")
+
+    def test_nothing_is_kept_outside_a_dispatch(self):
+        del os.environ["JUJU_CONTEXT_ID"]
+        rel_id = self._relate("app", units=1)
+        self.s3.reset_mock()
+        self.harness.add_relation_unit(rel_id, "app/1")
+        self.s3.list_buckets.assert_called_once()
+        self.s3.create_bucket.assert_called_once_with(Bucket="app")
+
+    def test_endpoints_carry_performance_hints(self):
+        rel_id = self._relate("app", units=1)
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        self.assertEqual(data["s3-uri-style"], "path")
+        self.assertEqual(data["max-request-size"], str(32 * 1024 * 1024))
+        self.assertEqual(data["recommended-concurrency"], "16")
+        self.assertEqual(data["multipart-part-size"], str(16 * 1024 * 1024))
+
+        self.harness.update_config({"cpu": "500m", "memory": "1Gi"})
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        self.assertEqual(data["recommended-concurrency"], "4")
+        self.assertEqual(data["multipart-part-size"], str(32 * 1024 * 1024))
+
+        self.harness.update_config({"cpu": "100", "memory": "256Mi"})
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        self.assertEqual(data["recommended-concurrency"], "50")
+        self.assertEqual(data["multipart-part-size"], str(5 * 1024 * 1024))
+
+
+class TestCredentialStore(unittest.TestCase):
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *_):
+        self.harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.harness.framework.commit()
+
+    def _state_writes(self, dispatch) -> int:
+        """Run `dispatch`, commit, and count the times the charm's StoredState was saved."""
+        framework = self.harness.framework
+        stored = self.harness.charm._stored._data
+        with patch.object(framework, "save_snapshot", wraps=framework.save_snapshot) as save:
+            dispatch()
+            framework.commit()
+        return sum(1 for c in save.call_args_list if c.args[0] is stored)
+
+    def test_reading_does_not_write_state(self):
+        self.harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        self.harness.framework.commit()
+
+        def read_many_times():
+            for _ in range(10):
+                self.assertEqual(self.harness.charm._credentials["identity"], "unittestid")
+            self.harness.charm.on.config_changed.emit()
+
+        self.assertEqual(self._state_writes(read_many_times), 0)
+
+    def test_generated_credentials_are_written_once(self):
+        generated = {}
+
+        def first_dispatch():
+            generated.update(self.harness.charm._credentials)
+            self.assertEqual(self.harness.charm._credentials, generated)
+
+        self.assertEqual(self._state_writes(first_dispatch), 1)
+        self.assertEqual(len(generated["identity"]), 20)
+        self.assertEqual(len(generated["credential"]), 40)
+
+        def next_dispatch():
+            self.assertEqual(self.harness.charm._credentials, generated)
+
+        self.assertEqual(self._state_writes(next_dispatch), 0)
+
+    def test_changed_config_is_picked_up(self):
+        self.harness.charm._credentials
+
+        def change_identity():
+            self.harness.update_config({"identity": "newid"})
+            self.assertEqual(self.harness.charm._credentials["identity"], "newid")
+
+        self.assertEqual(self._state_writes(change_identity), 1)
+
+
+class TestScale(unittest.TestCase):
+    """Hook tool calls each hook makes should grow linearly with the number of relations."""
+
+    @patch("charm.KubernetesServicePatch", lambda x, y: None)
+    @patch("lightkube.core.client.GenericSyncClient")
+    def _build(self, relations: int, *_) -> Harness:
+        harness = Harness(S3ProxyK8SOperatorCharm)
+        self.addCleanup(harness.cleanup)
+        harness.set_leader(True)
+        harness.update_config({"identity": "unittestid", "credential": "unittestcredential"})
+        harness.begin()
+        harness.container_pebble_ready("s3proxy")
+        for i in range(relations):
+            rel_id = harness.add_relation("s3", f"app{i}")
+            harness.add_relation_unit(rel_id, f"app{i}/0")
+            harness.update_relation_data(rel_id, f"app{i}", {"bucket": f"app{i}"})
+        harness.framework.commit()
+        return harness
+
+    def _hook_tool_calls(self, harness: Harness, hook) -> int:
+        # Every dispatch starts with an empty model cache, as it runs in a new process.
+        harness.model.relations._invalidate("s3")
+        backend = harness._backend
+        with patch.object(
+            backend, "relation_get", wraps=backend.relation_get
+        ) as get, patch.object(
+            backend, "update_relation_data", wraps=backend.update_relation_data
+        ) as update:
+            hook(harness)
+            harness.framework.commit()
+        return get.call_count + update.call_count
+
+    def setUp(self):
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_version", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "2.0.0"
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(
+            S3ProxyK8SOperatorCharm, "_workload_python", new_callable=PropertyMock
+        )
+        patcher.start().return_value = "Python 3.8.10"
+        self.addCleanup(patcher.stop)
+        patcher = patch("charm.boto3.client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hooks_scale_linearly(self):
+        hooks = {
+            "leader-elected": lambda h: h.charm.on.leader_elected.emit(),
+            "pebble-ready": lambda h: h.container_pebble_ready("s3proxy"),
+            "refresh": lambda h: h.charm.object_storage.on.refresh.emit(),
+            "config-changed": lambda h: h.update_config({"cpu": "2"}),
+        }
+        small, large = self._build(5), self._build(50)
+        for name, hook in hooks.items():
+            with self.subTest(hook=name):
+                per_relation_small = self._hook_tool_calls(small, hook) / 5
+                per_relation_large = self._hook_tool_calls(large, hook) / 50
+                self.assertLessEqual(per_relation_large, per_relation_small)
+                # Republishing unchanged data reads each relation, but writes nothing.
+                self.assertLessEqual(per_relation_large, 2)
@@ -0,0 +1,225 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import datetime
+import http.client
+import importlib.util
+import io
+import json
+import logging
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import boto3
+from botocore.auth import HmacV1Auth, S3SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.credentials import Credentials
+
+from access_log import AccessLog
+from cache_gateway import DiskCache, Upstream
+from front_cache import FrontCache, MemoryCache, SignatureVerifier, TieredCache
+from metrics_exporter import format_metrics
+
+HAS_MOTO_SERVER = all(importlib.util.find_spec(module) for module in ("moto", "flask"))
+NOW = datetime.datetime(2023, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def _signed_headers(auth, path: str, secret: str = "secret") -> http.client.HTTPMessage:
+    """Headers of a GET of `path`, signed by botocore as a client would, as a server sees them."""
+    request = AWSRequest(method="GET", url=f"http://s3proxy:8090{path}")
+    request.context["client_config"] = Config(s3={"payload_signing_enabled": False})
+    signer = auth(Credentials("access", secret), "s3", "us-east-1")
+    if auth is HmacV1Auth:
+        signer = auth(Credentials("access", secret))
+    with patch("botocore.auth.get_current_datetime", return_value=NOW), patch(
+        "botocore.auth.formatdate", return_value="Mon, 01 May 2023 12:00:00 GMT"
+    ):
+        signer.add_auth(request)
+    raw = "Host: s3proxy:8090\r\n" + "".join(f"{k}: {v}\r\n" for k, v in request.headers.items())
+    return http.client.parse_headers(io.BytesIO(raw.encode() + b"\r\n"))
+
+
+class TestSignatureVerifier(unittest.TestCase):
+    def setUp(self):
+        self.verifier = SignatureVerifier("access", "secret")
+
+    def test_valid_signatures(self):
+        for auth in (S3SigV4Auth, HmacV1Auth):
+            with self.subTest(auth=auth.__name__):
+                headers = _signed_headers(auth, "/bucket/some%20key")
+                self.assertTrue(self.verifier.verify("GET", "/bucket/some%20key", headers, NOW))
+
+    def test_invalid_signatures(self):
+        for auth in (S3SigV4Auth, HmacV1Auth):
+            with self.subTest(auth=auth.__name__):
+                headers = _signed_headers(auth, "/bucket/key")
+                later = NOW + datetime.timedelta(minutes=20)
+                self.assertFalse(self.verifier.verify("GET", "/bucket/key", headers, later))
+                self.assertFalse(self.verifier.verify("GET", "/bucket/other", headers, NOW))
+                self.assertFalse(self.verifier.verify("HEAD", "/bucket/key", headers, NOW))
+
+                headers = _signed_headers(auth, "/bucket/key", secret="wrong")
+                self.assertFalse(self.verifier.verify("GET", "/bucket/key", headers, NOW))
+
+    def test_unsigned_requests(self):
+        headers = http.client.parse_headers(io.BytesIO(b"Host: s3proxy\r\n\r\n"))
+        self.assertFalse(self.verifier.verify("GET", "/bucket/key", headers, NOW))
+        headers = http.client.parse_headers(
+            io.BytesIO(b"Authorization: AWS4-HMAC-SHA256 x\r\n\r\n")
+        )
+        self.assertFalse(self.verifier.verify("GET", "/bucket/key", headers, NOW))
+
+
+class TestTieredCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+
+    def _put(self, cache: TieredCache, key: str, data: bytes):
+        fill = cache.fill("bucket", key, {"etag": f'"{key}"'})
+        fill.write(data)
+        fill.commit()
+
+    def test_small_objects_are_kept_in_memory(self):
+        cache = TieredCache(MemoryCache(800), DiskCache(self.root, 8000))
+        self._put(cache, "small", b"x" * 100)
+        self._put(cache, "large", b"x" * 500)
+        self.assertEqual(cache.memory.size, 100)
+        self.assertEqual(cache.disk.size, 600)
+
+        self.assertEqual(cache.get("bucket", "small").open().read(), b"x" * 100)
+        self.assertEqual(cache.get("bucket", "large").open().read(), b"x" * 500)
+        self.assertIsNone(cache.get("bucket", "missing"))
+        self.assertEqual((cache.hits, cache.misses), ({"memory": 1, "disk": 1}, 1))
+
+    def test_disk_hits_are_promoted(self):
+        disk = DiskCache(self.root, 8000)
+        self._put(TieredCache(None, disk), "key", b"x" * 100)
+
+        cache = TieredCache(MemoryCache(800), disk)
+        cache.get("bucket", "key")
+        cache.get("bucket", "key")
+        self.assertEqual(cache.hits, {"memory": 1, "disk": 1})
+
+        cache.invalidate("bucket", "key")
+        self.assertIsNone(cache.get("bucket", "key"))
+
+    def test_memory_evicts_least_recently_used(self):
+        cache = TieredCache(MemoryCache(300), None)
+        for key in "abc":
+            self._put(cache, key, b"x" * 30)
+        cache.get("bucket", "a")
+        for key in "defghijk":
+            self._put(cache, key, b"x" * 30)
+        self.assertIsNotNone(cache.get("bucket", "a"))
+        self.assertIsNone(cache.get("bucket", "b"))
+        self.assertEqual(cache.memory.evictions, 1)
+
+    def test_metrics_by_tier(self):
+        cache = TieredCache(MemoryCache(800), DiskCache(self.root, 8000))
+        self._put(cache, "key", b"x" * 10)
+        cache.get("bucket", "key")
+        text = format_metrics(cache.metrics())
+        self.assertIn('s3proxy_proxy_cache_hits_total{tier="memory"} 1\n', text)
+        self.assertIn('s3proxy_proxy_cache_hits_total{tier="disk"} 0\n', text)
+        self.assertIn('s3proxy_proxy_cache_size_bytes{tier="disk"} 10\n', text)
+
+
+@unittest.skipUnless(HAS_MOTO_SERVER, "needs moto[server]")
+class TestFrontCache(unittest.TestCase):
+    """The proxy in front of a local moto server, standing in for s3proxy."""
+
+    @classmethod
+    def setUpClass(cls):
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        cls.s3proxy = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.s3proxy.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s3proxy.stop()
+
+    def _client(self, secret: str = "secret"):
+        return boto3.client(
+            "s3",
+            endpoint_url=f"http://127.0.0.1:{self.proxy.server_address[1]}",
+            aws_access_key_id="access",
+            aws_secret_access_key=secret,
+            region_name="us-east-1",
+            config=Config(
+                s3={"addressing_style": "path"}, request_checksum_calculation="when_required"
+            ),
+        )
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        host, port = self.s3proxy.get_host_and_port()
+        self.cache = TieredCache(MemoryCache(1024 * 1024), DiskCache(Path(tmp.name), 8 << 20))
+        self.proxy = FrontCache(
+            ("127.0.0.1", 0),
+            Upstream(f"http://{host}:{port}"),
+            self.cache,
+            SignatureVerifier("access", "secret"),
+        )
+        threading.Thread(target=self.proxy.serve_forever, daemon=True).start()
+        self.addCleanup(self.proxy.server_close)
+        self.addCleanup(self.proxy.shutdown)
+        self.client = self._client()
+        self.client.create_bucket(Bucket="bucket")
+
+    def _get(self, client, key: str) -> bytes:
+        return client.get_object(Bucket="bucket", Key=key)["Body"].read()
+
+    def test_hot_objects_are_served_from_cache(self):
+        small, large = b"s" * 1000, b"l" * (512 * 1024)
+        self.client.put_object(Bucket="bucket", Key="small", Body=small)
+        self.client.put_object(Bucket="bucket", Key="large", Body=large)
+        for _ in range(3):
+            self.assertEqual(self._get(self.client, "small"), small)
+            self.assertEqual(self._get(self.client, "large"), large)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(self.cache.hits, {"memory": 2, "disk": 2})
+
+    def test_unauthenticated_requests_go_to_s3proxy(self):
+        self.client.put_object(Bucket="bucket", Key="key", Body=b"data")
+        self._get(self.client, "key")
+        # The stand-in doesn't check signatures, so the proxy must not serve this.
+        self.assertEqual(self._get(self._client(secret="wrong"), "key"), b"data")
+        self.assertEqual(self.cache.hits, {"memory": 0, "disk": 0})
+
+    def test_writes_invalidate(self):
+        self.client.put_object(Bucket="bucket", Key="key", Body=b"one")
+        self._get(self.client, "key")
+        self.client.put_object(Bucket="bucket", Key="key", Body=b"two")
+        self.assertEqual(self._get(self.client, "key"), b"two")
+        self.client.delete_object(Bucket="bucket", Key="key")
+        with self.assertRaises(self.client.exceptions.NoSuchKey):
+            self._get(self.client, "key")
+
+    def test_requests_are_sampled_into_the_access_log(self):
+        stream = io.StringIO()
+        self.proxy.access_log = AccessLog(1, stream=stream)
+        self.client.put_object(Bucket="bucket", Key="dir/key", Body=b"data")
+        for _ in range(2):
+            self._get(self.client, "dir/key")
+        self.client.list_objects_v2(Bucket="bucket")
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(
+            [(line["method"], line["key"], line["status"], line["cached"]) for line in lines],
+            [
+                ("PUT", "dir/key", 200, False),
+                ("GET", "dir/key", 200, False),
+                ("GET", "dir/key", 200, True),
+                ("GET", "", 200, False),
+            ],
+        )
+        self.assertEqual(lines[2]["bytes"], 4)
+        self.assertIn("list-type", lines[3]["query"])
@@ -0,0 +1,173 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from jobs import load_state
+from lifecycle import (
+    DAY,
+    Expiry,
+    Rule,
+    Throttle,
+    merge_rules,
+    metrics,
+    parse_rules,
+)
+from metrics_exporter import format_metrics
+
+NOW = 1_700_000_000.0
+
+
+class TestRules(unittest.TestCase):
+    def test_parse(self):
+        rules = parse_rules(
+            [{"bucket": "logs", "days": 30}, {"bucket": "ci", "days": "1.5", "prefix": "tmp/"}]
+        )
+        self.assertEqual(rules, [Rule("logs", 30.0), Rule("ci", 1.5, "tmp/")])
+        for invalid in (
+            {},
+            [{"bucket": "logs"}],
+            [{"bucket": "a/b", "days": 1}],
+            [{"bucket": "logs", "days": 0}],
+        ):
+            with self.subTest(rules=invalid), self.assertRaises(ValueError):
+                parse_rules(invalid)
+
+    def test_later_rules_override(self):
+        merged = merge_rules([Rule("a", 1), Rule("a", 2, "x/")], [Rule("a", 3)])
+        self.assertEqual(merged, [Rule("a", 2, "x/"), Rule("a", 3)])
+
+
+class TestThrottle(unittest.TestCase):
+    def test_operations_are_spaced_out(self):
+        clock, sleeps = [0.0], []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        throttle = Throttle(10, clock=lambda: clock[0], sleep=sleep)
+        for _ in range(5):
+            throttle()
+        self.assertAlmostEqual(clock[0], 0.4)
+
+        # Idle time isn't banked for a later burst.
+        clock[0] += 10
+        sleeps.clear()
+        throttle()
+        throttle()
+        self.assertEqual(len(sleeps), 1)
+
+
+class TestExpiry(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.basedir = Path(tmp.name) / "blobstore"
+        self.state = Path(tmp.name) / "state.json"
+
+    def _object(self, path: str, age_days: float, size: int = 10):
+        file = self.basedir / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(b"x" * size)
+        mtime = NOW - age_days * DAY
+        os.utime(file, (mtime, mtime))
+
+    def _remaining(self):
+        return sorted(
+            str(p.relative_to(self.basedir)) for p in self.basedir.rglob("*") if p.is_file()
+        )
+
+    def test_expired_objects_are_deleted(self):
+        self._object("logs/old", 31, size=100)
+        self._object("logs/deep/er/old", 40, size=50)
+        self._object("logs/new", 1)
+        self._object("ci/tmp/old", 2)
+        self._object("ci/keep/old", 2)
+        self._object("other/old", 1000)
+
+        rules = [Rule("logs", 30), Rule("ci", 1, "tmp/"), Rule("missing", 1)]
+        run = Expiry(self.basedir, rules, self.state, now=NOW)()
+
+        self.assertEqual(self._remaining(), ["ci/keep/old", "logs/new", "other/old"])
+        self.assertEqual((run["objects"], run["bytes"], run["scanned"]), (3, 160, 5))
+        self.assertEqual(run["buckets"]["logs"], {"objects": 2, "bytes": 150})
+        # Directories emptied are removed, others left alone.
+        self.assertFalse((self.basedir / "logs" / "deep").exists())
+        self.assertTrue((self.basedir / "ci" / "keep").exists())
+        self.assertEqual(load_state(self.state)["runs"], [run])
+
+    def test_longest_overlapping_rule_wins(self):
+        self._object("logs/tmp/a", 5)
+        self._object("logs/b", 5)
+        Expiry(self.basedir, [Rule("logs", 1), Rule("logs", 10, "tmp/")], self.state, now=NOW)()
+        self.assertEqual(self._remaining(), ["logs/tmp/a"])
+
+    def test_interrupted_run_resumes(self):
+        for i in range(10):
+            self._object(f"logs/{i // 3}/{i}", 10)
+        rules = [Rule("logs", 1)]
+
+        expiry = Expiry(self.basedir, rules, self.state, batch_size=2, now=NOW)
+        batches = []
+
+        def crash_on_third_batch(batch, reached, delete=expiry._delete):
+            batches.append(batch)
+            if len(batches) == 3:
+                raise KeyboardInterrupt
+            delete(batch, reached)
+
+        expiry._delete = crash_on_third_batch
+        with self.assertRaises(KeyboardInterrupt):
+            expiry()
+        # Two batches went through: three objects and their directory.
+        self.assertEqual(len(self._remaining()), 7)
+        checkpoint = load_state(self.state)["checkpoint"]
+        self.assertEqual((checkpoint["path"], checkpoint["run"]["objects"]), (["logs", "0"], 3))
+        self.assertFalse((self.basedir / "logs" / "0").exists())
+
+        # Judged against when the run started, and counted from where it had got to.
+        run = Expiry(self.basedir, rules, self.state, now=NOW + 100 * DAY)()
+        self.assertEqual(self._remaining(), [])
+        self.assertEqual((run["started"], run["objects"], run["bytes"]), (NOW, 10, 100))
+        self.assertNotIn("checkpoint", load_state(self.state))
+
+    def test_checkpoint_is_dropped_when_rules_change(self):
+        self._object("logs/a", 10)
+        self.state.write_text(
+            json.dumps(
+                {
+                    "checkpoint": {
+                        "rules": "[]",
+                        "path": ["logs", "z"],
+                        "run": {
+                            "started": 0,
+                            "objects": 0,
+                            "bytes": 0,
+                            "scanned": 0,
+                            "buckets": {},
+                        },
+                    }
+                }
+            )
+        )
+        run = Expiry(self.basedir, [Rule("logs", 1)], self.state, now=NOW)()
+        self.assertEqual(run["objects"], 1)
+
+    def test_runs_are_reported(self):
+        self._object("logs/a", 10, size=42)
+        Expiry(self.basedir, [Rule("logs", 1)], self.state, now=NOW)()
+        Expiry(self.basedir, [Rule("logs", 1)], self.state, now=time.time())()
+
+        state = load_state(self.state)
+        self.assertEqual([run["objects"] for run in state["runs"]], [1, 0])
+        text = format_metrics(metrics(state))
+        self.assertIn("s3proxy_expiry_last_run_objects 0\n", text)
+
+        text = format_metrics(metrics({"runs": state["runs"][:1]}))
+        self.assertIn('s3proxy_expiry_last_run_bytes{bucket="logs"} 42\n', text)
@@ -0,0 +1,300 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import hashlib
+import importlib.util
+import logging
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Tuple
+from unittest.mock import patch
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.etree import ElementTree
+
+import boto3
+from botocore.config import Config
+
+import migration
+from cache_gateway import Remote, Upstream
+from jobs import load_state
+from migration import Migration, MigrationGateway, merge_listings
+
+HAS_MOTO_SERVER = all(importlib.util.find_spec(module) for module in ("moto", "flask"))
+NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def _listing(keys, truncated: bool = False) -> bytes:
+    contents = "".join(f"<Contents><Key>{key}</Key></Contents>" for key in keys)
+    return (
+        f'<ListBucketResult xmlns="{NS}"><Name>b</Name><IsTruncated>{str(truncated).lower()}'
+        f"</IsTruncated>{contents}</ListBucketResult>"
+    ).encode()
+
+
+def _keys(listing: bytes):
+    root = ElementTree.fromstring(listing)
+    keys = [e.text for e in root.iter(f"{{{NS}}}Key")]
+    return keys, root.findtext(f"{{{NS}}}IsTruncated"), root.findtext(f"{{{NS}}}NextMarker")
+
+
+class TestMergeListings(unittest.TestCase):
+    def test_new_and_old_objects_are_merged_in_order(self):
+        merged = merge_listings(_listing(["a", "c"]), _listing(["b", "c"]), 1000)
+        self.assertEqual(_keys(merged), (["a", "b", "c"], "false", None))
+        merged = merge_listings(_listing(["a", "c"]), _listing(["b"]), 2)
+        self.assertEqual(_keys(merged), (["a", "b"], "true", "b"))
+
+    def test_truncated_listings_bound_the_page(self):
+        # The old backend may have more objects between "m" and "z", on its next page.
+        merged = merge_listings(_listing(["a", "z"]), _listing(["b", "m"], truncated=True), 1000)
+        self.assertEqual(_keys(merged), (["a", "b", "m"], "true", "m"))
+
+
+class FakeS3(BaseHTTPRequestHandler):
+    """Just enough of S3 to stand in for the filesystem provider served by s3proxy."""
+
+    protocol_version = "HTTP/1.1"
+    page_size = 2
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", headers: Dict[str, str] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _target(self) -> Tuple[str, str, Dict[str, str]]:
+        target = urlsplit(self.path)
+        bucket, _, key = unquote(target.path).lstrip("/").partition("/")
+        return bucket, key, dict(parse_qsl(target.query, keep_blank_values=True))
+
+    def do_GET(self):  # noqa: N802
+        buckets = self.server.buckets
+        bucket, key, params = self._target()
+        if not bucket:
+            names = "".join(f"<Bucket><Name>{b}</Name></Bucket>" for b in sorted(buckets))
+            body = f'<ListAllMyBucketsResult xmlns="{NS}"><Buckets>{names}</Buckets>'
+            self._reply(200, (body + "</ListAllMyBucketsResult>").encode())
+        elif bucket not in buckets or (key and key not in buckets[bucket]):
+            self._reply(404, b"<Error><Code>NoSuchKey</Code></Error>")
+        elif key:
+            data, headers = buckets[bucket][key]
+            self._reply(200, data, headers)
+        else:
+            keys = sorted(k for k in buckets[bucket] if k > params.get("marker", ""))
+            page = keys[: self.page_size]
+            self._reply(200, _listing(page, truncated=len(keys) > len(page)))
+
+    do_HEAD = do_GET  # noqa: N815
+
+    def do_DELETE(self):  # noqa: N802
+        bucket, key, _ = self._target()
+        if key:
+            self.server.buckets.get(bucket, {}).pop(key, None)
+        elif self.server.buckets.get(bucket):
+            self._reply(409, b"<Error><Code>BucketNotEmpty</Code></Error>")
+            return
+        else:
+            self.server.buckets.pop(bucket, None)
+        self._reply(204)
+
+    def do_POST(self):  # noqa: N802
+        bucket, _, _ = self._target()
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        for key in ElementTree.fromstring(body).iter(f"{{{NS}}}Key"):
+            self.server.buckets.get(bucket, {}).pop(key.text, None)
+        self._reply(200, f'<DeleteResult xmlns="{NS}"/>'.encode())
+
+
+@unittest.skipUnless(HAS_MOTO_SERVER, "needs moto[server]")
+class TestMigration(unittest.TestCase):
+    """From a fake filesystem backend to a local moto server, standing in for the remote."""
+
+    @classmethod
+    def setUpClass(cls):
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        cls.remote = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.remote.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.remote.stop()
+
+    @staticmethod
+    def _client(endpoint: str):
+        return boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id="remoteid",
+            aws_secret_access_key="remotecredential",
+            region_name="us-east-1",
+            config=Config(
+                s3={"addressing_style": "path"}, request_checksum_calculation="when_required"
+            ),
+        )
+
+    def _serve(self, server: ThreadingHTTPServer) -> str:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.bucket = self._testMethodName.replace("_", "-")
+        self.objects = {
+            "a": (b"a" * 10, {"Content-Type": "text/x", "x-amz-meta-owner": "me"}),
+            "c": (b"c", {}),
+            "dir/b": (b"b" * 3000, {}),
+            "e": (b"", {}),
+        }
+        for data, headers in self.objects.values():
+            headers["ETag"] = f'"{hashlib.md5(data).hexdigest()}"'
+        old_server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3)
+        old_server.daemon_threads = True
+        old_server.buckets = {self.bucket: self.objects}
+        self.old = Upstream(self._serve(old_server))
+
+        host, port = self.remote.get_host_and_port()
+        self.remote_client = self._client(f"http://{host}:{port}")
+        self.addCleanup(self._empty_remote)
+        self.new = Remote(f"http://{host}:{port}", "us-east-1", "remoteid", "remotecredential")
+        self.state = Path(tmp.name) / "state.json"
+        # The old backend stands for a filesystem s3proxy, whose ETags are MD5s.
+        self.migration = Migration(self.old, self.new, self.state, workers=2, md5_etags=True)
+        gateway = MigrationGateway(("127.0.0.1", 0), self.old, self.new, self.migration)
+        self.client = self._client(self._serve(gateway))
+
+    def _empty_remote(self):
+        try:
+            listing = self.remote_client.list_objects(Bucket=self.bucket)
+        except self.remote_client.exceptions.NoSuchBucket:
+            return
+        for entry in listing.get("Contents", []):
+            self.remote_client.delete_object(Bucket=self.bucket, Key=entry["Key"])
+        self.remote_client.delete_bucket(Bucket=self.bucket)
+
+    def _get(self, client, key: str) -> bytes:
+        return client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def _listed(self):
+        listing = self.client.list_objects(Bucket=self.bucket, MaxKeys=3)
+        keys = [entry["Key"] for entry in listing["Contents"]]
+        while listing["IsTruncated"]:
+            listing = self.client.list_objects(Bucket=self.bucket, Marker=keys[-1], MaxKeys=3)
+            keys.extend(entry["Key"] for entry in listing["Contents"])
+        return keys
+
+    def test_reads_fall_through_until_copied(self):
+        self.assertEqual(self._get(self.client, "dir/b"), b"b" * 3000)
+        self.assertEqual(self.client.head_object(Bucket=self.bucket, Key="a")["ContentLength"], 10)
+        buckets = [b["Name"] for b in self.client.list_buckets()["Buckets"]]
+        self.assertIn(self.bucket, buckets)
+
+        # Writes go to the new backend, deletes to both.
+        self.remote_client.create_bucket(Bucket=self.bucket)
+        self.client.put_object(Bucket=self.bucket, Key="d", Body=b"new")
+        self.client.delete_object(Bucket=self.bucket, Key="c")
+        self.assertEqual(self._get(self.remote_client, "d"), b"new")
+        self.assertNotIn("c", self.objects)
+        self.assertEqual(self._listed(), ["a", "d", "dir/b", "e"])
+
+        self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": "e"}]})
+        self.assertNotIn("e", self.objects)
+        with self.assertRaises(self.client.exceptions.NoSuchKey):
+            self.client.get_object(Bucket=self.bucket, Key="e")
+
+    def test_objects_are_copied_and_verified(self):
+        self.assertTrue(self.migration.run())
+        self.assertEqual(
+            {k: self.migration.state[k] for k in ("copied", "bytes", "skipped", "failed")},
+            {"copied": 4, "bytes": 3011, "skipped": 0, "failed": 0},
+        )
+        for key, (data, _) in self.objects.items():
+            self.assertEqual(self._get(self.remote_client, key), data)
+        head = self.remote_client.head_object(Bucket=self.bucket, Key="a")
+        self.assertEqual((head["ContentType"], head["Metadata"]), ("text/x", {"owner": "me"}))
+
+        # Done, so the old backend is no longer read.
+        self.assertEqual(self._get(self.client, "a"), b"a" * 10)
+        self.objects["late"] = (b"late", {})
+        with self.assertRaises(self.client.exceptions.NoSuchKey):
+            self.client.get_object(Bucket=self.bucket, Key="late")
+        self.assertTrue(Migration(self.old, self.new, self.state).done)
+
+    def test_corrupt_objects_are_retried_by_another_pass(self):
+        self.objects["c"][1]["ETag"] = '"' + "0" * 32 + '"'
+        self.assertFalse(self.migration.run())
+        self.assertEqual((self.migration.state["copied"], self.migration.state["failed"]), (3, 1))
+        self.assertEqual(self.migration.state["failures"][0]["object"], f"{self.bucket}/c")
+        with self.assertRaises(self.remote_client.exceptions.NoSuchKey):
+            self.remote_client.get_object(Bucket=self.bucket, Key="c")
+
+        del self.objects["c"][1]["ETag"]
+        self.assertTrue(self.migration.run())
+        self.assertEqual(
+            {k: self.migration.state[k] for k in ("copied", "skipped", "failed")},
+            {"copied": 4, "skipped": 3, "failed": 0},
+        )
+
+    def test_etags_which_are_not_md5s(self):
+        # As a remote's are with SSE-KMS, both when read from the old and written to the new.
+        self.objects["c"][1]["ETag"] = '"' + "0" * 32 + '"'
+        call = migration._call
+
+        def encrypted(upstream, method, *args, **kwargs):
+            status, headers, data = call(upstream, method, *args, **kwargs)
+            if method == "PUT":
+                headers["etag"] = '"' + "1" * 32 + '"'
+            return status, headers, data
+
+        remote = Migration(self.old, self.new, self.state, workers=2)
+        with patch.object(migration, "_call", encrypted):
+            self.assertTrue(remote.run())
+        self.assertEqual(remote.state["copied"], 4)
+        for key, (data, _) in self.objects.items():
+            self.assertEqual(self._get(self.remote_client, key), data)
+
+    def test_newer_writes_are_not_overwritten(self):
+        self.remote_client.create_bucket(Bucket=self.bucket)
+        self.client.put_object(Bucket=self.bucket, Key="a", Body=b"newer")
+        self.assertTrue(self.migration.run())
+        self.assertEqual(self._get(self.remote_client, "a"), b"newer")
+        self.assertEqual(self.migration.state["skipped"], 1)
+
+    def test_progress_of_another_migration_is_discarded(self):
+        self.assertTrue(self.migration.run())
+        self.assertTrue(Migration(self.old, self.new, self.state).done)
+        other = Migration(self.old, self.new, self.state, source="s3-to-filesystem@x")
+        self.assertFalse(other.done)
+        self.assertEqual(other.state["copied"], 0)
+
+    def test_interrupted_migration_resumes(self):
+        copy = Migration.copy
+
+        def crash_on_third(migration, bucket, key):
+            if key == "dir/b":
+                raise KeyboardInterrupt
+            return copy(migration, bucket, key)
+
+        with patch.object(migration, "CHECKPOINT_SECONDS", 0):
+            with patch.object(Migration, "copy", crash_on_third):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.migration.run()
+        self.assertEqual(load_state(self.state)["marker"], "c")
+
+        resumed = Migration(self.old, self.new, self.state, workers=2)
+        self.assertTrue(resumed.run())
+        self.assertEqual(resumed.state["copied"] + resumed.state["skipped"], 4)
+        self.assertEqual(len(self.remote_client.list_objects(Bucket=self.bucket)["Contents"]), 4)
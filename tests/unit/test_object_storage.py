@@ -0,0 +1,587 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from charms.s3proxy_k8s.v0 import object_storage
+from charms.s3proxy_k8s.v0.object_storage import (
+    ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA,
+    OBJECT_STORAGE_PROVIDES_APP_SCHEMA,
+    AsyncObjectStorageClient,
+    BucketInfo,
+    DataValidationError,
+    ObjectStorageRequirer,
+    SingleAuthObjectStorageProvider,
+    _validate_data,
+    build_s3_client,
+    build_transfer_config,
+    download_directory,
+    download_stream,
+    upload_directory,
+    upload_stream,
+)
+from ops.charm import CharmBase
+from ops.testing import Harness
+
+HAS_MOTO_SERVER = all(
+    importlib.util.find_spec(module) for module in ("aiobotocore", "moto", "flask")
+)
+
+PROVIDER_META = """
+name: provider
+containers:
+  workload:
+    resource: workload-image
+provides:
+  s3:
+    interface: s3
+"""
+
+
+REQUIRER_META = """
+name: requirer
+requires:
+  s3:
+    interface: s3
+"""
+
+PROVIDER_DATA = {
+    "bucket": "requirer",
+    "endpoint": "http://s3proxy:8080",
+    "access-key": "access",
+    "secret-key": "secret",
+}
+
+HINTS = {
+    "s3-uri-style": "host",
+    "max-request-size": str(8 * 1024 * 1024),
+    "recommended-concurrency": "8",
+    "multipart-part-size": str(64 * 1024 * 1024),
+}
+
+
+class ProviderCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.object_storage = SingleAuthObjectStorageProvider(self, "s3")
+        self.requested = []
+        self.framework.observe(self.object_storage.on.requested, self._on_requested)
+
+    def _on_requested(self, event):
+        self.requested.append((event.relation.id, event.bucket))
+
+
+class RequirerCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.object_storage = ObjectStorageRequirer(self, bucket="requirer")
+        self.relation_changed = 0
+        self.ready = []
+        self.framework.observe(self.on.s3_relation_changed, self._on_relation_changed)
+        self.framework.observe(self.object_storage.on.ready, self._on_ready)
+
+    def _on_relation_changed(self, _):
+        self.relation_changed += 1
+
+    def _on_ready(self, event):
+        self.ready.append(event.endpoint)
+        self.last_ready = event
+
+
+class TestValidation(unittest.TestCase):
+    def test_validator_is_compiled_once_per_schema(self):
+        object_storage._VALIDATORS.clear()
+        for i in range(3):
+            _validate_data({"bucket": f"b-{i}"}, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
+        self.assertEqual(len(object_storage._VALIDATORS), 1)
+
+        validator = object_storage._VALIDATORS[ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA["$id"]]
+        _validate_data({"bucket": "again"}, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
+        self.assertIs(
+            object_storage._VALIDATORS[ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA["$id"]],
+            validator,
+        )
+
+    def test_provider_schema_is_valid(self):
+        _validate_data(
+            {"bucket": "b", "access-key": "a", "secret-key": "s", "endpoint": "http://e"},
+            OBJECT_STORAGE_PROVIDES_APP_SCHEMA,
+        )
+
+    def test_invalid_data_raises(self):
+        with self.assertRaises(DataValidationError):
+            _validate_data({"endpoint": "http://e"}, ANONYMOUS_OBJECT_STORAGE_REQUIRES_APP_SCHEMA)
+
+
+class TestProviderUpdateEndpoints(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(ProviderCharm, meta=PROVIDER_META)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.provider = self.harness.charm.object_storage
+
+    def _relate(self, app: str) -> int:
+        rel_id = self.harness.add_relation("s3", app)
+        self.harness.add_relation_unit(rel_id, f"{app}/0")
+        self.harness.update_relation_data(rel_id, app, {"bucket": app})
+        return rel_id
+
+    def _count_writes(self):
+        return patch.object(
+            self.harness._backend,
+            "update_relation_data",
+            wraps=self.harness._backend.update_relation_data,
+        )
+
+    def test_unchanged_data_is_not_rewritten(self):
+        rel_ids = [self._relate(f"app{i}") for i in range(3)]
+        data = {"endpoint": "http://e:8080", "access-key": "a", "secret-key": "s"}
+
+        with self._count_writes() as writes:
+            self.provider.update_endpoints(dict(data))
+            self.assertEqual(writes.call_count, 3 * 4)
+
+            writes.reset_mock()
+            self.provider.update_endpoints(dict(data))
+            self.provider.update_endpoints({"endpoint": "http://e:8080"})
+            self.assertEqual(writes.call_count, 0)
+
+            self.provider.update_endpoints({"endpoint": "http://f:8080"}, rel_ids[1])
+            writes.assert_called_once()
+            rel_id, _, key, value = writes.call_args.args
+            self.assertEqual((rel_id, key, value), (rel_ids[1], "endpoint", "http://f:8080"))
+
+        databag = self.harness.get_relation_data(rel_ids[1], self.harness.charm.app.name)
+        self.assertEqual(databag["bucket"], "app1")
+        self.assertEqual(databag["endpoint"], "http://f:8080")
+
+    def test_update_by_relation_id_only_touches_that_relation(self):
+        first = self._relate("app0")
+        second = self._relate("app1")
+
+        self.provider.update_endpoints({"endpoint": "http://e:8080"}, second)
+
+        app = self.harness.charm.app.name
+        self.assertEqual(self.harness.get_relation_data(first, app), {})
+        self.assertEqual(self.harness.get_relation_data(second, app)["bucket"], "app1")
+
+    def test_non_leader_does_not_publish(self):
+        rel_id = self._relate("app")
+        self.harness.set_leader(False)
+        with self._count_writes() as writes:
+            self.provider.update_endpoints({"endpoint": "http://s3proxy:8080", **HINTS})
+        writes.assert_not_called()
+        self.assertNotIn("endpoint", self.harness.get_relation_data(rel_id, "provider"))
+
+    def test_leader_elected_forgets_published_digests(self):
+        rel_id = self._relate("app0")
+        self.provider.update_endpoints({"endpoint": "http://e:8080"})
+        self.assertIn(str(rel_id), self.provider._stored.published)
+
+        self.harness.charm.on.leader_elected.emit()
+        self.assertEqual(dict(self.provider._stored.published), {})
+
+    def test_new_leader_does_not_rewrite_unchanged_data(self):
+        rel_ids = [self._relate(f"app{i}") for i in range(3)]
+        self.provider.update_endpoints({"endpoint": "http://e:8080"})
+        self.harness.charm.on.leader_elected.emit()
+
+        with self._count_writes() as writes:
+            self.provider.update_endpoints({"endpoint": "http://e:8080"})
+        writes.assert_not_called()
+
+        with self._count_writes() as writes:
+            self.provider.update_endpoints({"endpoint": "http://moved:8080"})
+        self.assertEqual(writes.call_count, len(rel_ids))
+
+    def test_invalid_hints_are_not_published(self):
+        rel_id = self._relate("app0")
+        with self.assertRaises(DataValidationError):
+            self.provider.update_endpoints(
+                {"endpoint": "http://e:8080", "recommended-concurrency": "many"}
+            )
+        self.assertEqual(self.harness.get_relation_data(rel_id, "provider"), {})
+
+        # Credentials are optional, as with anonymous access.
+        self.provider.update_endpoints({"endpoint": "http://e:8080", **HINTS})
+        self.assertEqual(
+            self.harness.get_relation_data(rel_id, "provider"),
+            {"bucket": "app0", "endpoint": "http://e:8080", **HINTS},
+        )
+
+    def test_relation_broken_drops_digests(self):
+        rel_id = self._relate("app0")
+        self.provider.update_endpoints({"endpoint": "http://e:8080"})
+
+        self.harness.remove_relation(rel_id)
+        self.assertNotIn(str(rel_id), self.provider._stored.published)
+
+
+class TestProviderRequested(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(ProviderCharm, meta=PROVIDER_META)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+    def test_requested_once_per_bucket_per_dispatch(self):
+        with patch.dict(os.environ, {"JUJU_CONTEXT_ID": "s3proxy/0-1"}):
+            rel_id = self.harness.add_relation("s3", "app")
+            self.harness.update_relation_data(rel_id, "app", {"bucket": "app"})
+            for unit in range(5):
+                self.harness.add_relation_unit(rel_id, f"app/{unit}")
+        self.assertEqual(self.harness.charm.requested, [(rel_id, "app-0"), (rel_id, "app")])
+
+        with patch.dict(os.environ, {"JUJU_CONTEXT_ID": "s3proxy/0-2"}):
+            self.harness.add_relation_unit(rel_id, "app/5")
+        self.assertEqual(self.harness.charm.requested[2:], [(rel_id, "app")])
+
+    def test_events_outside_a_dispatch_are_not_deduplicated(self):
+        with patch.dict(os.environ):
+            os.environ.pop("JUJU_CONTEXT_ID", None)
+            rel_id = self.harness.add_relation("s3", "app")
+            self.harness.update_relation_data(rel_id, "app", {"bucket": "app"})
+            self.harness.add_relation_unit(rel_id, "app/0")
+            self.harness.add_relation_unit(rel_id, "app/1")
+        self.assertEqual(self.harness.charm.requested[1:], [(rel_id, "app")] * 3)
+
+
+class TestRequirerBucketRequest(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(RequirerCharm, meta=REQUIRER_META)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+    def _count_writes(self):
+        return patch.object(
+            self.harness._backend,
+            "update_relation_data",
+            wraps=self.harness._backend.update_relation_data,
+        )
+
+    @staticmethod
+    def _local_writes(writes) -> int:
+        """Number of writes to the requirer's own databag, as opposed to the harness'."""
+        return len([c for c in writes.call_args_list if c.args[1].name == "requirer"])
+
+    def test_bucket_is_requested_once(self):
+        with self._count_writes() as writes:
+            rel_id = self.harness.add_relation("s3", "s3proxy")
+            for unit in range(3):
+                self.harness.add_relation_unit(rel_id, f"s3proxy/{unit}")
+            # The provider publishes in several steps, as the s3proxy charm does
+            # on refresh and again once the bucket exists.
+            self.harness.update_relation_data(
+                rel_id, "s3proxy", {"endpoint": PROVIDER_DATA["endpoint"]}
+            )
+            self.harness.update_relation_data(rel_id, "s3proxy", PROVIDER_DATA)
+            self.harness.update_relation_data(
+                rel_id, "s3proxy", dict(PROVIDER_DATA, endpoint="http://other:8080")
+            )
+
+        # Each requirer write would fire relation-changed on the provider; only
+        # the initial bucket request should have been written.
+        self.assertEqual(self._local_writes(writes), 1)
+        self.assertEqual(self.harness.charm.relation_changed, 3)
+        self.assertEqual(self.harness.charm.ready, ["http://s3proxy:8080", "http://other:8080"])
+        self.assertEqual(
+            self.harness.get_relation_data(rel_id, "requirer"), {"bucket": "requirer"}
+        )
+
+    def test_changed_bucket_is_requested_again(self):
+        rel_id = self.harness.add_relation("s3", "s3proxy")
+        self.harness.charm.object_storage.bucket = "renamed"
+
+        with self._count_writes() as writes:
+            self.harness.charm.on.upgrade_charm.emit()
+            self.harness.charm.on.leader_elected.emit()
+
+        self.assertEqual(self._local_writes(writes), 1)
+        self.assertEqual(self.harness.get_relation_data(rel_id, "requirer"), {"bucket": "renamed"})
+
+    def test_non_leader_does_not_write(self):
+        self.harness.set_leader(False)
+        with self._count_writes() as writes:
+            rel_id = self.harness.add_relation("s3", "s3proxy")
+            self.harness.add_relation_unit(rel_id, "s3proxy/0")
+        self.assertEqual(self._local_writes(writes), 0)
+
+
+class TestRequirerBucketInfo(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(RequirerCharm, meta=REQUIRER_META)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+        self.rel_id = self.harness.add_relation("s3", "s3proxy")
+        self.harness.add_relation_unit(self.rel_id, "s3proxy/0")
+        self.requirer = self.harness.charm.object_storage
+
+    def test_bucket_details_are_none_until_provided(self):
+        self.assertIsNone(self.requirer.bucket_details)
+        self.harness.update_relation_data(self.rel_id, "s3proxy", PROVIDER_DATA)
+        self.assertEqual(
+            self.requirer.bucket_details, BucketInfo.from_relation_data(PROVIDER_DATA)
+        )
+
+    def test_bucket_info_is_still_a_dict(self):
+        self.assertEqual(self.requirer.bucket_info, {})
+        self.harness.update_relation_data(self.rel_id, "s3proxy", {**PROVIDER_DATA, **HINTS})
+        self.assertEqual(self.requirer.bucket_info, {**PROVIDER_DATA, **HINTS})
+        self.assertEqual(self.requirer.bucket_info.get("endpoint"), "http://s3proxy:8080")
+
+    def test_bucket_info_is_read_once_per_dispatch(self):
+        self.harness.update_relation_data(self.rel_id, "s3proxy", PROVIDER_DATA)
+        with patch.object(
+            self.harness._backend, "relation_get", wraps=self.harness._backend.relation_get
+        ) as relation_get, patch.object(
+            object_storage, "_validate_data", wraps=object_storage._validate_data
+        ) as validate:
+            for _ in range(5):
+                self.assertEqual(self.requirer.bucket_details.endpoint, PROVIDER_DATA["endpoint"])
+        relation_get.assert_not_called()
+        validate.assert_not_called()
+
+    def test_relation_events_invalidate_the_cache(self):
+        self.harness.update_relation_data(self.rel_id, "s3proxy", PROVIDER_DATA)
+        self.assertEqual(self.requirer.bucket_details.endpoint, "http://s3proxy:8080")
+
+        self.harness.update_relation_data(self.rel_id, "s3proxy", {"endpoint": "http://new:80"})
+        self.assertEqual(self.requirer.bucket_details.endpoint, "http://new:80")
+
+        self.harness.remove_relation(self.rel_id)
+        self.assertIsNone(self.requirer.bucket_details)
+
+    def test_hints_are_surfaced(self):
+        self.harness.update_relation_data(self.rel_id, "s3proxy", {**PROVIDER_DATA, **HINTS})
+        info = self.requirer.bucket_details
+        self.assertEqual(info.s3_uri_style, "host")
+        self.assertEqual(info.max_request_size, 8 * 1024 * 1024)
+        self.assertEqual(info.recommended_concurrency, 8)
+        self.assertEqual(info.multipart_part_size, 64 * 1024 * 1024)
+        self.assertEqual(info.as_dict(), {**PROVIDER_DATA, **HINTS})
+
+    def test_ready_event_carries_hints(self):
+        self.harness.update_relation_data(self.rel_id, "s3proxy", {**PROVIDER_DATA, **HINTS})
+        event = self.harness.charm.last_ready
+        self.assertEqual(event.recommended_concurrency, 8)
+        self.assertEqual(object_storage._bucket_info(event), self.requirer.bucket_details)
+
+    def test_hints_are_optional(self):
+        self.harness.update_relation_data(self.rel_id, "s3proxy", PROVIDER_DATA)
+        self.assertIsNone(self.requirer.bucket_details.recommended_concurrency)
+
+    def test_bucket_info_is_immutable(self):
+        info = BucketInfo.from_relation_data(PROVIDER_DATA)
+        with self.assertRaises(AttributeError):
+            info.endpoint = "http://elsewhere"  # type: ignore
+        with self.assertRaises(AttributeError):
+            info.extra = 1  # type: ignore
+        self.assertEqual(info["access-key"], "access")
+        self.assertEqual(info.as_dict(), PROVIDER_DATA)
+        self.assertNotIn("secret", repr(info))
+
+    def test_bucket_info_equality_agrees_with_hash(self):
+        info = BucketInfo.from_relation_data(PROVIDER_DATA)
+        same = BucketInfo.from_relation_data(dict(PROVIDER_DATA))
+        self.assertEqual(info, same)
+        self.assertEqual(len({info, same}), 1)
+        # Both would be published as "5", but aren't the same values.
+        numeric = BucketInfo("bucket", "http://s3", "access", "secret", max_request_size=5)
+        text = BucketInfo("bucket", "http://s3", "access", "secret", max_request_size="5")  # type: ignore
+        self.assertEqual(numeric.as_dict(), text.as_dict())
+        self.assertNotEqual(numeric, text)
+        self.assertEqual(len({numeric, text}), 2)
+
+
+class TestClientFactory(unittest.TestCase):
+    def test_client_is_tuned_for_s3proxy(self):
+        client = build_s3_client(BucketInfo.from_relation_data(PROVIDER_DATA))
+        config = client.meta.config
+        self.assertEqual(client.meta.endpoint_url, "http://s3proxy:8080")
+        self.assertEqual(config.max_pool_connections, object_storage.DEFAULT_MAX_POOL_CONNECTIONS)
+        self.assertEqual(config.retries, {"mode": "adaptive", "total_max_attempts": 5})
+        self.assertEqual(config.s3, {"addressing_style": "path"})
+        self.assertTrue(config.tcp_keepalive)
+
+    def test_client_accepts_relation_data_and_overrides(self):
+        client = build_s3_client(PROVIDER_DATA, max_pool_connections=4, read_timeout=5)
+        self.assertEqual(client.meta.config.max_pool_connections, 4)
+        self.assertEqual(client.meta.config.read_timeout, 5)
+
+    def test_transfer_config(self):
+        config = build_transfer_config(max_concurrency=8)
+        self.assertEqual(config.max_request_concurrency, 8)
+        self.assertEqual(config.multipart_chunksize, object_storage.DEFAULT_MULTIPART_CHUNKSIZE)
+
+    def test_client_follows_provider_hints(self):
+        hinted = {**PROVIDER_DATA, **HINTS}
+        client = build_s3_client(hinted)
+        self.assertEqual(client.meta.config.max_pool_connections, 8)
+        self.assertEqual(client.meta.config.s3, {"addressing_style": "virtual"})
+        self.assertEqual(
+            build_s3_client(hinted, max_pool_connections=2).meta.config.max_pool_connections, 2
+        )
+
+        config = build_transfer_config(hinted)
+        self.assertEqual(config.max_request_concurrency, 8)
+        # The hinted part size is capped by the maximum request size.
+        self.assertEqual(config.multipart_chunksize, 8 * 1024 * 1024)
+        self.assertEqual(config.multipart_threshold, 8 * 1024 * 1024)
+
+    def test_missing_boto3(self):
+        with patch.object(object_storage, "boto3", None):
+            with self.assertRaises(object_storage.MissingDependencyError):
+                build_s3_client(PROVIDER_DATA)
+
+
+class MotoServerMixin:
+    """Runs a local moto server, standing in for s3proxy, for the test class."""
+
+    @classmethod
+    def setUpClass(cls):
+        from moto.server import ThreadedMotoServer
+
+        cls.server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.info = BucketInfo("bucket", f"http://{host}:{port}", "access", "secret")
+        build_s3_client(cls.info).create_bucket(Bucket="bucket")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+
+@unittest.skipUnless(HAS_MOTO_SERVER, "needs aiobotocore and moto[server]")
+class TestAsyncClient(MotoServerMixin, unittest.IsolatedAsyncioTestCase):
+
+    async def test_bulk_put_get_list(self):
+        objects = {f"prefix/{i:03}": f"body {i}".encode() for i in range(40)}
+        async with AsyncObjectStorageClient(self.info, concurrency=8) as s3:
+            await s3.put_many(objects)
+            await s3.put("other", b"x")
+
+            keys = await s3.list_keys(prefix="prefix/")
+            self.assertEqual(sorted(keys), sorted(objects))
+            self.assertEqual(await s3.get_many(keys), objects)
+
+    async def test_concurrency_is_bounded(self):
+        in_flight = peak = 0
+
+        async with AsyncObjectStorageClient(self.info, concurrency=4) as s3:
+            real_put = s3.put
+
+            async def put(*args, **kwargs):
+                nonlocal in_flight, peak
+                in_flight += 1
+                peak = max(peak, in_flight)
+                try:
+                    await real_put(*args, **kwargs)
+                finally:
+                    in_flight -= 1
+
+            s3.put = put  # type: ignore
+            await s3.put_many((f"bounded/{i}", b"x") for i in range(20))
+
+        self.assertEqual(peak, 4)
+
+    def test_missing_aiobotocore(self):
+        with patch.object(object_storage, "AioConfig", None):
+            with self.assertRaises(object_storage.MissingDependencyError):
+                AsyncObjectStorageClient(self.info)
+
+
+class _NonSeekable(io.RawIOBase):
+    """A pipe-like stream, which can only be read or written sequentially."""
+
+    def __init__(self, data: bytes = b""):
+        self._buffer = io.BytesIO(data)
+        self.written = io.BytesIO()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._buffer.read(len(b))
+        b[: len(chunk)] = chunk
+        return len(chunk)
+
+    def write(self, b):
+        return self.written.write(b)
+
+
+@unittest.skipUnless(HAS_MOTO_SERVER, "needs moto[server]")
+class TestTransferHelpers(MotoServerMixin, unittest.TestCase):
+    PART_SIZE = 5 * 1024 * 1024  # the smallest part S3 accepts
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def test_directory_round_trip(self):
+        src = self.tmp / "src"
+        (src / "nested" / "deeper").mkdir(parents=True)
+        files = {
+            "small.txt": b"small",
+            "nested/large.bin": os.urandom(2 * self.PART_SIZE + 123),
+            "nested/deeper/empty": b"",
+        }
+        for name, data in files.items():
+            (src / name).write_bytes(data)
+
+        progress = []
+        stats = upload_directory(
+            self.info, src, "dataset/", part_size=self.PART_SIZE, progress=progress.append
+        )
+        total = sum(len(d) for d in files.values())
+        self.assertEqual((stats.objects, stats.bytes), (3, total))
+        self.assertEqual(progress[-1], total)
+        self.assertGreater(stats.throughput, 0)
+
+        dst = self.tmp / "dst"
+        stats = download_directory(self.info, dst, "dataset/", part_size=self.PART_SIZE)
+        self.assertEqual((stats.objects, stats.bytes), (3, total))
+        for name, data in files.items():
+            self.assertEqual((dst / name).read_bytes(), data)
+
+    def test_download_with_a_prefix_without_a_slash(self):
+        client = build_s3_client(self.info)
+        for key in ("models/a.bin", "models/sub/b.bin"):
+            client.put_object(Bucket="bucket", Key=key, Body=key.encode())
+        dst = self.tmp / "models"
+        stats = download_directory(self.info, dst, "models")
+        self.assertEqual(stats.objects, 2)
+        self.assertEqual((dst / "a.bin").read_bytes(), b"models/a.bin")
+        self.assertEqual((dst / "sub" / "b.bin").read_bytes(), b"models/sub/b.bin")
+
+        stats = download_directory(self.info, self.tmp / "one", "models/a.bin")
+        self.assertEqual((self.tmp / "one" / "a.bin").read_bytes(), b"models/a.bin")
+
+    def test_download_refuses_to_escape_directory(self):
+        client = build_s3_client(self.info)
+        client.put_object(Bucket="bucket", Key="escape/../../outside", Body=b"x")
+        with self.assertRaises(ValueError):
+            download_directory(self.info, self.tmp / "dst", "escape/")
+
+    def test_stream_round_trip(self):
+        data = os.urandom(self.PART_SIZE + 1)
+        stats = upload_stream(self.info, _NonSeekable(data), "stream", part_size=self.PART_SIZE)
+        self.assertEqual(stats.bytes, len(data))
+
+        out = _NonSeekable()
+        stats = download_stream(self.info, "stream", out, part_size=self.PART_SIZE)
+        self.assertEqual(stats.bytes, len(data))
+        self.assertEqual(out.written.getvalue(), data)
@@ -0,0 +1,128 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import base64
+import errno
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import scrub
+from jobs import load_state
+from metrics_exporter import format_metrics
+from scrub import Scrub, corrupt_objects, metrics, stored_md5
+
+
+class TestScrub(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.basedir = Path(tmp.name) / "blobstore"
+        self.state = Path(tmp.name) / "scrub" / "state.json"
+        self.basedir.mkdir()
+
+    def _object(self, path: str, data: bytes, md5=None):
+        file = self.basedir / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(data)
+        if md5 is not False:
+            # As jclouds' filesystem provider writes it, through Java's user-defined attributes.
+            os.setxattr(file, "user.user.content-md5", md5 or hashlib.md5(data).digest())
+        return file
+
+    def test_mismatches_are_reported(self):
+        self._object("logs/a", b"a" * 100)
+        self._object("logs/dir/b", b"b")
+        self._object("logs/dir/c", b"c", md5=hashlib.md5(b"not c").digest())
+        self._object("other/d", b"d", md5=False)
+        run = Scrub(self.basedir, self.state, workers=3)()
+        self.assertEqual(
+            {k: run[k] for k in ("objects", "bytes", "unverified", "mismatched")},
+            {"objects": 4, "bytes": 103, "unverified": 1, "mismatched": 1},
+        )
+        self.assertEqual(
+            run["mismatches"],
+            [
+                {
+                    "object": "logs/dir/c",
+                    "expected": hashlib.md5(b"not c").hexdigest(),
+                    "actual": hashlib.md5(b"c").hexdigest(),
+                }
+            ],
+        )
+        state = load_state(self.state)
+        self.assertEqual(state["runs"], [run])
+        self.assertEqual(corrupt_objects(state), 1)
+
+    def test_unreadable_objects_are_corrupt(self):
+        self._object("logs/a", b"a")
+
+        class Failing(io.FileIO):
+            def __init__(self, path, mode, buffering):
+                super().__init__(path, mode)
+
+            def readinto(self, buffer):
+                raise OSError(errno.EIO, "Input/output error")
+
+        with patch("scrub.open", Failing, create=True):
+            run = Scrub(self.basedir, self.state)()
+        self.assertEqual(
+            run["mismatches"],
+            [
+                {
+                    "object": "logs/a",
+                    "expected": hashlib.md5(b"a").hexdigest(),
+                    "actual": "Input/output error",
+                }
+            ],
+        )
+
+    def test_interrupted_scrubs_resume(self):
+        for i in range(6):
+            self._object(f"bucket/{i}", bytes([i]), md5=None if i != 4 else b"\0" * 16)
+        verify = Scrub._verify
+        verified = []
+
+        def crash_after_three(scrub, path):
+            if len(verified) == 3:
+                raise KeyboardInterrupt
+            verified.append(path)
+            return verify(scrub, path)
+
+        with patch.object(scrub, "CHECKPOINT_SECONDS", 0):
+            with patch.object(Scrub, "_verify", crash_after_three):
+                with self.assertRaises(KeyboardInterrupt):
+                    Scrub(self.basedir, self.state, workers=1)()
+            self.assertEqual(load_state(self.state)["checkpoint"]["path"], ["bucket", "2"])
+            run = Scrub(self.basedir, self.state, workers=1)()
+        self.assertEqual((run["objects"], run["mismatched"]), (6, 1))
+        self.assertNotIn("checkpoint", load_state(self.state))
+
+    def test_missing_basedir(self):
+        # As on a new unit, before any bucket is created.
+        self.basedir.rmdir()
+        run = Scrub(self.basedir, self.state)()
+        self.assertEqual((run["objects"], run["mismatched"]), (0, 0))
+        self.assertEqual(load_state(self.state)["runs"], [run])
+
+    def test_md5_encodings(self):
+        digest = hashlib.md5(b"x").digest()
+        for value in (digest, digest.hex().encode(), base64.b64encode(digest)):
+            with self.subTest(value=value):
+                file = self._object("bucket/x", b"x", md5=value)
+                self.assertEqual(stored_md5(str(file)), digest)
+        self.assertIsNone(stored_md5(str(self._object("bucket/y", b"y", md5=False))))
+
+    def test_metrics(self):
+        state = {
+            "runs": [{"finished": 10, "objects": 5, "unverified": 1, "mismatched": 2}],
+            "checkpoint": {"path": ["a"], "run": {"bytes": 100, "mismatched": 3}},
+        }
+        text = format_metrics(metrics(state))
+        self.assertIn("s3proxy_scrub_corrupt_objects 3", text)
+        self.assertIn("s3proxy_scrub_last_run_objects 5", text)
+        self.assertIn("s3proxy_scrub_progress_bytes 100", text)
@@ -0,0 +1,102 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from snapshot import Snapshots
+
+NOW = 1_700_000_000.0
+HOUR = 60 * 60
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.basedir = Path(tmp.name) / "blobstore"
+        self.snapshots = Snapshots(self.basedir, Path(tmp.name) / "snapshots")
+        self.now = NOW
+
+    def _object(self, path: str, data: bytes):
+        """Write an object as s3proxy does: to a new file renamed in place."""
+        file = self.basedir / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = file.parent.parent / f".{file.name}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, file)
+
+    def _take(self, keep: int = 0):
+        self.now += HOUR
+        # Directories changed in the last moments before a snapshot aren't trusted, so
+        # make them look older than that, as they would in a real deployment.
+        for directory in [self.basedir, *self.basedir.rglob("*")]:
+            mtime = directory.stat().st_mtime_ns
+            if directory.is_dir() and mtime > (self.now - 10) * 1e9:
+                os.utime(directory, ns=(mtime, int((self.now - 60) * 1e9)))
+        return self.snapshots.take(keep, now=self.now)
+
+    def _tree(self, root: Path):
+        return {str(p.relative_to(root)): p.read_bytes() for p in root.rglob("*") if p.is_file()}
+
+    def test_unchanged_files_are_linked(self):
+        self._object("logs/a", b"a")
+        self._object("logs/dir/b", b"b")
+        self._object("other/c", b"c")
+        first = self._take()
+        self.assertEqual((first.linked, first.copied, first.copied_bytes), (0, 3, 3))
+
+        self._object("logs/dir/b", b"b2")
+        self._object("logs/new", b"new")
+        (self.basedir / "other" / "c").unlink()
+        second = self._take()
+        self.assertEqual((second.linked, second.copied), (1, 2))
+
+        root = self.snapshots.snapshot_dir
+        self.assertEqual(
+            self._tree(root / first.name), {"logs/a": b"a", "logs/dir/b": b"b", "other/c": b"c"}
+        )
+        self.assertEqual(self._tree(root / second.name), self._tree(self.basedir))
+        self.assertEqual(
+            os.stat(root / first.name / "logs" / "a").st_ino,
+            os.stat(root / second.name / "logs" / "a").st_ino,
+        )
+        # The live blobstore is never linked into, only copied from.
+        self.assertEqual(os.stat(self.basedir / "logs" / "a").st_nlink, 1)
+
+    def test_unchanged_directories_are_not_scanned(self):
+        for i in range(3):
+            self._object(f"logs/{i}/object", b"x" * 10)
+        self._take()
+        self._object("logs/1/object", b"changed")
+        result = self._take()
+        self.assertEqual((result.linked, result.copied, result.copied_bytes), (2, 1, 7))
+
+    def test_recent_directories_are_scanned_again(self):
+        self._object("logs/a", b"a")
+        self.now += HOUR
+        self.snapshots.take(0, now=self.now)
+        # Written in the same instant, which the directory's mtime can't tell.
+        self._object("logs/b", b"b")
+        result = self._take()
+        self.assertEqual((result.linked, result.copied), (1, 1))
+
+    def test_old_snapshots_are_pruned(self):
+        self._object("logs/a", b"a")
+        names = [self._take(keep=2).name for _ in range(4)]
+        self.assertEqual(self.snapshots.names(), names[2:])
+        self.assertEqual(
+            sorted(p.name for p in self.snapshots.snapshot_dir.iterdir()),
+            sorted(names[2:] + [f"{name}.json" for name in names[2:]]),
+        )
+
+    def test_partial_snapshots_are_discarded(self):
+        self._object("logs/a", b"a")
+        partial = self.snapshots.snapshot_dir / ".19700101T000000Z.partial"
+        partial.mkdir(parents=True)
+        self.assertEqual(self.snapshots.names(), [])
+        result = self._take()
+        self.assertEqual(self.snapshots.names(), [result.name])
+        self.assertFalse(partial.exists())
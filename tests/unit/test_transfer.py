@@ -0,0 +1,126 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest.mock import patch
+
+import transfer
+from transfer import MANIFEST, Checkpoint, Transfer
+
+OBJECTS = {"a": b"x" * 10, "dir/b": b"y" * 3000, "dir/sub/c": b"", "d.e": b"z"}
+
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.source = self.tmp / "source"
+        self.target = self.tmp / "target"
+        for key, data in OBJECTS.items():
+            path = self.source / "bucket" / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            os.utime(path, (1_600_000_000, 1_600_000_000))
+        os.setxattr(self.source / "bucket" / "a", "user.content-type", b"text/plain")
+        self.stdout = io.StringIO()
+        redirect = redirect_stdout(self.stdout)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def _transfer(self, basedir: Path, path: Path, bucket: str = "bucket") -> Transfer:
+        return Transfer(basedir, bucket, path, basedir.parent / f"{basedir.name}-work", 3)
+
+    def _objects(self, root: Path):
+        return {str(p.relative_to(root)): p.read_bytes() for p in root.rglob("*") if p.is_file()}
+
+    def _assert_imported(self):
+        bucket = self.target / "copy"
+        self.assertEqual(self._objects(bucket), OBJECTS)
+        self.assertEqual(os.getxattr(bucket / "a", "user.content-type"), b"text/plain")
+        self.assertEqual(os.stat(bucket / "dir" / "b").st_mtime, 1_600_000_000)
+        self.assertEqual(list((self.tmp / "target-work" / "staging").iterdir()), [])
+
+    def test_directory_round_trip(self):
+        export = self.tmp / "export"
+        self._transfer(self.source, export).export_directory()
+        self.assertEqual(self._objects(export / "objects"), OBJECTS)
+        records = [json.loads(line) for line in (export / MANIFEST).read_text().splitlines()]
+        # In the blobstore's walk order: a directory's objects come where its name does.
+        self.assertEqual([r["key"] for r in records], ["a", "d.e", "dir/b", "dir/sub/c"])
+        self.assertEqual(records[0]["xattrs"], {"user.content-type": "dGV4dC9wbGFpbg=="})
+
+        self._transfer(self.target, export, "copy").import_directory()
+        self._assert_imported()
+        last = json.loads(self.stdout.getvalue().splitlines()[-1])
+        self.assertEqual(last, {"objects": 4, "bytes": 3011, "done": True})
+
+    def test_tar_round_trip(self):
+        archive = self.tmp / "export.tar"
+        self._transfer(self.source, archive).export_tar()
+        with tarfile.open(archive) as tar:
+            self.assertEqual(tar.getnames(), ["a", "d.e", "dir/b", "dir/sub/c"])
+            self.assertEqual(
+                tar.getmember("a").pax_headers["SCHILY.xattr.user.content-type"], "text/plain"
+            )
+
+        self._transfer(self.target, archive, "copy").import_tar()
+        self._assert_imported()
+
+    def test_interrupted_transfers_resume(self):
+        for fmt, path in (("tar", self.tmp / "export.tar"), ("directory", self.tmp / "export")):
+            with self.subTest(format=fmt):
+                for direction, basedir, bucket in (
+                    ("export", self.source, "bucket"),
+                    ("import", self.target, "copy"),
+                ):
+                    run = getattr(self._transfer(basedir, path, bucket), f"{direction}_{fmt}")
+                    done = Checkpoint.done
+
+                    def crash_after_two(checkpoint, size, **position):
+                        done(checkpoint, size, **position)
+                        checkpoint.save(**position)
+                        if checkpoint.objects == 2:
+                            raise KeyboardInterrupt
+
+                    with patch.object(Checkpoint, "done", crash_after_two):
+                        with self.assertRaises(KeyboardInterrupt):
+                            run()
+                    run()
+                    self.assertEqual(
+                        list((basedir.parent / f"{basedir.name}-work").glob("*.json")), []
+                    )
+
+                self._assert_imported()
+                last = json.loads(self.stdout.getvalue().splitlines()[-1])
+                self.assertEqual(last["objects"], 4)
+
+    def test_unsafe_keys_are_refused(self):
+        export = self.tmp / "export"
+        export.mkdir()
+        (export / MANIFEST).write_text(json.dumps({"key": "../escape", "size": 0, "mtime": 0}))
+        with self.assertRaises(ValueError):
+            self._transfer(self.target, export, "copy").import_directory()
+        with self.assertRaises(ValueError):
+            self._transfer(self.target, export, "..")
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_saved_at_intervals(self):
+        with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+            path = Path(tmp) / "checkpoint.json"
+            checkpoint = Checkpoint(path)
+            checkpoint.done(10, offset=1)
+            self.assertFalse(path.exists())
+            with patch.object(transfer, "CHECKPOINT_SECONDS", 0):
+                checkpoint.done(5, offset=2)
+            self.assertEqual(Checkpoint(path).state, {"offset": 2, "objects": 2, "bytes": 15})
+            checkpoint.finish()
+            self.assertFalse(path.exists())
@@ -0,0 +1,77 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from metrics_exporter import format_metrics
+from usage import BucketUsage, Usage, metrics
+
+
+class TestBucketUsage(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.basedir = Path(tmp.name) / "blobstore"
+        self.index = BucketUsage(self.basedir, Path(tmp.name) / "usage")
+
+    def _object(self, path: str, size: int):
+        file = self.basedir / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(b"x" * size)
+
+    def _age(self):
+        """Backdate recently modified directories, for their mtimes to be trusted."""
+        recent = (time.time() - 30) * 1e9
+        for directory in [self.basedir, *self.basedir.rglob("*")]:
+            mtime = directory.stat().st_mtime_ns
+            if directory.is_dir() and mtime > recent:
+                os.utime(directory, ns=(mtime, mtime - 60 * 10**9))
+
+    def test_usage_per_bucket(self):
+        self._object("a/one", 10)
+        self._object("a/dir/two", 20)
+        self._object("a/dir/sub/three", 30)
+        self._object("b/one", 5)
+        (self.basedir / "empty").mkdir()
+
+        self.assertEqual(
+            list(self.index.update()),
+            [Usage("a", 3, 60, 3, 3), Usage("b", 1, 5, 1, 1), Usage("empty", 0, 0, 1, 1)],
+        )
+        self.assertEqual(list(self.index.update(["b"])), [Usage("b", 1, 5, 1, 1)])
+
+    def test_only_changed_directories_are_listed(self):
+        for i in range(5):
+            self._object(f"a/{i}/object", 10)
+        self._age()
+        self.assertEqual(list(self.index.update()), [Usage("a", 5, 50, 6, 6)])
+        self.assertEqual(list(self.index.update()), [Usage("a", 5, 50, 6, 0)])
+
+        self._object("a/3/new", 7)
+        (self.basedir / "a" / "1" / "object").unlink()
+        self._age()
+        self.assertEqual(list(self.index.update()), [Usage("a", 5, 47, 6, 2)])
+
+    def test_recently_changed_directories_are_listed_again(self):
+        self._object("a/object", 10)
+        list(self.index.update())
+        self.assertEqual(list(self.index.update())[0].listed, 1)
+
+    def test_deleted_buckets_are_forgotten(self):
+        self._object("a/object", 10)
+        self._object("b/object", 10)
+        list(self.index.update())
+        (self.basedir / "b" / "object").unlink()
+        (self.basedir / "b").rmdir()
+        self.assertEqual([u.bucket for u in self.index.update()], ["a"])
+        self.assertEqual([p.name for p in self.index.index_dir.iterdir()], ["a.json"])
+        self.assertEqual(list(self.index.update(["b"])), [Usage("b", 0, 0, 0, 0)])
+
+    def test_metrics(self):
+        text = format_metrics(metrics([Usage("a", 3, 60, 1, 1)]))
+        self.assertIn('s3proxy_bucket_objects{bucket="a"} 3\n', text)
+        self.assertIn('s3proxy_bucket_size_bytes{bucket="a"} 60\n', text)